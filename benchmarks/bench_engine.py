@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""Measures the host engine (manifest loading, post-processing, initialization & scheduling) on synthetic manifests.
+
+Each scenario generates a manifest of a given shape & size, and runs 'Manifest' and 'Executor' against a fake Docker
+invoker (which answers "init" & "state" invocations after a configurable latency, without running anything). Every
+scenario runs in a separate process, so that its peak RSS is its own. Shapes are:
+
+  - wide:    independent resources
+  - deep:    a single dependency chain
+  - diamond: levels of 4 resources, each depending on all resources of the previous level
+
+Every resource config contains templated strings referencing variables & dependencies' state ("heavy templating").
+
+Usage (from the repository root):
+
+    PYTHONPATH=./src python3 ./benchmarks/bench_engine.py [--shapes wide,deep,diamond] [--sizes 10,100,1000,5000]
+        [--latency SECONDS] [--parallelism N] [--templates N] [--output FILE]
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Sequence, Tuple
+
+import yaml
+
+from context import Context, ConfirmationMode
+from docker import DockerInvoker
+from executor import Executor
+from manifest import Manifest, Resource
+from util import Logger
+
+
+class FakeDockerInvoker(DockerInvoker):
+
+    def __init__(self, latency: float, volumes: Sequence[str] = None) -> None:
+        super().__init__(volumes)
+        self._latency: float = latency
+        self.invocations: int = 0
+        self._lock: threading.Lock = threading.Lock()
+
+    def inspect_image_id(self, image: str) -> None:
+        return None
+
+    def pull(self, image: str) -> None:
+        pass
+
+    def _invoke(self,
+                local_work_dir: Path,
+                container_work_dir: str,
+                image: str,
+                entrypoint: str = None,
+                args: Sequence[str] = None,
+                input: dict = None,
+                stderr_logger: Logger = None,
+                stdout_logger: Logger = None) -> Tuple[int, str, str]:
+        with self._lock:
+            self.invocations += 1
+        if self._latency:
+            time.sleep(self._latency)
+        if args == ['state']:
+            return 0, json.dumps({'status': 'VALID', 'state': {'value': input['name']}}), ''
+        else:
+            return 0, json.dumps({'state_action': {'args': ['state']}}), ''
+
+
+def generate_resources(shape: str, size: int, templates: int) -> dict:
+    def config(dependencies: Sequence[str]) -> dict:
+        values: dict = {f"static{i}": f"value{i}" for i in range(templates)}
+        for i in range(templates):
+            values[f"templated{i}"] = f"{{{{ prefix }}}}-{i}"
+        for index, dependency in enumerate(dependencies[0:3]):
+            values[f"dependency{index}"] = f"{{{{ d{index}.state.value }}}}"
+        return {'labels': values, 'items': [f"{{{{ prefix }}}}-item-{i}" for i in range(templates)]}
+
+    resources: dict = {}
+    for i in range(size):
+        if shape == 'wide':
+            dependencies: Sequence[str] = []
+        elif shape == 'deep':
+            dependencies: Sequence[str] = [f"r{i - 1}"] if i else []
+        elif shape == 'diamond':
+            level: int = i // 4
+            dependencies: Sequence[str] = [f"r{j}" for j in range((level - 1) * 4, level * 4)] if level else []
+        else:
+            raise ValueError(f"unknown shape: {shape}")
+        resources[f"r{i}"] = {
+            'type': 'bench/resource:1',
+            'dependencies': {f"d{index}": dependency for index, dependency in enumerate(dependencies)},
+            'config': config(dependencies)
+        }
+    return resources
+
+
+def run_scenario(shape: str, size: int, latency: float, parallelism: int, templates: int, work_dir: str,
+                 results: multiprocessing.Queue) -> None:
+    scenario_dir: Path = Path(work_dir) / f"{shape}-{size}"
+    shutil.rmtree(str(scenario_dir), ignore_errors=True)
+    os.makedirs(str(scenario_dir))
+    manifest_file: Path = scenario_dir / 'manifest.yaml'
+    with manifest_file.open('w') as f:
+        f.write(yaml.dump({'resources': generate_resources(shape, size, templates)}))
+
+    context: Context = Context(env={
+        "CONF_DIR": str(scenario_dir / 'conf'),
+        "WORKSPACE_DIR": str(scenario_dir / 'workspace'),
+        "WORK_DIR": str(scenario_dir / 'work')
+    })
+    context.confirm = ConfirmationMode.NO
+    context.parallelism = parallelism
+    context.init_cache = False
+    context.manifest_cache = False
+    context.add_variable('prefix', 'bench')
+
+    invoker: FakeDockerInvoker = FakeDockerInvoker(latency=latency)
+    phases: dict = {}
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        wall_start: float = time.perf_counter()
+        cpu_start: float = time.process_time()
+
+        start: float = time.perf_counter()
+        manifest: Manifest = Manifest(context=context, manifest_files=[manifest_file],
+                                      resource_factory=lambda **kwargs: Resource(docker_invoker=invoker, **kwargs))
+        phases['load'] = time.perf_counter() - start
+
+        executor: Executor = Executor(manifest=manifest, docker_invoker=invoker)
+        start = time.perf_counter()
+        executor._initialize_resources(logger=Logger())
+        phases['init'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        executor.execute()
+        phases['execute'] = time.perf_counter() - start
+
+        wall: float = time.perf_counter() - wall_start
+        cpu: float = time.process_time() - cpu_start
+
+    # ru_maxrss is in kilobytes on Linux, but in bytes on macOS
+    max_rss: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put({
+        'shape': shape,
+        'size': size,
+        'latency': latency,
+        'parallelism': parallelism,
+        'templates': templates,
+        'wall_s': round(wall, 3),
+        'cpu_s': round(cpu, 3),
+        'load_s': round(phases['load'], 3),
+        'init_s': round(phases['init'], 3),
+        'execute_s': round(phases['execute'], 3),
+        'peak_rss_mb': round(max_rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1),
+        'invocations': invoker.invocations,
+        'invocations_per_s': round(invoker.invocations / wall, 1)
+    })
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Host engine benchmark")
+    argparser.add_argument('--shapes', default='wide,deep,diamond', help='comma-separated manifest shapes')
+    argparser.add_argument('--sizes', default='10,100,1000,5000', help='comma-separated resource counts')
+    argparser.add_argument('--latency', type=float, default=0.0, help='fake invocation latency (seconds)')
+    argparser.add_argument('--parallelism', type=int, default=8, help='executor parallelism (default is 8)')
+    argparser.add_argument('--templates', type=int, default=10, help='templated strings per resource config')
+    argparser.add_argument('--work-dir', default='./benchmarks/.work/engine', help='work directory for scenarios')
+    argparser.add_argument('--output', default='./benchmarks/.work/engine.json', help='JSON results file')
+    args = argparser.parse_args()
+
+    results: list = []
+    print(f"{'shape':<9}{'size':>6}{'wall (s)':>10}{'cpu (s)':>9}{'load (s)':>10}{'init (s)':>10}"
+          f"{'exec (s)':>10}{'rss (MB)':>10}{'calls/s':>10}")
+    for shape in args.shapes.split(','):
+        for size in [int(size) for size in args.sizes.split(',')]:
+            queue: multiprocessing.Queue = multiprocessing.Queue()
+            process = multiprocessing.Process(target=run_scenario,
+                                              args=(shape, size, args.latency, args.parallelism, args.templates,
+                                                    args.work_dir, queue))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                raise SystemExit(f"scenario '{shape}' of {size} resources failed (exit code {process.exitcode})")
+            result: dict = queue.get()
+            results.append(result)
+            print(f"{shape:<9}{size:>6}{result['wall_s']:>10.3f}{result['cpu_s']:>9.3f}{result['load_s']:>10.3f}"
+                  f"{result['init_s']:>10.3f}{result['execute_s']:>10.3f}{result['peak_rss_mb']:>10.1f}"
+                  f"{result['invocations_per_s']:>10.1f}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        f.write(json.dumps({'results': results}, indent=2))
+    print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
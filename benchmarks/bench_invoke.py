@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""Measures the per-invocation overhead of DockerInvoker's process handling.
+
+Runs the real 'DockerInvoker._invoke' against a local process (see 'MockProcessDockerInvoker') instead of a Docker
+container, and compares it with running the very same process directly via 'subprocess.run'. The difference is the
+overhead added by the invoker itself (output threads, work-dir files, waiting for the process, etc).
+
+The same process is also run through the legacy invocation path (see 'legacy_invoke'), which polled the process for
+completion every second, so that the improvement over it can be reproduced.
+
+Usage (from the repository root):
+
+    PYTHONPATH=./src:./resources/src:./tests python3 ./benchmarks/bench_invoke.py [--iterations N]
+"""
+
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import time
+from io import TextIOWrapper
+from pathlib import Path
+from statistics import mean
+from subprocess import Popen, PIPE
+from threading import Thread
+from typing import Sequence
+
+from mock_external_services import MockProcessDockerInvoker
+from util import Logger
+
+
+def measure_raw(invoker: MockProcessDockerInvoker, input: str, iterations: int) -> float:
+    cmd = invoker._command(container_work_dir='/', image='bench')
+    durations = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        subprocess.run(cmd, input=input, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        durations.append(time.perf_counter() - start)
+    return mean(durations)
+
+
+def legacy_invoke(cmd: Sequence[str], input: dict, work_dir: Path) -> int:
+    """The invocation path of 'DockerInvoker._invoke' before it waited for its process: output is written to files by
+    threads, while the process is polled for completion every second."""
+    timestamp = datetime.datetime.utcnow().isoformat("T") + "Z"
+    os.makedirs(str(work_dir), exist_ok=True)
+    with open(work_dir / f"stdin-{timestamp}.json", 'w') as f:
+        f.write(json.dumps(input, indent=2))
+
+    process = Popen(cmd, shell=False, stdin=PIPE, stdout=PIPE, stderr=PIPE, universal_newlines=True)
+
+    def handler(stream: TextIOWrapper, file: Path):
+        with open(file, 'w') as f:
+            for line in iter(stream.readline, ''):
+                f.write(line[0:len(line) - 1] + '\n')
+
+    threads = [Thread(target=handler, kwargs={'stream': process.stderr, 'file': work_dir / f"stderr-{timestamp}.json"},
+                      daemon=True),
+               Thread(target=handler, kwargs={'stream': process.stdout, 'file': work_dir / f"stdout-{timestamp}.json"},
+                      daemon=True)]
+    for thread in threads:
+        thread.start()
+
+    process.stdin.write(json.dumps(input, indent=2))
+    process.stdin.close()
+    while process.poll() is None:
+        time.sleep(1)
+    for thread in threads:
+        thread.join()
+    return process.returncode
+
+
+def measure_legacy(invoker: MockProcessDockerInvoker, input: dict, iterations: int, work_dir: Path) -> float:
+    cmd = invoker._command(container_work_dir='/', image='bench')
+    durations = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        legacy_invoke(cmd, input, work_dir)
+        durations.append(time.perf_counter() - start)
+    return mean(durations)
+
+
+def measure_invoker(invoker: MockProcessDockerInvoker, input: dict, iterations: int, work_dir: Path) -> float:
+    durations = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        invoker.run_json(logger=Logger(), local_work_dir=work_dir, container_work_dir='/', image='bench', input=input)
+        durations.append(time.perf_counter() - start)
+    return mean(durations)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="DockerInvoker per-invocation overhead benchmark")
+    argparser.add_argument('--iterations', type=int, default=10, help='invocations per scenario (default is 10)')
+    argparser.add_argument('--work-dir', default='./benchmarks/.work/invoke', help='work directory for invocations')
+    args = argparser.parse_args()
+
+    input: dict = {'name': 'bench', 'type': 'bench', 'config': {f"key{i}": f"value{i}" for i in range(100)}}
+    results: list = []
+    for duration in [0.0, 0.2]:
+        invoker = MockProcessDockerInvoker(duration=duration)
+        raw: float = measure_raw(invoker, json.dumps(input), args.iterations)
+        invoked: float = measure_invoker(invoker, input, args.iterations, Path(args.work_dir))
+        legacy: float = measure_legacy(invoker, input, args.iterations, Path(args.work_dir))
+        results.append({
+            'process_duration_ms': duration * 1000,
+            'raw_process_ms': round(raw * 1000, 1),
+            'invoker_ms': round(invoked * 1000, 1),
+            'overhead_ms': round((invoked - raw) * 1000, 1),
+            'legacy_ms': round(legacy * 1000, 1),
+            'legacy_overhead_ms': round((legacy - raw) * 1000, 1)
+        })
+
+    print(f"{'process (ms)':>14}{'raw (ms)':>12}{'invoker (ms)':>15}{'overhead (ms)':>16}{'legacy (ms)':>14}"
+          f"{'legacy overhead (ms)':>23}")
+    for result in results:
+        print(f"{result['process_duration_ms']:>14.0f}{result['raw_process_ms']:>12.1f}"
+              f"{result['invoker_ms']:>15.1f}{result['overhead_ms']:>16.1f}{result['legacy_ms']:>14.1f}"
+              f"{result['legacy_overhead_ms']:>23.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Measures 'util.post_process' on a large (10k leaves by default) configuration, of which only a small fraction of
+strings is templated - similar to big ConfigMap or Deployment manifests.
+
+Compares rendering with a plan computed once up-front (as resources do) against analyzing on every call, and against
+a reference walk that copies every container (the previous behavior). Reports time & peak allocations per render.
+
+Usage (from the repository root):
+
+    PYTHONPATH=./src python3 ./benchmarks/bench_post_process.py [--leaves N] [--templated-ratio R] [--iterations N]
+"""
+
+import argparse
+import time
+import tracemalloc
+from statistics import mean
+from typing import Any, Callable
+
+from util import analyze_templates, post_process
+
+
+def generate_config(leaves: int, templated_ratio: float) -> dict:
+    # 100 "documents" of equal size, each made of nested dicts & lists; every N-th leaf is templated
+    every: int = max(1, round(1 / templated_ratio)) if templated_ratio > 0 else leaves + 1
+    config: dict = {}
+    per_document: int = max(1, leaves // 100)
+    leaf: int = 0
+    for doc in range(100):
+        items: list = []
+        for i in range(per_document // 10):
+            entry: dict = {}
+            for j in range(10):
+                entry[f"key{j}"] = f"{{{{ prefix }}}}-{leaf}" if leaf % every == 0 else f"value-{leaf}"
+                leaf += 1
+            items.append({'metadata': {'labels': entry}})
+        config[f"document{doc}"] = {'kind': 'ConfigMap', 'items': items}
+    return config
+
+
+def full_copy(value: Any, context: dict) -> Any:
+    # reference: the previous behavior, which copied every dict & list regardless of whether it was templated
+    if isinstance(value, str):
+        return post_process(value, context) if analyze_templates(value) else value
+    elif isinstance(value, dict):
+        return {k: full_copy(v, context) for k, v in value.items()}
+    elif isinstance(value, list):
+        return [full_copy(item, context) for item in value]
+    else:
+        return value
+
+
+def measure(render: Callable[[], Any], iterations: int) -> dict:
+    render()  # warm up (eg. template compilation)
+    durations: list = []
+    peaks: list = []
+    for i in range(iterations):
+        tracemalloc.start()
+        start = time.perf_counter()
+        render()
+        durations.append(time.perf_counter() - start)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return {'ms': round(mean(durations) * 1000, 1), 'peak_kb': round(mean(peaks) / 1024, 1)}
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="post_process benchmark")
+    argparser.add_argument('--leaves', type=int, default=10000, help='number of leaves in the config')
+    argparser.add_argument('--templated-ratio', type=float, default=0.01, help='ratio of templated leaves')
+    argparser.add_argument('--iterations', type=int, default=10, help='renders per scenario (default is 10)')
+    args = argparser.parse_args()
+
+    config: dict = generate_config(args.leaves, args.templated_ratio)
+    context: dict = {'prefix': 'p'}
+    plan: Any = analyze_templates(config)
+    assert post_process(config, context, plan) == full_copy(config, context)
+
+    results: dict = {
+        'full copy (previous)': measure(lambda: full_copy(config, context), args.iterations),
+        'analyze + render': measure(lambda: post_process(config, context), args.iterations),
+        'render (pre-analyzed)': measure(lambda: post_process(config, context, plan), args.iterations),
+    }
+
+    print(f"{'scenario':<24}{'time (ms)':>12}{'peak alloc (KB)':>18}")
+    for name, result in results.items():
+        print(f"{name:<24}{result['ms']:>12.1f}{result['peak_kb']:>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
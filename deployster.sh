@@ -10,6 +10,7 @@ fi
 
 # setup paths to mount
 CONF_DIR="$(mkdir -p ~/.deployster; cd ~/.deployster; pwd)"
+CACHE_DIR="$(mkdir -p ~/.deployster/cache; cd ~/.deployster/cache; pwd)"
 WORKSPACE_DIR="$(pwd)"
 WORK_DIR="$(mkdir -p ./work; cd ./work; pwd)"
 
@@ -19,6 +20,7 @@ WORK_DIR="$(mkdir -p ./work; cd ./work; pwd)"
 # run!
 docker run ${TTY_FLAGS} \
            -v ${CONF_DIR}:${CONF_DIR}:ro \
+           -v ${CACHE_DIR}:${CACHE_DIR}:rw \
            -v ${WORKSPACE_DIR}:${WORKSPACE_DIR}:ro \
            -v ${WORK_DIR}:${WORK_DIR}:rw \
            -v /var/run/docker.sock:/var/run/docker.sock \
@@ -1,9 +1,13 @@
 import argparse
+import io
 import json
+import os
 import sys
+import traceback
 from abc import ABC, abstractmethod
+from contextlib import redirect_stdout, redirect_stderr
 from pathlib import Path
-from typing import Mapping, Sequence, Any, Callable, MutableMapping
+from typing import Mapping, Sequence, Any, Callable, MutableMapping, TextIO, Union
 
 from external_services import ExternalServices
 
@@ -99,6 +103,13 @@ class DPlug:
         """The path to mount the plug in the resource Docker image when plugged into the resource."""
         return self._container_path
 
+    @property
+    def path(self) -> str:
+        """The path to access the plug at: its container path, unless remapped by Deployster (eg. when the resource is
+        executed in a host process rather than in its Docker image)."""
+        mappings: Mapping[str, str] = json.loads(os.environ.get('DEPLOYSTER_PATH_MAPPINGS', '{}'))
+        return mappings.get(self._container_path, self._container_path)
+
     @property
     def optional(self) -> bool:
         """Whether the resource can work without the plug, or whether the it's required for the resource to function."""
@@ -161,10 +172,26 @@ class DResourceInfo:
         in the deployment manifest."""
         return self._data['config']
 
+    @property
+    def combined_state(self) -> bool:
+        """Whether Deployster requested the state result as part of the "init" action (it then provides the config)."""
+        return 'combined_state' in self._data and self._data['combined_state']
+
+    @property
+    def plugs(self) -> Mapping[str, str]:
+        """The paths of plugs mounted for a combined "init" action, by plug name (Deployster cannot know the container
+        paths of the plugs requested by the resource until it's initialized, so it mounts all plugs allowed for it)."""
+        return self._data['plugs'] if 'plugs' in self._data else {}
+
     @property
     def stale_state(self) -> dict:
         return self._data['staleState']
 
+    @property
+    def emit_state(self) -> bool:
+        """Whether Deployster asked this (last "apply") action to emit the resource's new state (see 'emit_state')."""
+        return 'emit_state' in self._data and self._data['emit_state']
+
 
 class DResource(ABC):
     """
@@ -189,6 +216,7 @@ class DResource(ABC):
             "additionalProperties": True,
             "properties": {}
         }
+        self._worker_supported: bool = False
 
     @property
     def svc(self) -> ExternalServices:
@@ -205,6 +233,16 @@ class DResource(ABC):
         """Signals that this resource requests or demands this plug."""
         self._plugs[name] = DPlug(container_path=container_path, optional=optional, writable=writable)
 
+    @property
+    def worker_supported(self) -> bool:
+        """Whether this resource's image can serve its actions in worker mode (see 'serve'), and resolve the state of
+        multiple resources at once (see 'batch_state'). Set by 'resource_main'."""
+        return self._worker_supported
+
+    @worker_supported.setter
+    def worker_supported(self, value: bool) -> None:
+        self._worker_supported = value
+
     @property
     def config_schema(self) -> dict:
         """Provides the JSON schema to be used to validate resource configuration in the manifest.
@@ -257,43 +295,108 @@ class DResource(ABC):
         if args: pass
 
         plugs: dict = self._plugs
-        print(json.dumps({
+        result: dict = {
             "plugs": {plug_name: plug.to_dict() for plug_name, plug in plugs.items()},
             "config_schema": self.config_schema,
             "state_action": {
                 "args": ["state"]
             }
-        }))
-
-    @action
-    def state(self, args) -> None:
-        if args: pass
+        }
+        if self.worker_supported:
+            result['worker_action'] = {"args": ["serve"]}
+            result['batch_state_action'] = {"args": ["batch_state"]}
+
+        # state can only be discovered here if all required plugs were mounted (see 'DResourceInfo.plugs')
+        if self.info.combined_state and self.info.has_config and self._remap_mounted_plugs():
+            try:
+                result['state_result'] = self.state_result()
+            except Exception as e:
+                # config is only validated by Deployster later on; it will invoke the "state" action separately
+                print(f"State discovery during initialization failed ({e}); deferring to the 'state' action",
+                      file=sys.stderr)
+        print(json.dumps(result))
+
+    def _remap_mounted_plugs(self) -> bool:
+        """Remaps the plugs' container paths (& environment variables pointing into them, eg. credentials) to where
+        Deployster mounted them for a combined "init" action; returns False if a required plug was not mounted."""
+        mounted: Mapping[str, str] = self.info.plugs
+        if any(not plug.optional and name not in mounted for name, plug in self._plugs.items()):
+            return False
+
+        # mounted paths themselves may be remapped too (eg. to host paths, when executed in a host process)
+        mappings: Mapping[str, str] = json.loads(os.environ.get('DEPLOYSTER_PATH_MAPPINGS', '{}'))
+        plug_mappings: Mapping[str, str] = {plug.container_path: mappings.get(mounted[name], mounted[name])
+                                            for name, plug in self._plugs.items() if name in mounted}
+        for variable, value in list(os.environ.items()):
+            for container_path, path in plug_mappings.items():
+                if value == container_path or value.startswith(container_path + '/'):
+                    os.environ[variable] = path + value[len(container_path):]
+        os.environ['DEPLOYSTER_PATH_MAPPINGS'] = json.dumps(dict(mappings, **plug_mappings))
+        return True
+
+    def state_result(self) -> dict:
+        """Discovers the resource's state, returning the result of the "state" action."""
         state: dict = self.discover_state()
         if state is not None:
             actions: Sequence[DAction] = self.get_actions_for_discovered_state(state=state)
             if actions:
-                print(json.dumps({
+                return {
                     'status': 'STALE',
                     'staleState': state,
                     'actions': [action.to_dict() for action in actions]
-                }, indent=2))
+                }
             else:
-                print(json.dumps({
+                return {
                     'status': 'VALID',
                     'state': state
-                }, indent=2))
+                }
         else:
-            print(json.dumps({
+            return {
                 'status': 'STALE',
                 'actions': [action.to_dict() for action in self.get_actions_for_missing_state()]
-            }, indent=2))
+            }
+
+    def post_apply_state(self) -> Union[None, dict]:
+        """Provides the resource's state after its "apply" actions, if known to be VALID without a full discovery.
+
+        Returns None by default, in which case Deployster verifies the resource by invoking its "state" action again.
+        Subclasses that know their new state (eg. from waiting for it to become available) can return it instead."""
+        return None
+
+    def emit_state(self) -> None:
+        """Prints the resource's post-apply state (if known) as a single compact "VALID" state result line, which
+        Deployster accepts instead of invoking the "state" action again."""
+        try:
+            state: dict = self.post_apply_state()
+        except Exception as e:
+            # the action itself succeeded; Deployster will simply invoke the "state" action to verify the resource
+            print(f"Post-apply state discovery failed ({e}); deferring to the 'state' action", file=sys.stderr)
+            return
+        if state is not None:
+            print(json.dumps({'status': 'VALID', 'state': state}, separators=(',', ':')))
+
+    @classmethod
+    def batch_state_results(cls, resources: Sequence['DResource']) -> Sequence[dict]:
+        """Discovers the state of multiple resources of this class, returning their "state" action results (in order).
+
+        Resources are discovered one by one by default (sharing this process's API clients & caches); subclasses can
+        override this to discover them all at once."""
+        return [resource.state_result() for resource in resources]
+
+    @action
+    def state(self, args) -> None:
+        if args: pass
+        print(json.dumps(self.state_result(), indent=2))
 
     def execute_action(self, action_name: str,
                        action_method: Callable[['DResource', argparse.Namespace], None],
                        args: argparse.Namespace):
-        if action_name: pass
         action_method(self, args)
 
+        # the last "apply" action may report the resource's new state
+        if self.info.emit_state and action_name not in ['init', 'state']:
+            self.emit_state()
+
     def execute(self, args=sys.argv[1:]) -> None:
         argparser: argparse.ArgumentParser = argparse.ArgumentParser(description=f"Resource {self.info.name}")
         subparsers = argparser.add_subparsers()
@@ -310,3 +413,113 @@ class DResource(ABC):
 
         args = argparser.parse_args(args=args)
         self.execute_action(args.action_name, args.action_method, args)
+
+
+class _WorkerOutput(io.TextIOBase):
+    """Text stream sending every line written to it as a JSON-RPC "output" notification of the current request."""
+
+    def __init__(self, send: Callable[[dict], None], request_id: Any, stream: str) -> None:
+        super().__init__()
+        self._send: Callable[[dict], None] = send
+        self._request_id: Any = request_id
+        self._stream: str = stream
+        self._buffer: str = ''
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        self._buffer += text
+        while '\n' in self._buffer:
+            line, self._buffer = self._buffer.split('\n', 1)
+            self._send_line(line)
+        return len(text)
+
+    def _send_line(self, line: str) -> None:
+        self._send({
+            'jsonrpc': '2.0',
+            'method': 'output',
+            'params': {'id': self._request_id, 'stream': self._stream, 'line': line}
+        })
+
+    def close(self) -> None:
+        if self._buffer:
+            self._send_line(self._buffer)
+            self._buffer = ''
+        super().close()
+
+
+def batch_state(factory: Callable[[dict], DResource], inputs: Sequence[dict]) -> None:
+    """Batch "state" action: receives an array of resource data (what the "state" action would otherwise receive on
+    stdin, for each resource), and prints the array of their "state" action results (in the same order)."""
+    resources: Sequence[DResource] = [factory(data) for data in inputs]
+    print(json.dumps(type(resources[0]).batch_state_results(resources) if resources else []))
+
+
+def serve(factory: Callable[[dict], DResource], input: TextIO = None, output: TextIO = None) -> None:
+    """Worker mode: serves action invocations as newline-delimited JSON-RPC 2.0 requests, until stdin is closed.
+
+    Each request's method is the action name, and its params provide the resource data (what would otherwise be sent
+    on stdin) & extra action arguments, eg. {"jsonrpc": "2.0", "id": 1, "method": "state", "params": {"input": {...},
+    "args": []}}. Whatever the action prints is sent back as "output" notifications (one per line), followed by the
+    response, eg. {"jsonrpc": "2.0", "id": 1, "result": {"exit_code": 0}}. Imports, API clients & credentials are
+    thus reused across the invocations served by the same worker."""
+    if output is None:
+        # keep a private handle to the real stdout for the protocol, and send anything else written to it (eg. by
+        # sub-processes) to stderr instead, so it cannot corrupt the protocol
+        output = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    input = input if input is not None else sys.stdin
+
+    def send(message: dict) -> None:
+        output.write(json.dumps(message) + '\n')
+        output.flush()
+
+    for line in iter(input.readline, ''):
+        if not line.strip():
+            continue
+        try:
+            request: dict = json.loads(line)
+            request_id: Any = request['id']
+            method: str = request['method']
+            params: dict = request['params'] if 'params' in request else {}
+            data: dict = params['input']
+            args: Sequence[str] = params['args'] if 'args' in params else []
+        except (ValueError, KeyError, TypeError) as e:
+            send({'jsonrpc': '2.0', 'id': None, 'error': {'code': -32600, 'message': f"invalid request: {e}"}})
+            continue
+
+        exit_code: int = 0
+        stdout: _WorkerOutput = _WorkerOutput(send, request_id, 'stdout')
+        stderr: _WorkerOutput = _WorkerOutput(send, request_id, 'stderr')
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            try:
+                if method == 'batch_state':
+                    batch_state(factory, data)
+                else:
+                    resource: DResource = factory(data)
+                    resource.worker_supported = True
+                    resource.execute([method] + list(args))
+            except SystemExit as e:
+                exit_code = e.code if isinstance(e.code, int) else 0 if e.code is None else 1
+            except Exception:
+                traceback.print_exc()
+                exit_code = 1
+        stdout.close()
+        stderr.close()
+        send({'jsonrpc': '2.0', 'id': request_id, 'result': {'exit_code': exit_code}})
+
+
+def resource_main(factory: Callable[[dict], DResource], args: Sequence[str] = None) -> None:
+    """Entry point of resource images: executes a single action (reading the resource data from stdin), resolves the
+    state of multiple resources when invoked with the "batch_state" argument, or serves actions as a long-lived worker
+    when invoked with the "serve" argument."""
+    args = args if args is not None else sys.argv[1:]
+    if args == ['serve']:
+        serve(factory)
+    elif args == ['batch_state']:
+        batch_state(factory, json.loads(sys.stdin.read()))
+    else:
+        resource: DResource = factory(json.loads(sys.stdin.read()))
+        resource.worker_supported = True
+        resource.execute(args)
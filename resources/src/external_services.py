@@ -1,17 +1,43 @@
+import hashlib
 import json
+import os
+import random
+import socket
 import subprocess
 import sys
+import time
 from abc import abstractmethod
 from pathlib import Path
 from pprint import pformat
-from time import sleep
-from typing import Sequence, MutableMapping, Union, Any, Mapping, MutableSequence
+from typing import Sequence, MutableMapping, Union, Any, Mapping, MutableSequence, Tuple, Callable
 
+import httplib2
 import pymysql
+from google.auth.credentials import AnonymousCredentials
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
+from googleapiclient.discovery_cache.base import Cache
 from googleapiclient.errors import HttpError
 from pymysql import Connection
 
+# bump to invalidate all cached discovery documents (eg. ones baked into existing images)
+DISCOVERY_CACHE_VERSION = 1
+
+# Google APIs used by the built-in resources (service name & version)
+GCP_SERVICES: Sequence[Tuple[str, str]] = [
+    ('cloudbilling', 'v1'),
+    ('cloudresourcemanager', 'v1'),
+    ('compute', 'v1'),
+    ('container', 'v1'),
+    ('iam', 'v1'),
+    ('servicemanagement', 'v1'),
+    ('serviceusage', 'v1'),
+    ('sqladmin', 'v1beta4'),
+]
+
+# maximum number of services per Service Usage "batchEnable" request
+SERVICE_USAGE_BATCH_ENABLE_LIMIT = 20
+
 
 class SqlExecutor:
 
@@ -50,10 +76,11 @@ class ProxySqlExecutor(SqlExecutor):
 
     def open(self) -> None:
         self._svc.update_gcp_sql_user(project_id=self._project_id, instance=self._instance, password=self._password)
+        credentials: str = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS', '/deployster/service-account.json')
         self._proxy_process: subprocess.Popen = \
             subprocess.Popen([f'/usr/local/bin/cloud_sql_proxy',
                               f'-instances={self._project_id}:{self._region}:{self._instance}=tcp:3306',
-                              f'-credential_file=/deployster/service-account.json'])
+                              f'-credential_file={credentials}'])
         try:
             self._proxy_process.wait(2)
             raise Exception(f"could not start Cloud SQL Proxy!")
@@ -92,18 +119,162 @@ def region_from_zone(zone: str) -> str:
     return zone[0:zone.rfind('-')]
 
 
+class OperationPoller:
+    """Polls a long-running operation until it's done. The operation is checked immediately, and then at exponentially
+    growing intervals (with random jitter, so concurrent pollers don't synchronize), starting at the given initial
+    interval & bounded by the given maximum interval. Pollers of server-side blocking waits use zero intervals."""
+
+    def __init__(self,
+                 initial_interval: float,
+                 max_interval: float,
+                 multiplier: float = 2,
+                 jitter: float = 0.2,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep) -> None:
+        super().__init__()
+        self._initial_interval: float = initial_interval
+        self._max_interval: float = max_interval
+        self._multiplier: float = multiplier
+        self._jitter: float = jitter
+        self._clock: Callable[[], float] = clock
+        self._sleep: Callable[[float], None] = sleep
+
+    @property
+    def clock(self) -> Callable[[], float]:
+        return self._clock
+
+    @property
+    def initial_interval(self) -> float:
+        return self._initial_interval
+
+    @property
+    def max_interval(self) -> float:
+        return self._max_interval
+
+    def poll(self, fetch: Callable[[], dict], description: str, timeout: float = None) -> dict:
+        """Fetches the operation until it's done (either "done" or in "DONE" status), returning its final state."""
+        return self.poll_all(fetch=lambda keys: {key: fetch() for key in keys},
+                             keys=[0],
+                             description=description,
+                             timeout=timeout)[0]
+
+    def poll_all(self,
+                 fetch: Callable[[Sequence[Any]], Mapping[Any, dict]],
+                 keys: Sequence[Any],
+                 description: str,
+                 timeout: float = None) -> Mapping[Any, dict]:
+        """Fetches the given operations (by key) until all are done, returning their final states. Each check fetches
+        only the pending operations, all at once (eg. in a single batch HTTP request)."""
+        deadline: float = self._clock() + timeout if timeout is not None else None
+        interval: float = self._initial_interval
+        results: MutableMapping[Any, dict] = {}
+        pending: Sequence[Any] = list(keys)
+        while True:
+            results.update(fetch(pending))
+            pending = [key for key in pending if not self._is_done(results[key])]
+            if not pending:
+                return results
+
+            now: float = self._clock()
+            if deadline is not None and now >= deadline:
+                pending_results: Sequence[dict] = [results[key] for key in pending]
+                raise Exception(f"Timed out waiting for {description}: "
+                                f"{json.dumps(pending_results[0] if len(pending) == 1 else pending_results, indent=2)}")
+            delay: float = min(interval, self._max_interval) * random.uniform(1 - self._jitter, 1 + self._jitter)
+            self._sleep(min(delay, deadline - now) if deadline is not None else delay)
+            interval *= self._multiplier
+
+    @staticmethod
+    def _is_done(result: dict) -> bool:
+        return ('done' in result and result['done']) or ('status' in result and result['status'] == 'DONE')
+
+
+# timing hints per operation type: API enablement & project changes are usually quick, SQL operations take a while, &
+# GKE operations take minutes; Compute operations are awaited server-side (falling back to polling if unsupported)
+OPERATION_POLLERS: Mapping[str, OperationPoller] = {
+    'serviceusage': OperationPoller(initial_interval=1, max_interval=5),
+    'cloudresourcemanager': OperationPoller(initial_interval=1, max_interval=5),
+    'sqladmin': OperationPoller(initial_interval=2, max_interval=15),
+    'container': OperationPoller(initial_interval=5, max_interval=30),
+    'compute': OperationPoller(initial_interval=1, max_interval=10),
+    'compute-wait': OperationPoller(initial_interval=0, max_interval=0),
+}
+
+
+class DiscoveryCache(Cache):
+    """Disk-backed cache of Google API discovery documents (keyed by their URL), so that building API clients does not
+    download & parse them over the network in every resource process. Documents are kept in a versioned sub-directory
+    of the given directory (see DISCOVERY_CACHE_VERSION); a read-only directory simply serves what it already has.
+
+    Only used by 1.x versions of the Google API client: later versions ship the discovery documents of all Google APIs
+    (& never fetch them), in which case the cache is neither read nor populated."""
+
+    def __init__(self, path: Path) -> None:
+        super().__init__()
+        self._path: Path = path / f"v{DISCOVERY_CACHE_VERSION}"
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def _file(self, url: str) -> Path:
+        return self._path / f"{hashlib.sha256(url.encode('utf-8')).hexdigest()}.json"
+
+    def get(self, url: str) -> Union[None, str]:
+        try:
+            with open(self._file(url), 'r') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def set(self, url: str, content: Union[str, bytes]) -> None:
+        file: Path = self._file(url)
+        temp_file: Path = file.with_name(f"{file.name}.{os.getpid()}.tmp")
+        try:
+            self._path.mkdir(parents=True, exist_ok=True)
+            with open(temp_file, 'w') as f:
+                f.write(content.decode('utf-8') if isinstance(content, bytes) else content)
+            os.replace(str(temp_file), str(file))
+        except OSError:
+            pass
+
+
 class ExternalServices:
 
     def __init__(self) -> None:
         super().__init__()
-        self._gcp_service_cache: MutableMapping[str, Any] = {}
+        self._gcp_service_cache: MutableMapping[Tuple[str, str, str], Any] = {}
+        self._pollers: MutableMapping[str, OperationPoller] = dict(OPERATION_POLLERS)
+
+    @property
+    def discovery_cache(self) -> DiscoveryCache:
+        # resolved on use: a (host) process may create this instance before the resource's environment is applied
+        return DiscoveryCache(Path(os.environ.get('DEPLOYSTER_DISCOVERY_CACHE', '/deployster/discovery-cache')))
+
+    @property
+    def pollers(self) -> MutableMapping[str, OperationPoller]:
+        """Operation pollers per operation type (see OPERATION_POLLERS); can be replaced, eg. to tune timings."""
+        return self._pollers
 
     def _get_gcp_service(self, service_name, version) -> Any:
-        service_key = service_name + '_' + version
+        # clients are bound to the credentials they were built with, & a (host) process may serve resources plugged
+        # with different service accounts
+        service_key: Tuple[str, str, str] = \
+            (service_name, version, os.environ.get('GOOGLE_APPLICATION_CREDENTIALS'))
         if service_key not in self._gcp_service_cache:
-            self._gcp_service_cache[service_key] = build(serviceName=service_name, version=version)
+            self._gcp_service_cache[service_key] = build(serviceName=service_name,
+                                                         version=version,
+                                                         cache=self.discovery_cache)
         return self._gcp_service_cache[service_key]
 
+    def warm_discovery_cache(self) -> None:
+        """Builds the clients of all Google APIs used by the built-in resources, populating the discovery cache (eg.
+        when building the resource images)."""
+        for service_name, version in GCP_SERVICES:
+            # no credentials are available (nor needed) at that time; the clients themselves are discarded
+            build(serviceName=service_name, version=version, cache=self.discovery_cache,
+                  credentials=AnonymousCredentials())
+
     def find_gcp_project(self, project_id: str) -> Union[None, dict]:
         filter: str = f"name:{project_id}"
         result: dict = self._get_gcp_service('cloudresourcemanager', 'v1').projects().list(filter=filter).execute()
@@ -149,53 +320,102 @@ class ExternalServices:
         service = self._get_gcp_service('cloudbilling', 'v1').projects()
         service.updateBillingInfo(name=f'projects/{project_id}', body=body).execute()
 
-    def enable_gcp_project_api(self, project_id: str, api: str) -> None:
-        self.wait_for_gcp_service_manager_operation(
-            self._get_gcp_service('servicemanagement', 'v1').services().enable(serviceName=api, body={
-                'consumerId': f"project:{project_id}"
-            }).execute())
-
-    def disable_gcp_project_api(self, project_id: str, api: str) -> None:
-        self.wait_for_gcp_service_manager_operation(
-            self._get_gcp_service('servicemanagement', 'v1').services().disable(serviceName=api, body={
-                'consumerId': f"project:{project_id}"
-            }).execute())
-
-    def wait_for_gcp_service_manager_operation(self, result):
-        if 'response' in result:
-            return result['response']
+    def enable_gcp_project_apis(self, project_id: str, apis: Sequence[str]) -> None:
+        # Service Usage enables up to 20 services per "batchEnable" call; larger lists are split & enabled concurrently
+        services = self._get_gcp_service('serviceusage', 'v1').services()
+        limit: int = SERVICE_USAGE_BATCH_ENABLE_LIMIT
+        self.wait_for_gcp_service_usage_operations(self._batch_execute('serviceusage', 'v1', [
+            services.batchEnable(parent=f"projects/{project_id}", body={'serviceIds': list(apis[i:i + limit])})
+            for i in range(0, len(apis), limit)
+        ]))
+
+    def disable_gcp_project_apis(self, project_id: str, apis: Sequence[str]) -> None:
+        # Service Usage has no batch-disable endpoint, so we disable the APIs concurrently instead
+        services = self._get_gcp_service('serviceusage', 'v1').services()
+        self.wait_for_gcp_service_usage_operations(self._batch_execute('serviceusage', 'v1', [
+            services.disable(name=f"projects/{project_id}/services/{api}", body={}) for api in apis
+        ]))
+
+    def wait_for_gcp_service_usage_operations(self,
+                                              results: Sequence[Union[dict, Exception]],
+                                              timeout: int = 60 * 10) -> Sequence[dict]:
+        return self._wait_for_gcp_operations('serviceusage', 'v1', results, "Google Service Usage operations", timeout)
+
+    def _wait_for_gcp_operations(self,
+                                 service_name: str,
+                                 version: str,
+                                 results: Sequence[Union[dict, Exception]],
+                                 description: str,
+                                 timeout: int) -> Sequence[dict]:
+        """Waits for all given operations (or submission failures, as returned by '_batch_execute') in a single polling
+        loop; failures are reported (per operation) only once all operations are done."""
+        operations_service = self._get_gcp_service(service_name, version).operations()
+
+        def fetch(keys: Sequence[int]) -> Mapping[int, dict]:
+            # failing to fetch an operation (eg. due to throttling or a server error) does not fail the operation; it
+            # is simply fetched again on the next check (until timing out)
+            try:
+                fetched: Sequence[Union[dict, Exception]] = self._batch_execute(service_name, version, [
+                    operations_service.get(name=results[key]['name']) for key in keys
+                ])
+            except HttpError as e:
+                fetched: Sequence[Union[dict, Exception]] = [e] * len(keys)
+            return {key: dict(results[key], fetch_error=str(result)) if isinstance(result, Exception) else result
+                    for key, result in zip(keys, fetched)}
+
+        pending: Sequence[int] = [index for index, result in enumerate(results)
+                                  if not isinstance(result, Exception) and 'response' not in result
+                                  and 'error' not in result]
+        fetched_results: Mapping[int, dict] = self._pollers[service_name].poll_all(fetch=fetch,
+                                                                                   keys=pending,
+                                                                                   description=description,
+                                                                                   timeout=timeout)
+        final_results: Sequence[Union[dict, Exception]] = [fetched_results[index] if index in fetched_results
+                                                            else result for index, result in enumerate(results)]
+
+        errors: Sequence[str] = [f"operation: {result}" if isinstance(result, Exception)
+                                 else f"{result.get('name', 'operation')}: "
+                                      f"{json.dumps(result['error'] if 'error' in result else result)}"
+                                 for result in final_results
+                                 if isinstance(result, Exception) or 'response' not in result]
+        if errors:
+            raise Exception("ERROR: %s" % '\n'.join(errors))
+        return [result['response'] for result in final_results]
+
+    def _batch_execute(self,
+                       service_name: str,
+                       version: str,
+                       requests: Sequence[Any]) -> Sequence[Union[dict, Exception]]:
+        """Executes the given requests of the given service in a single batch HTTP request, returning their results (in
+        order). Failed requests are returned as their exceptions, rather than failing the batch."""
+        if not requests:
+            return []
 
-        operations_service = self._get_gcp_service('servicemanagement', 'v1').operations()
-        while True:
-            sleep(5)
-            result = operations_service.get(name=result['name']).execute()
-            if 'done' in result and result['done']:
-                if 'response' in result:
-                    return result['response']
+        results: MutableMapping[str, Union[dict, Exception]] = {}
 
-                elif 'error' in result:
-                    raise Exception("ERROR: %s" % json.dumps(result['error']))
+        def callback(request_id: str, response: dict, exception: Exception) -> None:
+            results[request_id] = response if exception is None else exception
 
-                else:
-                    raise Exception("UNKNOWN ERROR: %s" % json.dumps(result))
+        batch = self._get_gcp_service(service_name, version).new_batch_http_request(callback=callback)
+        for index, request in enumerate(requests):
+            batch.add(request, request_id=str(index))
+        batch.execute()
+        return [results[str(index)] for index in range(len(requests))]
 
     def wait_for_gcp_resource_manager_operation(self, result):
         if 'response' in result:
             return result['response']
 
         operations_service = self._get_gcp_service('cloudresourcemanager', 'v1').operations()
-        while True:
-            sleep(5)
-            result = operations_service.get(name=result['name']).execute()
-            if 'done' in result and result['done']:
-                if 'response' in result:
-                    return result['response']
-
-                elif 'error' in result:
-                    raise Exception("ERROR: %s" % json.dumps(result['error']))
-
-                else:
-                    raise Exception("UNKNOWN ERROR: %s" % json.dumps(result))
+        result = self._pollers['cloudresourcemanager'].poll(
+            fetch=lambda: operations_service.get(name=result['name']).execute(),
+            description="Google Resource Manager operation")
+        if 'response' in result:
+            return result['response']
+        elif 'error' in result:
+            raise Exception("ERROR: %s" % json.dumps(result['error']))
+        else:
+            raise Exception("UNKNOWN ERROR: %s" % json.dumps(result))
 
     def find_service_account(self, project_id: str, email: str):
         try:
@@ -312,24 +532,28 @@ class ExternalServices:
                                 password=kwargs['password'],
                                 region=kwargs['region'])
 
+    @staticmethod
+    def _operation_result(result: dict) -> dict:
+        if 'error' in result:
+            raise Exception("ERROR: %s" % json.dumps(result['error']))
+        else:
+            return result
+
+    @staticmethod
+    def _http_with_timeout(http: Any, timeout: float) -> Any:
+        """Provides an HTTP client authorized like the given one (of a Google API request), but timing out after the
+        given number of seconds. Clients not authorized by google-auth are returned as is."""
+        if isinstance(http, AuthorizedHttp):
+            return AuthorizedHttp(http.credentials, http=httplib2.Http(timeout=timeout))
+        else:
+            return http
+
     def wait_for_gcp_sql_operation(self, project_id: str, operation: dict, timeout=60 * 30):
         operations_service = self._get_gcp_service('sqladmin', 'v1beta4').operations()
-
-        interval = 5
-        counter = 0
-        while True:
-            sleep(interval)
-            counter = counter + interval
-
-            result = operations_service.get(project=project_id, operation=operation['name']).execute()
-
-            if 'status' in result and result['status'] == 'DONE':
-                if 'error' in result:
-                    raise Exception("ERROR: %s" % json.dumps(result['error']))
-                else:
-                    return result
-            if counter >= timeout:
-                raise Exception(f"Timed out waiting for Google Cloud SQL operation: {json.dumps(result,indent=2)}")
+        return self._operation_result(self._pollers['sqladmin'].poll(
+            fetch=lambda: operations_service.get(project=project_id, operation=operation['name']).execute(),
+            description="Google Cloud SQL operation",
+            timeout=timeout))
 
     def get_gke_cluster(self, project_id: str, zone: str, name: str):
         clusters_service = self._get_gcp_service('container', 'v1').projects().zones().clusters()
@@ -457,20 +681,11 @@ class ExternalServices:
     def wait_for_gke_zonal_operation(self, project_id: str, zone: str, operation: dict,
                                      timeout: int = 60 * 15):
         operations_service = self._get_gcp_service('container', 'v1').projects().zones().operations()
-
-        interval = 5
-        counter = 0
-        while True:
-            sleep(interval)
-            counter = counter + interval
-            result = operations_service.get(projectId=project_id, zone=zone, operationId=operation['name']).execute()
-            if 'status' in result and result['status'] == 'DONE':
-                if 'error' in result:
-                    raise Exception("ERROR: %s" % json.dumps(result['error']))
-                else:
-                    return result
-            if counter >= timeout:
-                raise Exception(f"Timed out waiting for GKE zonal operation: {json.dumps(result,indent=2)}")
+        return self._operation_result(self._pollers['container'].poll(
+            fetch=lambda: operations_service.get(projectId=project_id, zone=zone,
+                                                 operationId=operation['name']).execute(),
+            description="GKE zonal operation",
+            timeout=timeout))
 
     def generate_gcloud_access_token(self, json_credentials_file: Path) -> str:
         # first, make gcloud use our service account
@@ -508,23 +723,12 @@ class ExternalServices:
                                                 operation: dict,
                                                 timeout: int = 60 * 5):
         operations_service = self._get_gcp_service('compute', 'v1').regionOperations()
-
-        interval = 5
-        counter = 0
-        while True:
-            sleep(interval)
-            counter = counter + interval
-
-            result = operations_service.get(project=project_id, region=region, operation=operation['name']).execute()
-
-            if 'status' in result and result['status'] == 'DONE':
-                if 'error' in result:
-                    raise Exception("ERROR: %s" % json.dumps(result['error']))
-                else:
-                    return result
-            if counter >= timeout:
-                raise Exception(
-                    f"Timed out waiting for Google Compute regional operation: {json.dumps(result,indent=2)}")
+        return self._wait_for_gcp_compute_operation(operations_service=operations_service,
+                                                    description="Google Compute regional operation",
+                                                    timeout=timeout,
+                                                    project=project_id,
+                                                    region=region,
+                                                    operation=operation['name'])
 
     def get_gcp_compute_global_ip_address(self, project_id: str, name: str) -> Union[None, dict]:
         try:
@@ -543,22 +747,32 @@ class ExternalServices:
 
     def wait_for_gcp_compute_global_operation(self, project_id: str, operation: dict, timeout: int = 60 * 5):
         operations_service = self._get_gcp_service('compute', 'v1').globalOperations()
-
-        interval = 5
-        counter = 0
-        while True:
-            sleep(interval)
-            counter = counter + interval
-
-            result = operations_service.get(project=project_id, operation=operation['name']).execute()
-
-            if 'status' in result and result['status'] == 'DONE':
-                if 'error' in result:
-                    raise Exception("ERROR: %s" % json.dumps(result['error']))
-                else:
-                    return result
-            if counter >= timeout:
-                raise Exception(f"Timed out waiting for Google Compute global operation: {json.dumps(result,indent=2)}")
+        return self._wait_for_gcp_compute_operation(operations_service=operations_service,
+                                                    description="Google Compute global operation",
+                                                    timeout=timeout,
+                                                    project=project_id,
+                                                    operation=operation['name'])
+
+    def _wait_for_gcp_compute_operation(self, operations_service: Any, description: str, timeout: int,
+                                        **operation_id: str) -> dict:
+        # Compute's "wait" blocks server-side until the operation is done (or for up to 2 minutes, in which case we
+        # simply wait again); older discovery documents do not provide it, so we fall back to polling
+        if hasattr(operations_service, 'wait'):
+            poller: OperationPoller = self._pollers['compute-wait']
+            deadline: float = poller.clock() + timeout
+
+            def fetch() -> dict:
+                # each wait is cut short at our own deadline (an unfinished wait simply reports a running operation)
+                request: Any = operations_service.wait(**operation_id)
+                http: Any = self._http_with_timeout(request.http, max(deadline - poller.clock(), 1))
+                try:
+                    return request.execute(http=http)
+                except socket.timeout:
+                    return {'name': operation_id['operation'], 'status': 'RUNNING'}
+        else:
+            poller: OperationPoller = self._pollers['compute']
+            fetch: Callable[[], dict] = lambda: operations_service.get(**operation_id).execute()
+        return self._operation_result(poller.poll(fetch=fetch, description=description, timeout=timeout))
 
     def find_k8s_cluster_object(self, manifest: dict) -> Union[None, dict]:
         cmd = f"kubectl get {manifest['kind']} {manifest['metadata']['name']} --ignore-not-found=true --output=json"
@@ -574,6 +788,34 @@ class ExternalServices:
         process = subprocess.run(f"{cmd}", shell=True, check=True, stdout=subprocess.PIPE)
         return json.loads(process.stdout) if process.stdout else None
 
+    def find_k8s_objects(self, manifests: Sequence[dict]) -> Sequence[Union[None, dict]]:
+        """Finds multiple Kubernetes objects (in the order of the given manifests), using a single "kubectl get" per
+        kind & namespace."""
+        groups: MutableMapping[Tuple[str, str], MutableSequence[int]] = {}
+        for index, manifest in enumerate(manifests):
+            key: Tuple[str, str] = (manifest['kind'], manifest['metadata'].get('namespace'))
+            groups.setdefault(key, []).append(index)
+
+        objects: MutableSequence[Union[None, dict]] = [None] * len(manifests)
+        for (kind, namespace), indices in groups.items():
+            names: Sequence[str] = [manifests[index]['metadata']['name'] for index in indices]
+            namespace_arg: str = f"--namespace {namespace} " if namespace else ''
+            cmd: str = f"kubectl get {namespace_arg}{kind} {' '.join(names)} --ignore-not-found=true --output=json"
+            process = subprocess.run(f"{cmd}", shell=True, check=True, stdout=subprocess.PIPE)
+
+            # kubectl returns a "List" object when multiple objects are found (and nothing if none are found)
+            result: dict = json.loads(process.stdout) if process.stdout else None
+            if result is None:
+                items: Sequence[dict] = []
+            elif result['kind'] == 'List':
+                items: Sequence[dict] = result['items']
+            else:
+                items: Sequence[dict] = [result]
+            found: Mapping[str, dict] = {item['metadata']['name']: item for item in items}
+            for index in indices:
+                objects[index] = found.get(manifests[index]['metadata']['name'])
+        return objects
+
     def create_k8s_object(self, manifest: dict, timeout: int = 60 * 5, verbose: bool = False) -> None:
         if verbose:
             print(f"Creating Kubernetes object from:\n{json.dumps(manifest, indent=2)}")
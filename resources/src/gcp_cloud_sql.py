@@ -2,15 +2,14 @@
 
 import argparse
 import json
-import sys
 from abc import ABC, abstractmethod
 from pathlib import Path
 from pprint import pformat
-from typing import Sequence, MutableSequence, Any, Mapping
+from typing import Sequence, MutableSequence, Any, Mapping, Union
 
 from jinja2 import Environment, Template
 
-from dresources import DAction, action
+from dresources import DAction, action, resource_main
 from external_services import ExternalServices
 from external_services import region_from_zone, SqlExecutor
 from gcp import GcpResource
@@ -681,16 +680,24 @@ class GcpCloudSql(GcpResource):
         enabled_apis = self.svc.find_gcp_project_enabled_apis(project_id=cfg['project_id'])
         if enabled_apis is not None:
             if 'sqladmin.googleapis.com' in enabled_apis and 'sql-component.googleapis.com' in enabled_apis:
-                instance = self.svc.get_gcp_sql_instance(project_id=cfg['project_id'], instance_name=cfg['name'])
-                if instance:
-                    if 'users' in self.info.config:
-                        instance['users'] = \
-                            self.svc.get_gcp_sql_users(project_id=cfg['project_id'], instance_name=cfg['name'])
-                    else:
-                        instance['users'] = []
-                return instance
+                return self._find_instance()
         return None
 
+    def _find_instance(self) -> Union[None, dict]:
+        cfg: dict = self.info.config
+        instance = self.svc.get_gcp_sql_instance(project_id=cfg['project_id'], instance_name=cfg['name'])
+        if instance:
+            if 'users' in cfg:
+                instance['users'] = self.svc.get_gcp_sql_users(project_id=cfg['project_id'], instance_name=cfg['name'])
+            else:
+                instance['users'] = []
+        return instance
+
+    def post_apply_state(self) -> Union[None, dict]:
+        # flags, tiers & APIs were already validated by the "state" action, so only the instance itself is fetched
+        instance: dict = self._find_instance()
+        return instance if instance and not self.get_actions_for_discovered_state(instance) else None
+
     def get_actions_for_missing_state(self) -> Sequence[DAction]:
         actions: MutableSequence[DAction] = []
         cfg: dict = self.info.config
@@ -921,8 +928,8 @@ class GcpCloudSql(GcpResource):
     @action
     def enable_sql_apis(self, args):
         if args: pass
-        for api in ['sqladmin.googleapis.com', 'sql-component.googleapis.com']:
-            self.svc.enable_gcp_project_api(project_id=self.info.config['project_id'], api=api)
+        self.svc.enable_gcp_project_apis(project_id=self.info.config['project_id'],
+                                         apis=['sqladmin.googleapis.com', 'sql-component.googleapis.com'])
 
     @action
     def create_sql_instance(self, args) -> None:
@@ -1144,7 +1151,7 @@ class GcpCloudSql(GcpResource):
 
 
 def main():
-    GcpCloudSql(json.loads(sys.stdin.read())).execute()  # pragma: no cover
+    resource_main(GcpCloudSql)  # pragma: no cover
 
 
 if __name__ == "__main__":
@@ -1,10 +1,8 @@
 #!/usr/bin/env python3.6
 
-import json
-import sys
 from typing import Sequence
 
-from dresources import DAction, action
+from dresources import DAction, action, resource_main
 from external_services import ExternalServices
 from gcp import GcpResource
 
@@ -54,7 +52,7 @@ class GcpIpAddress(GcpResource):
 
 
 def main():
-    GcpIpAddress(json.loads(sys.stdin.read())).execute()  # pragma: no cover
+    resource_main(GcpIpAddress)  # pragma: no cover
 
 
 if __name__ == "__main__":
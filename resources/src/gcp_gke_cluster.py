@@ -1,15 +1,13 @@
 #!/usr/bin/env python3.6
 
 import argparse
-import json
 import os
-import sys
 from pathlib import Path
 from typing import Mapping, Sequence, MutableSequence
 
 import yaml
 
-from dresources import DAction, action
+from dresources import DAction, action, resource_main
 from external_services import ExternalServices
 from gcp import GcpResource
 
@@ -71,8 +69,8 @@ class GkeCluster(GcpResource):
 
         # generate a kubectl config file using the cluster properties and the service account's access token
         cluster_full_id = f"gke_{self.info.config['project_id']}_{self.info.config['zone']}_{self.info.config['name']}"
-        os.makedirs(self.get_plug('kube').container_path, exist_ok=True)
-        with open(self.get_plug('kube').container_path + '/config', 'w') as stream:
+        os.makedirs(self.get_plug('kube').path, exist_ok=True)
+        with open(self.get_plug('kube').path + '/config', 'w') as stream:
             stream.write(yaml.dump({
                 'apiVersion': 'v1',
                 'kind': 'Config',
@@ -90,7 +88,7 @@ class GkeCluster(GcpResource):
                     {
                         'name': cluster_full_id,
                         'user': {
-                            'token': self.svc.generate_gcloud_access_token(Path(sa_plug.container_path))
+                            'token': self.svc.generate_gcloud_access_token(Path(sa_plug.path))
                         }
                     }
                 ],
@@ -559,7 +557,7 @@ class GkeCluster(GcpResource):
 
 
 def main():
-    GkeCluster(data=json.loads(sys.stdin.read())).execute()  # pragma: no cover
+    resource_main(GkeCluster)  # pragma: no cover
 
 
 if __name__ == "__main__":
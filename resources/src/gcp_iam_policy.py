@@ -1,11 +1,10 @@
 #!/usr/bin/env python3.6
 import argparse
-import json
 import sys
 from copy import deepcopy
 from typing import Sequence, MutableSequence, List
 
-from dresources import DAction, action
+from dresources import DAction, action, resource_main
 from external_services import ExternalServices
 from gcp import GcpResource
 
@@ -112,7 +111,7 @@ class GcpIamPolicy(GcpResource):
 
 
 def main():
-    GcpIamPolicy(json.loads(sys.stdin.read())).execute()  # pragma: no cover
+    resource_main(GcpIamPolicy)  # pragma: no cover
 
 
 if __name__ == "__main__":
@@ -1,11 +1,9 @@
 #!/usr/bin/env python3.6
 
 import argparse
-import json
-import sys
 from typing import Sequence, MutableSequence
 
-from dresources import DAction, action
+from dresources import DAction, action, resource_main
 from external_services import ExternalServices
 from gcp import GcpResource
 
@@ -69,7 +67,7 @@ class GcpIamServiceAccount(GcpResource):
 
 
 def main():
-    GcpIamServiceAccount(json.loads(sys.stdin.read())).execute()  # pragma: no cover
+    resource_main(GcpIamServiceAccount)  # pragma: no cover
 
 
 if __name__ == "__main__":
@@ -1,12 +1,10 @@
 #!/usr/bin/env python3.6
 
 import argparse
-import json
-import sys
 from pprint import pprint
 from typing import Sequence, MutableSequence
 
-from dresources import DAction, action
+from dresources import DAction, action, resource_main
 from external_services import ExternalServices
 from gcp import GcpResource
 
@@ -83,18 +81,10 @@ class GcpProject(GcpResource):
 
         if 'apis' in config:
             apis = config['apis']
-            if 'disabled' in apis:
-                for api_name in apis['disabled']:
-                    actions.append(
-                        DAction(name=f"disable-api-{api_name}",
-                                description=f"Disable API '{api_name}'",
-                                args=['disable_api', api_name]))
-            if 'enabled' in apis:
-                for api_name in apis['enabled']:
-                    actions.append(
-                        DAction(name=f"enable-api-{api_name}",
-                                description=f"Enable API '{api_name}'",
-                                args=['enable_api', api_name]))
+            if 'disabled' in apis and apis['disabled']:
+                actions.append(self._apis_action('disable', apis['disabled']))
+            if 'enabled' in apis and apis['enabled']:
+                actions.append(self._apis_action('enable', apis['enabled']))
         return actions
 
     def get_actions_for_discovered_state(self, state: dict) -> Sequence[DAction]:
@@ -123,28 +113,31 @@ class GcpProject(GcpResource):
             actual_enabled_api_names: Sequence[str] = sorted(state['apis']['enabled'])
             if 'disabled' in apis:
                 # disable APIs that are currently enabled, but user requested them to be disabled
-                for api_name in [api_name for api_name in apis['disabled'] if api_name in actual_enabled_api_names]:
-                    actions.append(
-                        DAction(name=f"disable-api-{api_name}",
-                                description=f"Disable API '{api_name}'",
-                                args=['disable_api', api_name]))
+                api_names = [api_name for api_name in apis['disabled'] if api_name in actual_enabled_api_names]
+                if api_names:
+                    actions.append(self._apis_action('disable', api_names))
 
             if 'enabled' in apis:
                 # enable APIs that are currently not enabled, but user requested them to be enabled
-                for api_name in [api_name for api_name in apis['enabled'] if api_name not in actual_enabled_api_names]:
-                    actions.append(
-                        DAction(name=f"enable-api-{api_name}",
-                                description=f"Enable API '{api_name}'",
-                                args=['enable_api', api_name]))
+                api_names = [api_name for api_name in apis['enabled'] if api_name not in actual_enabled_api_names]
+                if api_names:
+                    actions.append(self._apis_action('enable', api_names))
 
         return actions
 
+    @staticmethod
+    def _apis_action(verb: str, api_names: Sequence[str]) -> DAction:
+        # all APIs are enabled (or disabled) by a single action, which submits them in bulk
+        return DAction(name=f"{verb}-apis",
+                       description=f"{verb.capitalize()} APIs: {', '.join(api_names)}",
+                       args=[f"{verb}_apis"] + list(api_names))
+
     def configure_action_argument_parser(self, action: str, argparser: argparse.ArgumentParser):
         super().configure_action_argument_parser(action, argparser)
-        if action == 'disable_api':
-            argparser.add_argument('api', metavar='NAME', help="API to disable (eg. 'cloudbuild.googleapis.com)")
-        elif action == 'enable_api':
-            argparser.add_argument('api', metavar='NAME', help="API to enable (eg. 'cloudbuild.googleapis.com)")
+        if action == 'disable_apis':
+            argparser.add_argument('apis', metavar='NAME', nargs='+', help="APIs to disable")
+        elif action == 'enable_apis':
+            argparser.add_argument('apis', metavar='NAME', nargs='+', help="APIs to enable")
 
     @action
     def create_project(self, args):
@@ -178,16 +171,16 @@ class GcpProject(GcpResource):
         })
 
     @action
-    def disable_api(self, args):
-        self.svc.disable_gcp_project_api(project_id=self.info.config['project_id'], api=args.api)
+    def disable_apis(self, args):
+        self.svc.disable_gcp_project_apis(project_id=self.info.config['project_id'], apis=args.apis)
 
     @action
-    def enable_api(self, args):
-        self.svc.enable_gcp_project_api(project_id=self.info.config['project_id'], api=args.api)
+    def enable_apis(self, args):
+        self.svc.enable_gcp_project_apis(project_id=self.info.config['project_id'], apis=args.apis)
 
 
 def main():
-    GcpProject(json.loads(sys.stdin.read())).execute()  # pragma: no cover
+    resource_main(GcpProject)  # pragma: no cover
 
 
 if __name__ == "__main__":
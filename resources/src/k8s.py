@@ -3,7 +3,7 @@ import time
 from copy import deepcopy
 from pprint import pprint
 from time import sleep
-from typing import Sequence, MutableSequence
+from typing import Sequence, MutableSequence, Union
 
 from dresources import DAction, action, DResource
 from dresources_util import collect_differences
@@ -14,6 +14,9 @@ class K8sResource(DResource):
 
     def __init__(self, data: dict, svc: ExternalServices = ExternalServices()) -> None:
         super().__init__(data=data, svc=svc)
+        self._prefetched: bool = False
+        self._prefetched_object: dict = None
+        self._available_state: dict = None
         self.add_plug(name='kube', container_path='/root/.kube', optional=False, writable=False)
         self.config_schema.update({
             "required": ["manifest"],
@@ -67,8 +70,19 @@ class K8sResource(DResource):
     def timeout_interval_ms(self) -> int:
         return self.info.config['timeout_interval_ms'] if 'timeout_interval_ms' in self.info.config else 100
 
+    @classmethod
+    def batch_state_results(cls, resources: Sequence['K8sResource']) -> Sequence[dict]:
+        # a single "kubectl get" per kind & namespace, rather than one per resource
+        objects: Sequence[dict] = resources[0].svc.find_k8s_objects([r.info.config['manifest'] for r in resources])
+        for resource, found in zip(resources, objects):
+            resource._prefetched = True
+            resource._prefetched_object = found
+        return super().batch_state_results(resources)
+
     def discover_state(self):
-        if 'namespace' in self.info.config['manifest']['metadata']:
+        if self._prefetched:
+            return self._prefetched_object
+        elif 'namespace' in self.info.config['manifest']['metadata']:
             return self.svc.find_k8s_namespace_object(self.info.config['manifest'])
         else:
             return self.svc.find_k8s_cluster_object(self.info.config['manifest'])
@@ -99,12 +113,11 @@ class K8sResource(DResource):
     def build_kubectl_manifest(self) -> dict:
         return deepcopy(self.info.config['manifest'])
 
-    @action
-    def state(self, args) -> None:
+    def state_result(self) -> dict:
         if self.timeout_interval_ms >= self.timeout_ms:
             raise Exception(f"timeout interval ({self.timeout_interval_ms / 1000}) cannot be greater "
                             f"than or equal to total timeout ({self.timeout_ms / 1000}) duration")
-        super().state(args)
+        return super().state_result()
 
     @action
     def create(self, args) -> None:
@@ -135,6 +148,11 @@ class K8sResource(DResource):
     def is_available(self, state: dict) -> bool:
         return True
 
+    def post_apply_state(self) -> Union[None, dict]:
+        # the state found available after creating/updating the object is our new state (if it matches the config)
+        state: dict = self._available_state
+        return state if state is not None and not self.get_actions_for_discovered_state(state) else None
+
     def check_availability(self, timeout_ms: int = None, timeout_interval_ms: int = None):
         if timeout_ms is None:
             timeout_ms: int = self.timeout_ms
@@ -145,6 +163,7 @@ class K8sResource(DResource):
         while waited_ms <= timeout_ms:
             state: dict = self.discover_state()
             if self.is_available(state):
+                self._available_state = state
                 return True
             sleep(timeout_interval_ms / 1000)
             waited_ms += timeout_interval_ms
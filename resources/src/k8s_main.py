@@ -1,9 +1,8 @@
 #!/usr/bin/env python3.6
 
-import json
-import sys
 from typing import Mapping
 
+from dresources import resource_main
 from k8s import K8sResource
 from k8s_deployment import K8sDeployment
 from k8s_ingress import K8sIngress
@@ -137,25 +136,26 @@ def main():
         },
     }
 
-    # read the current resource type from stdin, along with all the other information Deployster sends
-    data = json.loads(sys.stdin.read())
-    resource_type: str = data['type'][0:data['type'].find(':')] if ':' in data['type'] else data['type']
+    def create_resource(data: dict) -> K8sResource:
+        resource_type: str = data['type'][0:data['type'].find(':')] if ':' in data['type'] else data['type']
 
-    # search for the K8sResource subclass to pass execution to
-    for type, info in k8s_object_types.items():
-        if resource_type == type:
-            if 'config' in data and 'manifest' in data['config']:
-                manifest: dict = data['config']['manifest']
-                if 'kind' not in manifest:
-                    manifest['kind'] = info['kind']
-                if 'apiVersion' not in manifest:
-                    manifest['apiVersion'] = info['api_version']
+        # search for the K8sResource subclass to pass execution to
+        for type, info in k8s_object_types.items():
+            if resource_type == type:
+                if 'config' in data and 'manifest' in data['config']:
+                    manifest: dict = data['config']['manifest']
+                    if 'kind' not in manifest:
+                        manifest['kind'] = info['kind']
+                    if 'apiVersion' not in manifest:
+                        manifest['apiVersion'] = info['api_version']
+                return info['factory'](data=data)
 
-            info['factory'](data=data).execute()
-            return
+        # no resource handler found!
+        raise Exception(f"resource type '{data['type']}' is not supported (this should not happen)")
 
-    # no resource handler found!
-    raise Exception(f"resource type '{data['type']}' is not supported (this should not happen)")
+    # the resource type is read from stdin, along with all the other information Deployster sends (or from each
+    # request, when serving as a worker)
+    resource_main(create_resource)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Union
+
+
+class JsonCache:
+    """Directory of JSON documents, keyed by arbitrary strings. Failures to write (eg. read-only directory) are not
+    fatal - they simply disable further writes."""
+
+    def __init__(self, path: Path, enabled: bool = True) -> None:
+        super().__init__()
+        self._path: Path = path
+        self._enabled: bool = enabled
+        self._writable: bool = True
+        self._lock: threading.Lock = threading.Lock()
+        self._hits: int = 0
+        self._misses: int = 0
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled
+
+    @property
+    def writable(self) -> bool:
+        return self._writable
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    @staticmethod
+    def hash(value: Any) -> str:
+        return hashlib.sha256(json.dumps(value, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _file(self, key: str) -> Path:
+        return self._path / f"{JsonCache.hash(key)}.json"
+
+    def peek(self, key: str) -> Union[None, Any]:
+        """Returns the value cached for the given key (or None), without affecting the hit/miss counters."""
+        if not self._enabled:
+            return None
+        try:
+            with open(self._file(key), 'r') as f:
+                entry: dict = json.loads(f.read())
+            return entry['value'] if entry['key'] == key else None
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def get(self, key: str) -> Union[None, Any]:
+        value: Any = self.peek(key)
+        if self._enabled:
+            with self._lock:
+                if value is None:
+                    self._misses += 1
+                else:
+                    self._hits += 1
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        if not self._enabled or not self._writable:
+            return
+        file: Path = self._file(key)
+        temp_file: Path = file.with_name(f"{file.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            os.makedirs(str(self._path), exist_ok=True)
+            with open(temp_file, 'w') as f:
+                f.write(json.dumps({'key': key, 'value': value}))
+            os.replace(str(temp_file), str(file))
+        except OSError:
+            self._writable = False
+
+    def delete(self, key: str) -> None:
+        if not self._enabled or not self._writable:
+            return
+        try:
+            os.remove(str(self._file(key)))
+        except FileNotFoundError:
+            pass
+        except OSError:
+            self._writable = False
+
+
+class InitCache:
+    """Caches results of the 'init' action of resource images.
+
+    Init results are a function of the image and of the init input (excluding the resource name), so entries are keyed
+    by the image ID (digest) and that input. Since the image ID changes whenever a tag is re-pointed to a new image,
+    such entries are naturally invalidated; the entry previously associated with the tag is removed as well."""
+
+    def __init__(self, path: Path, enabled: bool = True) -> None:
+        super().__init__()
+        self._entries: JsonCache = JsonCache(path=path, enabled=enabled)
+
+    @property
+    def enabled(self) -> bool:
+        return self._entries.enabled
+
+    @property
+    def writable(self) -> bool:
+        return self._entries.writable
+
+    @property
+    def hits(self) -> int:
+        return self._entries.hits
+
+    @property
+    def misses(self) -> int:
+        return self._entries.misses
+
+    @staticmethod
+    def _key(image_id: str, input: dict) -> str:
+        return 'init:' + JsonCache.hash({
+            'image_id': image_id,
+            'input': {k: v for k, v in input.items() if k != 'name'}
+        })
+
+    def get(self, image_id: str, input: dict) -> Union[None, dict]:
+        return self._entries.get(InitCache._key(image_id, input))
+
+    def put(self, image: str, image_id: str, input: dict, result: dict) -> None:
+        key: str = InitCache._key(image_id, input)
+        tag_key: str = f"tag:{image}:" + JsonCache.hash({k: v for k, v in input.items() if k != 'name'})
+
+        # if the tag used to point to a different image, its cached result is stale
+        previous_key: str = self._entries.peek(tag_key)
+        if previous_key is not None and previous_key != key:
+            self._entries.delete(previous_key)
+
+        self._entries.put(key, result)
+        self._entries.put(tag_key, key)
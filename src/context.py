@@ -1,5 +1,7 @@
+import datetime
 import os
 import re
+import uuid
 from enum import Enum, auto, unique
 from pathlib import Path
 from typing import Any
@@ -35,11 +37,28 @@ class Context:
         self.add_variable('_verbose',
                           True if "VERBOSE" in env and env["VERBOSE"].lower() in ['1', 'yes', 'true'] else False)
 
+        # unique ID of this run (used to label Docker containers created by it)
+        self.add_variable('_run_id', f"{datetime.datetime.utcnow():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}")
+
         # work paths
         self.add_variable('_conf', env["CONF_DIR"] if 'CONF_DIR' in env else os.path.expanduser('~/.deployster'))
         self.add_variable('_workspace', env["WORKSPACE_DIR"] if 'WORKSPACE_DIR' in env else os.path.abspath('.'))
         self.add_variable('_work', env["WORK_DIR"] if 'WORK_DIR' in env else os.path.abspath('./work'))
         self.add_variable('_confirm', ConfirmationMode.ACTION.name)
+        self.add_variable('_parallelism', 1)
+        self.add_variable('_init_cache', True)
+        self.add_variable('_manifest_cache', True)
+        self.add_variable('_journal', False)
+        self.add_variable('_lazy_init', False)
+        self.add_variable('_strict_verify', False)
+        self.add_variable('_workers', False)
+        self.add_variable('_in_process', False)
+        self.add_variable('_builtins_dir', env["BUILTINS_DIR"] if 'BUILTINS_DIR' in env
+                          else os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'resources', 'src')))
+        self.add_variable('_pull_parallelism', 4)
+        self.add_variable('_docker_backend', 'cli')
+        self.add_variable('_docker_socket',
+                          env["DOCKER_SOCKET"] if 'DOCKER_SOCKET' in env else '/var/run/docker.sock')
 
     def load_auto_files(self) -> None:
         if os.path.exists(self.conf_dir) and os.path.isdir(self.conf_dir):
@@ -59,6 +78,104 @@ class Context:
     def confirm(self, value: ConfirmationMode):
         self.add_variable('_confirm', value.name)
 
+    @property
+    def parallelism(self) -> int:
+        return self._data['_parallelism']
+
+    @parallelism.setter
+    def parallelism(self, value: int):
+        if value < 1:
+            raise UserError(f"illegal config: parallelism must be at least 1 (got {value})")
+        self.add_variable('_parallelism', value)
+
+    @property
+    def pull_parallelism(self) -> int:
+        return self._data['_pull_parallelism']
+
+    @pull_parallelism.setter
+    def pull_parallelism(self, value: int):
+        if value < 1:
+            raise UserError(f"illegal config: pull parallelism must be at least 1 (got {value})")
+        self.add_variable('_pull_parallelism', value)
+
+    @property
+    def init_cache(self) -> bool:
+        return self._data['_init_cache']
+
+    @init_cache.setter
+    def init_cache(self, value: bool):
+        self.add_variable('_init_cache', value)
+
+    @property
+    def run_id(self) -> str:
+        return self._data['_run_id']
+
+    @property
+    def manifest_cache(self) -> bool:
+        return self._data['_manifest_cache']
+
+    @manifest_cache.setter
+    def manifest_cache(self, value: bool):
+        self.add_variable('_manifest_cache', value)
+
+    @property
+    def lazy_init(self) -> bool:
+        return self._data['_lazy_init']
+
+    @lazy_init.setter
+    def lazy_init(self, value: bool):
+        self.add_variable('_lazy_init', value)
+
+    @property
+    def workers(self) -> bool:
+        return self._data['_workers']
+
+    @workers.setter
+    def workers(self, value: bool):
+        self.add_variable('_workers', value)
+
+    @property
+    def strict_verify(self) -> bool:
+        return self._data['_strict_verify']
+
+    @strict_verify.setter
+    def strict_verify(self, value: bool):
+        self.add_variable('_strict_verify', value)
+
+    @property
+    def in_process(self) -> bool:
+        return self._data['_in_process']
+
+    @in_process.setter
+    def in_process(self, value: bool):
+        self.add_variable('_in_process', value)
+
+    @property
+    def builtins_dir(self) -> Path:
+        return Path(self._data['_builtins_dir'])
+
+    @property
+    def journal(self) -> bool:
+        return self._data['_journal']
+
+    @journal.setter
+    def journal(self, value: bool):
+        self.add_variable('_journal', value)
+
+    @property
+    def docker_backend(self) -> str:
+        return self._data['_docker_backend']
+
+    @docker_backend.setter
+    def docker_backend(self, value: str):
+        if value not in ['cli', 'api']:
+            raise UserError(f"illegal config: unknown Docker backend '{value}' (must be 'cli' or 'api')")
+        self.add_variable('_docker_backend', value)
+
+    @property
+    def docker_socket(self) -> str:
+        return self._data['_docker_socket']
+
     @property
     def conf_dir(self) -> Path:
         return Path(self._data['_conf'])
@@ -86,7 +203,7 @@ class Context:
     def add_file(self, path: str) -> None:
         with open(path, 'r') as stream:
             try:
-                source = yaml.load(stream.read())
+                source = util.load_yaml(stream.read())
             except yaml.YAMLError as e:
                 raise UserError(f"illegal config: malformed variables file at '{path}': {e}") from e
             merge_into(self._data, util.post_process(value=source, context=self.data))
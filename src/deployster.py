@@ -1,18 +1,26 @@
 #!/usr/bin/env python3
 
 import argparse
+import json
 import os
+import sys
 import termios
 import traceback
 from pathlib import Path
+from typing import Sequence
 
 from colors import bold, underline, green
 
 from context import Context, ConfirmationMode
+from docker import DockerInvoker, InProcessDockerInvoker, create_docker_invoker
 # from plan import Plan
 from executor import Executor
+from journal import Journal
 from manifest import Manifest
+from timing import Timings
+from tracing import write_trace
 from util import UserError, Logger
+from worker import WorkerPool
 
 
 def parse_arguments(context: Context):
@@ -64,15 +72,132 @@ def parse_arguments(context: Context):
                                help='makes the given variable available to the deployment manifest')
         argparser.add_argument('--var-file', action=VariablesFileAction, metavar='FILE', dest='context',
                                help='makes the variables in the given file available to the deployment manifest')
+        argparser.add_argument('-j', '--parallelism', type=int, default=1, metavar='N', dest='parallelism',
+                               help='maximum number of resources to execute concurrently (default is 1)')
+        argparser.add_argument('--pull-parallelism', type=int, default=4, metavar='N', dest='pull_parallelism',
+                               help='maximum number of Docker images to pull concurrently (default is 4)')
+        argparser.add_argument('--no-init-cache', action='store_false', dest='init_cache',
+                               help='always run the resources\' "init" action, ignoring cached results')
+        argparser.add_argument('--no-manifest-cache', action='store_false', dest='manifest_cache',
+                               help='always parse & validate manifest files, ignoring cached results')
+        argparser.add_argument('--lazy-init', action='store_true', dest='lazy_init',
+                               help='defer resources\' "init" action until their config is resolved, combining it '
+                                    'with the "state" action for resources that support it')
+        argparser.add_argument('--strict-verify', action='store_true', dest='strict_verify',
+                               help='always verify resources by invoking their "state" action after applying them, '
+                                    'even if their last action reported their new state')
+        argparser.add_argument('--workers', action='store_true', dest='workers',
+                               help='serve resources\' actions via long-lived worker containers (per image), for '
+                                    'resources that support it (requires the "cli" Docker backend)')
+        argparser.add_argument('--in-process', action='store_true', dest='in_process',
+                               help='execute built-in resources (the "infolinks/deployster-*" images) in host '
+                                    'processes rather than in Docker containers')
+        argparser.add_argument('--docker-backend', default='cli', choices=['cli', 'api'], dest='docker_backend',
+                               help='invoke resources via the "docker" command (cli), or directly via the Docker '
+                                    'Engine API socket (api); default is "cli"')
+        argparser.add_argument('--journal', action='store_true', dest='journal',
+                               help='record all invocations in a single append-only journal (journal.jsonl in the '
+                                    'work directory) instead of per-invocation files; see "deployster.py logs"')
+        argparser.add_argument('--trace', metavar='FILE', dest='trace',
+                               help='write a Chrome trace-event file of the run (viewable in chrome://tracing or '
+                                    'Perfetto)')
         argparser.add_argument('manifests', nargs='+', help='the deployment manifest to execute.')
         argparser.add_argument('-v', '--verbose', action='store_true', dest='verbose', help="increase verbosity")
         return argparser.parse_args()
 
 
+def parse_gc_arguments(context: Context):
+    argparser = argparse.ArgumentParser(prog='deployster.py gc',
+                                        description=f"Removes containers left behind by previous deployster runs "
+                                                    f"(eg. crashed or interrupted runs).")
+    argparser.add_argument('--run', metavar='RUN_ID', dest='run_id',
+                           help='only remove containers created by the given run')
+    argparser.add_argument('--all', action='store_true', dest='include_running',
+                           help='remove running containers too (by default, only stopped containers are removed)')
+    argparser.add_argument('--docker-backend', default='cli', choices=['cli', 'api'], dest='docker_backend',
+                           help='use the "docker" command (cli), or the Docker Engine API socket (api)')
+    argparser.add_argument('-v', '--verbose', action='store_true', dest='verbose', help="increase verbosity")
+    return argparser.parse_args(sys.argv[2:])
+
+
+def gc(context: Context) -> None:
+    args = parse_gc_arguments(context)
+    context.verbose = args.verbose
+    context.docker_backend = args.docker_backend
+
+    with Logger(f":wastebasket: {underline('Garbage collection:')}") as logger:
+        invoker: DockerInvoker = create_docker_invoker(context=context)
+        container_ids: Sequence[str] = invoker.prune_containers(run_id=args.run_id, include_running=args.include_running)
+        if context.verbose:
+            for container_id in container_ids:
+                logger.info(f":heavy_minus_sign: {container_id[0:12]}")
+        logger.info(f":heavy_check_mark: Removed {len(container_ids)} container(s)")
+
+
+def parse_logs_arguments(context: Context):
+    argparser = argparse.ArgumentParser(prog='deployster.py logs',
+                                        description=f"Displays the invocations recorded in a run journal (see the "
+                                                    f"'--journal' flag).")
+    argparser.add_argument('--file', metavar='FILE', dest='file', default=str(context.work_dir / 'journal.jsonl'),
+                           help='the journal file to read (default is the journal of the last run)')
+    argparser.add_argument('--resource', metavar='NAME', dest='resource', help='only show invocations of this resource')
+    argparser.add_argument('--action', metavar='NAME', dest='action', help='only show invocations of this action')
+    argparser.add_argument('--invocation', metavar='ID', dest='invocation', help='only show the given invocation')
+    argparser.add_argument('-v', '--verbose', action='store_true', dest='verbose',
+                           help="show invocations' input (stdin) too")
+    return argparser.parse_args(sys.argv[2:])
+
+
+def logs(context: Context) -> None:
+    args = parse_logs_arguments(context)
+    context.verbose = args.verbose
+
+    path: Path = Path(args.file).absolute()
+    if not path.exists():
+        raise UserError(f"journal file '{path}' does not exist (was the run executed with '--journal'?)")
+
+    for invocation in Journal.invocations(path):
+        if args.resource and invocation['resource'] != args.resource:
+            continue
+        elif args.action and invocation['action'] != args.action:
+            continue
+        elif args.invocation and invocation['id'] != args.invocation:
+            continue
+
+        if invocation['exit_code'] is None:
+            status: str = 'incomplete'
+        else:
+            status: str = f"exit code {invocation['exit_code']}, {invocation['end'] - invocation['start']:.3f}s"
+        header: str = f"{invocation['resource']} ({invocation['action']}) :point_right: {invocation['image']}"
+        with Logger(f":page_facing_up: {underline(header)} [{invocation['id']}, {status}]") as logger:
+            if context.verbose and invocation['stdin'] is not None:
+                logger.info(bold('stdin:'))
+                for line in json.dumps(invocation['stdin'], indent=2).split('\n'):
+                    logger.info(line)
+            if invocation['stdout']:
+                logger.info(bold('stdout:'))
+                for line in invocation['stdout']:
+                    logger.info(line)
+            if invocation['stderr']:
+                logger.info(bold('stderr:'))
+                for line in invocation['stderr']:
+                    logger.info(line)
+
+
 def main():
     # create the shared context
     context: Context = Context()
     try:
+        # the "gc" subcommand only prunes containers of previous runs
+        if len(sys.argv) > 1 and sys.argv[1] == 'gc':
+            gc(context)
+            return
+
+        # the "logs" subcommand only displays the journal of a previous run
+        elif len(sys.argv) > 1 and sys.argv[1] == 'logs':
+            logs(context)
+            return
+
         # load the auto files from user home and cwd
         context.load_auto_files()
 
@@ -80,6 +205,18 @@ def main():
         args = parse_arguments(context)
         context.verbose = args.verbose
         context.confirm = ConfirmationMode[args.confirm]
+        context.parallelism = args.parallelism
+        context.pull_parallelism = args.pull_parallelism
+        context.init_cache = args.init_cache
+        context.manifest_cache = args.manifest_cache
+        context.lazy_init = args.lazy_init
+        context.strict_verify = args.strict_verify
+        context.workers = args.workers
+        context.in_process = args.in_process
+        context.docker_backend = args.docker_backend
+        context.journal = args.journal
+        if context.workers and context.docker_backend != 'cli':
+            raise UserError("illegal config: '--workers' requires the \"cli\" Docker backend")
 
         # print a cool header now...
         print('')
@@ -94,10 +231,25 @@ def main():
         manifest: Manifest = Manifest(context=context, manifest_files=[Path(p).absolute() for p in args.manifests])
         manifest.display_plugs()
 
-        # build the deployment plan, display, and potentially execute it
+        # build the deployment plan, display, and potentially execute it; timings are reported even if it fails
         executor: Executor = Executor(manifest=manifest)
-        executor.bootstrap()
-        executor.execute()
+        try:
+            executor.bootstrap()
+            executor.execute()
+        finally:
+            if context.workers:
+                WorkerPool.shared().close()
+            if context.in_process:
+                InProcessDockerInvoker.shutdown()
+            if context.journal:
+                Journal.for_path(context.work_dir / 'journal.jsonl').close()
+            Timings.display()
+            Timings.write_report(context.work_dir / 'timings.json', run_id=context.run_id)
+            if args.trace:
+                write_trace(path=Path(args.trace).absolute(),
+                            spans=Timings.spans(),
+                            dependencies={r.name: [d.name for d in r.dependencies.values()]
+                                          for r in manifest.resources.values()})
 
     except UserError as e:
         with Logger(indent_amount=0, spacious=False) as logger:
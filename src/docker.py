@@ -1,81 +1,275 @@
+import base64
 import datetime
+import http.client
+import importlib
+import io
 import json
 import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout, redirect_stderr
 from io import TextIOWrapper
 from pathlib import Path
 from subprocess import Popen, PIPE
+from tempfile import TemporaryFile
 from threading import Thread
-from time import sleep
-from typing import Sequence, MutableSequence, Tuple
+from typing import Sequence, MutableSequence, Tuple, Union, MutableMapping, Any, Callable, Mapping, TextIO
+from urllib.parse import quote, urlencode
 
+from context import Context
+from journal import Journal
+from timing import Timings
 from util import UserError, Logger
+from worker import Worker, WorkerPool
+
+# labels attached to every container created by deployster
+RUN_LABEL = 'deployster.run'
+RESOURCE_LABEL = 'deployster.resource'
+
+# registry of images whose name does not start with a registry host (as named in Docker CLI configurations)
+DOCKER_HUB_REGISTRY = 'https://index.docker.io/v1/'
+
+# container states considered leftovers (as opposed to containers that are still running)
+STOPPED_STATES = ['created', 'exited', 'dead']
+
+# built-in resource images, mapped to their Python module & the environment their Dockerfile sets up
+BUILTIN_IMAGE_PATTERN = re.compile(r'^infolinks/deployster-(?P<name>[^:]+)(?::.+)?$')
+GCP_ENVIRONMENT = {'GOOGLE_APPLICATION_CREDENTIALS': '/deployster/service-account.json'}
+K8S_ENVIRONMENT = {'KUBECONFIG': '/root/.kube/config'}
+BUILTIN_RESOURCES: Mapping[str, Tuple[str, Mapping[str, str]]] = {
+    'gcp-cloud-sql': ('gcp_cloud_sql', GCP_ENVIRONMENT),
+    'gcp-compute-ip-address': ('gcp_compute_ip_address', GCP_ENVIRONMENT),
+    'gcp-gke-cluster': ('gcp_gke_cluster', dict(GCP_ENVIRONMENT, **K8S_ENVIRONMENT)),
+    'gcp-iam-policy': ('gcp_iam_policy', GCP_ENVIRONMENT),
+    'gcp-iam-service-account': ('gcp_iam_service_account', GCP_ENVIRONMENT),
+    'gcp-project': ('gcp_project', GCP_ENVIRONMENT),
+    'k8s': ('k8s_main', K8S_ENVIRONMENT),
+}
+
+# host tools that built-in resource modules execute (their images provide them, but the host must too when in-process)
+BUILTIN_TOOLS: Mapping[str, Sequence[str]] = {
+    'gcp_cloud_sql': ['/usr/local/bin/cloud_sql_proxy'],
+    'gcp_gke_cluster': ['gcloud'],
+    'k8s_main': ['kubectl'],
+}
+
+
+class InvocationLog:
+    """Records the input & output of a single invocation: either as separate stdin, stdout & stderr files in the
+    invocation's work dir (the default), or as records in the run journal (if one is given)."""
+
+    def __init__(self, local_work_dir: Path, image: str, journal: Journal = None) -> None:
+        super().__init__()
+        self._journal: Journal = journal
+
+        # the timestamp serves as a unique invocation ID in the work dir
+        timestamp: str = datetime.datetime.utcnow().isoformat("T") + "Z"
+        if journal is None:
+            self._id: str = timestamp
+            os.makedirs(str(local_work_dir), exist_ok=True)
+            self._local_work_dir: Path = local_work_dir
+            self._files: MutableMapping[str, TextIO] = {
+                'out': open(local_work_dir / f"stdout-{timestamp}.json", 'w'),
+                'err': open(local_work_dir / f"stderr-{timestamp}.json", 'w')
+            }
+        else:
+            self._id: str = f"{timestamp}-{uuid.uuid4().hex[0:8]}"
+
+            # work dirs are structured as "<work dir>/<resource>/<action>"
+            try:
+                parts: Sequence[str] = local_work_dir.absolute().relative_to(journal.path.parent.absolute()).parts
+            except ValueError:
+                parts: Sequence[str] = [str(local_work_dir)]
+            self._resource: str = parts[0] if parts else None
+            self._action: str = '/'.join(parts[1:]) if len(parts) > 1 else None
+            self._image: str = image
+
+    @property
+    def id(self) -> str:
+        return self._id
+
+    def input(self, input: dict) -> None:
+        if self._journal is not None:
+            self._journal.append('start', self._id, resource=self._resource, action=self._action, image=self._image,
+                                 stdin=input)
+        elif input is not None:
+            with open(self._local_work_dir / f"stdin-{self._id}.json", 'w') as f:
+                f.write(json.dumps(input if input else {}, indent=2))
+
+    def stdout(self, line: str) -> None:
+        if self._journal is not None:
+            self._journal.append('out', self._id, line=line)
+        else:
+            self._files['out'].write(line + '\n')
+
+    def stderr(self, line: str) -> None:
+        if self._journal is not None:
+            self._journal.append('err', self._id, line=line)
+        else:
+            self._files['err'].write(line + '\n')
+
+    def close(self, exit_code: int) -> None:
+        if self._journal is not None:
+            self._journal.append('exit', self._id, code=exit_code)
+        else:
+            for file in self._files.values():
+                file.close()
 
 
 class DockerInvoker:
 
-    def __init__(self, volumes: Sequence[str] = None) -> None:
+    def __init__(self,
+                 volumes: Sequence[str] = None,
+                 labels: Mapping[str, str] = None,
+                 journal: Journal = None,
+                 workers: WorkerPool = None) -> None:
         super().__init__()
         self._volumes: Sequence[str] = volumes
+        self._labels: Mapping[str, str] = labels if labels else {}
+        self._journal: Journal = journal
+        self._workers: WorkerPool = workers
+        self._worker_actions: MutableMapping[str, Tuple[str, Sequence[str]]] = {}
 
-    def _invoke(self,
-                local_work_dir: Path,
-                container_work_dir: str,
-                image: str,
-                entrypoint: str = None,
-                args: Sequence[str] = None,
-                input: dict = None,
-                stderr_logger: Logger = None,
-                stdout_logger: Logger = None) -> Tuple[int, str, str]:
+    @property
+    def volumes(self) -> Sequence[str]:
+        return self._volumes
 
-        # the timestamp serves as a unique invocation ID in the work dir
-        timestamp = datetime.datetime.utcnow().isoformat("T") + "Z"
-        os.makedirs(str(local_work_dir), exist_ok=True)
-        stderr_file = local_work_dir / f"stderr-{timestamp}.json"
-        stdout_file = local_work_dir / f"stdout-{timestamp}.json"
+    @volumes.setter
+    def volumes(self, volumes: Sequence[str]) -> None:
+        self._volumes = volumes
 
-        # save the input we will send to the process in the work_dir (for reference)
-        if input is not None:
-            with open(local_work_dir / f"stdin-{timestamp}.json", 'w') as f:
-                f.write(json.dumps(input if input else {}, indent=2))
+    @property
+    def labels(self) -> Mapping[str, str]:
+        return self._labels
+
+    @property
+    def journal(self) -> Journal:
+        return self._journal
+
+    @property
+    def workers(self) -> WorkerPool:
+        return self._workers
+
+    def set_worker_action(self, image: str, entrypoint: str = None, args: Sequence[str] = None) -> None:
+        """Declares that the given image can serve invocations as a long-lived worker, started with the given
+        entrypoint & args. Invocations of that image with its default entrypoint are then sent to a warm worker (if
+        this invoker has a worker pool), rather than to a fresh container."""
+        self._worker_actions[image] = (entrypoint, args)
+
+    def inspect_image_id(self, image: str) -> Union[None, str]:
+        """Returns the ID (digest) of the given image, or None if the image is not available locally."""
+        process = subprocess.run(["docker", "image", "inspect", "--format={{.Id}}", image],
+                                 stdout=PIPE, stderr=PIPE, universal_newlines=True)
+        return process.stdout.strip() if process.returncode == 0 and process.stdout.strip() else None
+
+    def pull(self, image: str) -> None:
+        process = subprocess.run(["docker", "pull", image], stdout=PIPE, stderr=PIPE, universal_newlines=True)
+        if process.returncode != 0:
+            raise UserError(f"failed pulling image '{image}': {process.stderr.strip()}")
+
+    def prune_containers(self, run_id: str = None, include_running: bool = False) -> Sequence[str]:
+        """Removes containers created by deployster (optionally only those of the given run), returning their IDs."""
+        cmd: MutableSequence[str] = ["docker", "ps", "--all", "--quiet", "--no-trunc",
+                                     "--filter", f"label={RUN_LABEL}={run_id}" if run_id else f"label={RUN_LABEL}"]
+        if not include_running:
+            for state in STOPPED_STATES:
+                cmd.extend(["--filter", f"status={state}"])
+        process = subprocess.run(cmd, stdout=PIPE, stderr=PIPE, universal_newlines=True)
+        if process.returncode != 0:
+            raise UserError(f"failed listing containers: {process.stderr.strip()}")
+        container_ids: Sequence[str] = process.stdout.split()
+        if container_ids:
+            process = subprocess.run(["docker", "rm", "--force"] + container_ids,
+                                     stdout=PIPE, stderr=PIPE, universal_newlines=True)
+            if process.returncode != 0:
+                raise UserError(f"failed removing containers: {process.stderr.strip()}")
+        return container_ids
+
+    def _command(self,
+                 container_work_dir: str,
+                 image: str,
+                 entrypoint: str = None,
+                 args: Sequence[str] = None,
+                 labels: Mapping[str, str] = None) -> Sequence[str]:
 
         # build the full "docker run ..." command (volumes, entrypoint, image & args)
-        cmd: MutableSequence[str] = ["docker", "run", "-i", f"--workdir={container_work_dir}"]
+        cmd: MutableSequence[str] = ["docker", "run", "-i", "--rm", f"--workdir={container_work_dir}"]
+        for name, value in (labels if labels is not None else self._labels).items():
+            cmd.extend(["--label", f"{name}={value}"])
         for volume in self._volumes if self._volumes is not None else []:
             cmd.extend(["--volume", volume])
         if entrypoint is not None: cmd.extend(["--entrypoint", entrypoint])
         cmd.append(image)
         if args:
             cmd.extend(args)
+        return cmd
+
+    def _invoke(self,
+                local_work_dir: Path,
+                container_work_dir: str,
+                image: str,
+                entrypoint: str = None,
+                args: Sequence[str] = None,
+                input: dict = None,
+                stderr_logger: Logger = None,
+                stdout_logger: Logger = None) -> Tuple[int, str, str]:
+
+        # save the input we will send to the process (for reference)
+        log: InvocationLog = InvocationLog(local_work_dir=local_work_dir, image=image, journal=self._journal)
+        log.input(input)
 
         # start the process
+        cmd: Sequence[str] = self._command(container_work_dir=container_work_dir,
+                                           image=image,
+                                           entrypoint=entrypoint,
+                                           args=args)
+        started: float = time.time()
         process = Popen(cmd, shell=False, stdin=PIPE, stdout=PIPE, stderr=PIPE, universal_newlines=True)
 
-        # thread handler for writing stderr to file, and optionally to a given logger
+        # the "docker" CLI does not tell us when the container actually started, so the invocation is split at its first
+        # output instead (which includes the resource's own start-up, unlike the Engine API's "container start" span)
+        first_output: MutableSequence[float] = []
+
+        # output is kept in memory (to be returned), as well as logged
+        stdout_lines: MutableSequence[str] = []
+        stderr_lines: MutableSequence[str] = []
+
+        # thread handler for logging stderr, and optionally writing it to a given logger
         def stderr_handler(stream: TextIOWrapper):
-            with open(stderr_file, 'w') as f:
-                for line in iter(stream.readline, ''):
-                    line = line[0:len(line) - 1]
-                    f.write(line + '\n')
-                    if stderr_logger:
-                        stderr_logger.info(line)
-
-        # thread handler for writing stdout to file, and optionally to a given logger
+            for line in iter(stream.readline, ''):
+                first_output.append(time.time())
+                line = line[0:len(line) - 1] if line.endswith('\n') else line
+                log.stderr(line)
+                stderr_lines.append(line)
+                if stderr_logger:
+                    stderr_logger.info(line)
+
+        # thread handler for logging stdout, and optionally writing it to a given logger
         def stdout_handler(stream: TextIOWrapper):
-            with open(stdout_file, 'w') as f:
-                for line in iter(stream.readline, ''):
-                    line = line[0:len(line) - 1]
-                    f.write(line + '\n')
-                    if stdout_logger:
-                        stdout_logger.info(line)
+            for line in iter(stream.readline, ''):
+                first_output.append(time.time())
+                line = line[0:len(line) - 1] if line.endswith('\n') else line
+                log.stdout(line)
+                stdout_lines.append(line)
+                if stdout_logger:
+                    stdout_logger.info(line)
 
         # setup output threads
         stderr_thread = Thread(target=stderr_handler,
-                               name=f"{image}-{timestamp}-stderr",
+                               name=f"{image}-{log.id}-stderr",
                                kwargs={'stream': process.stderr},
                                daemon=True) if stderr_handler else None
         stderr_thread.start()
         stdout_thread = Thread(target=stdout_handler,
-                               name=f"{image}-{timestamp}-stdout",
+                               name=f"{image}-{log.id}-stdout",
                                kwargs={'stream': process.stdout},
                                daemon=True) if stdout_handler else None
         stdout_thread.start()
@@ -85,16 +279,104 @@ class DockerInvoker:
             process.stdin.write(json.dumps(input, indent=2))
             process.stdin.close()
 
-        # while process is alive, pipe stderr to console, and stdout into memory
-        while process.poll() is None:
-            sleep(1)
-
-        # ensure threads are done
+        # block until the process exits, and until its output has been fully consumed by the output threads (rather
+        # than polling, so short-lived processes do not incur extra latency)
+        process.wait()
         stderr_thread.join()
         stdout_thread.join()
+        log.close(process.returncode)
+        ended: float = time.time()
+        output: float = min(first_output) if first_output else ended
+        Timings.record('time to first output', 'docker', start=started, end=output, image=image)
+        Timings.record('after first output', 'docker', start=output, end=ended, image=image)
+
+        return process.returncode, ''.join(line + '\n' for line in stdout_lines), \
+               ''.join(line + '\n' for line in stderr_lines)
+
+    def _dispatch(self,
+                  local_work_dir: Path,
+                  container_work_dir: str,
+                  image: str,
+                  entrypoint: str = None,
+                  args: Sequence[str] = None,
+                  input: dict = None,
+                  stderr_logger: Logger = None,
+                  stdout_logger: Logger = None) -> Tuple[int, str, str]:
+        """Invokes the given image in a warm worker if possible, or in a fresh container otherwise."""
+
+        # workers serve the actions of their image's default entrypoint; the first argument is the action name
+        if self._workers is not None and image in self._worker_actions and entrypoint is None and args:
+            return self._invoke_worker(local_work_dir=local_work_dir,
+                                       container_work_dir=container_work_dir,
+                                       image=image,
+                                       args=args,
+                                       input=input,
+                                       stderr_logger=stderr_logger,
+                                       stdout_logger=stdout_logger)
+        else:
+            return self._invoke(local_work_dir=local_work_dir,
+                                container_work_dir=container_work_dir,
+                                image=image,
+                                entrypoint=entrypoint,
+                                args=args,
+                                input=input,
+                                stderr_logger=stderr_logger,
+                                stdout_logger=stdout_logger)
 
-        # validate exit-code is zero, and if so, parse stdout into JSON, save it to file, and return JSON as dict
-        return process.returncode, open(stdout_file, 'r').read(), open(stderr_file, 'r').read()
+    def _invoke_worker(self,
+                       local_work_dir: Path,
+                       container_work_dir: str,
+                       image: str,
+                       args: Sequence[str],
+                       input: dict = None,
+                       stderr_logger: Logger = None,
+                       stdout_logger: Logger = None) -> Tuple[int, str, str]:
+
+        # save the input we will send to the worker (for reference)
+        log: InvocationLog = InvocationLog(local_work_dir=local_work_dir, image=image, journal=self._journal)
+        log.input(input)
+
+        # output is kept in memory (to be returned), as well as logged
+        stdout_lines: MutableSequence[str] = []
+        stderr_lines: MutableSequence[str] = []
+
+        def stdout_handler(line: str) -> None:
+            log.stdout(line)
+            stdout_lines.append(line)
+            if stdout_logger:
+                stdout_logger.info(line)
+
+        def stderr_handler(line: str) -> None:
+            log.stderr(line)
+            stderr_lines.append(line)
+            if stderr_logger:
+                stderr_logger.info(line)
+
+        # workers are shared by all resources of the same image (& volumes), so they only carry the run's label
+        worker_entrypoint, worker_args = self._worker_actions[image]
+        cmd: Sequence[str] = self._command(container_work_dir=container_work_dir,
+                                           image=image,
+                                           entrypoint=worker_entrypoint,
+                                           args=worker_args,
+                                           labels={k: v for k, v in self._labels.items() if k != RESOURCE_LABEL})
+        worker: Worker = self._workers.acquire(command=cmd, image=image)
+        exit_code: int = None
+        started: float = time.time()
+        try:
+            exit_code = worker.request(method=args[0],
+                                       params={'args': list(args[1:]), 'input': input},
+                                       stdout_handler=stdout_handler,
+                                       stderr_handler=stderr_handler)
+        except BaseException:
+            self._workers.discard(worker)
+            raise
+        else:
+            self._workers.release(worker)
+        finally:
+            log.close(exit_code)
+        Timings.record('worker request', 'docker', start=started, end=time.time(), image=image)
+
+        return exit_code, ''.join(line + '\n' for line in stdout_lines), ''.join(line + '\n' for line in stderr_lines)
 
     def run(self,
             logger: Logger,
@@ -103,19 +385,22 @@ class DockerInvoker:
             image: str,
             entrypoint: str = None,
             args: Sequence[str] = None,
-            input: dict = None) -> None:
+            input: dict = None) -> str:
+        """Invokes the given image, logging its output as it goes; returns its standard output."""
 
-        return_code, stdout, stderr = self._invoke(local_work_dir=local_work_dir,
-                                                   container_work_dir=container_work_dir,
-                                                   image=image,
-                                                   entrypoint=entrypoint,
-                                                   args=args,
-                                                   input=input,
-                                                   stderr_logger=logger,
-                                                   stdout_logger=logger)
+        with Timings.span('invocation', 'docker', image=image):
+            return_code, stdout, stderr = self._dispatch(local_work_dir=local_work_dir,
+                                                         container_work_dir=container_work_dir,
+                                                         image=image,
+                                                         entrypoint=entrypoint,
+                                                         args=args,
+                                                         input=input,
+                                                         stderr_logger=logger,
+                                                         stdout_logger=logger)
 
         if return_code != 0:
             raise UserError(f"Docker command terminated with exit code #{return_code}!")
+        return stdout
 
     def run_json(self,
                  logger: Logger,
@@ -126,13 +411,14 @@ class DockerInvoker:
                  args: Sequence[str] = None,
                  input: dict = None):
 
-        return_code, stdout, stderr = self._invoke(local_work_dir=local_work_dir,
-                                                   container_work_dir=container_work_dir,
-                                                   image=image,
-                                                   entrypoint=entrypoint,
-                                                   args=args,
-                                                   input=input,
-                                                   stderr_logger=logger)
+        with Timings.span('invocation', 'docker', image=image):
+            return_code, stdout, stderr = self._dispatch(local_work_dir=local_work_dir,
+                                                         container_work_dir=container_work_dir,
+                                                         image=image,
+                                                         entrypoint=entrypoint,
+                                                         args=args,
+                                                         input=input,
+                                                         stderr_logger=logger)
 
         if return_code != 0:
             raise UserError(f"Docker command terminated with exit code #{return_code}!")
@@ -143,3 +429,556 @@ class DockerInvoker:
                 raise UserError(f"Docker command provided invalid JSON: {e.msg}") from e
         else:
             raise UserError(f"Docker command did not provide any JSON back!")
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a Unix domain socket (eg. the Docker Engine socket)."""
+
+    def __init__(self, socket_path: str, timeout: float = None) -> None:
+        super().__init__('localhost', timeout=timeout)
+        self._socket_path: str = socket_path
+
+    def connect(self) -> None:
+        sock: socket.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self._socket_path)
+        self.sock = sock
+
+
+class DockerEngineInvoker(DockerInvoker):
+    """Invokes resource images by talking to the Docker Engine API directly over its Unix socket, rather than forking
+    the 'docker' command-line tool for every invocation.
+
+    Control requests (create, start, wait, etc) share a pool of keep-alive connections (per socket), while each
+    container's stdin/stdout/stderr are streamed over a dedicated "attach" connection, which is demultiplexed in the
+    calling thread."""
+
+    # idle keep-alive connections, per socket path
+    _connection_pools: MutableMapping[str, MutableSequence[UnixHTTPConnection]] = {}
+    _connection_pools_lock: threading.Lock = threading.Lock()
+
+    def __init__(self,
+                 volumes: Sequence[str] = None,
+                 labels: Mapping[str, str] = None,
+                 journal: Journal = None,
+                 socket_path: str = '/var/run/docker.sock') -> None:
+        super().__init__(volumes, labels, journal)
+        self._socket_path: str = socket_path
+
+    def _acquire_connection(self) -> UnixHTTPConnection:
+        with DockerEngineInvoker._connection_pools_lock:
+            pool = DockerEngineInvoker._connection_pools.setdefault(self._socket_path, [])
+            if pool:
+                return pool.pop()
+        return UnixHTTPConnection(self._socket_path)
+
+    def _release_connection(self, connection: UnixHTTPConnection) -> None:
+        with DockerEngineInvoker._connection_pools_lock:
+            DockerEngineInvoker._connection_pools.setdefault(self._socket_path, []).append(connection)
+
+    def _request(self,
+                 method: str,
+                 path: str,
+                 body: Any = None,
+                 headers: Mapping[str, str] = None) -> Tuple[int, bytes]:
+        headers: dict = dict(headers) if headers else {}
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+        payload: bytes = json.dumps(body).encode('utf-8') if body is not None else None
+
+        # pooled connections may have been closed by the server while idle; retry once on a fresh connection
+        for attempt in range(2):
+            connection: UnixHTTPConnection = self._acquire_connection() if attempt == 0 \
+                else UnixHTTPConnection(self._socket_path)
+            try:
+                connection.request(method, path, body=payload, headers=headers)
+                response: http.client.HTTPResponse = connection.getresponse()
+                data: bytes = response.read()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                connection.close()
+                if attempt == 0:
+                    continue
+                raise
+            except FileNotFoundError as e:
+                raise UserError(f"Docker Engine socket not found at '{self._socket_path}'") from e
+            if response.will_close:
+                connection.close()
+            else:
+                self._release_connection(connection)
+            return response.status, data
+
+    def _request_json(self, method: str, path: str, body: Any = None, expected: Sequence[int] = (200,)) -> Any:
+        status, data = self._request(method, path, body)
+        if status not in expected:
+            message: str = data.decode('utf-8', errors='replace').strip()
+            try:
+                message = json.loads(message)['message']
+            except (ValueError, KeyError, TypeError):
+                pass
+            raise UserError(f"Docker Engine request '{method} {path}' failed ({status}): {message}")
+        return json.loads(data.decode('utf-8')) if data else None
+
+    def ping(self) -> bool:
+        try:
+            status, data = self._request('GET', '/_ping')
+            return status == 200
+        except (OSError, UserError):
+            return False
+
+    def inspect_image_id(self, image: str) -> Union[None, str]:
+        status, data = self._request('GET', f"/images/{quote(image, safe='/:@')}/json")
+        return json.loads(data.decode('utf-8'))['Id'] if status == 200 else None
+
+    def prune_containers(self, run_id: str = None, include_running: bool = False) -> Sequence[str]:
+        filters: dict = {'label': [f"{RUN_LABEL}={run_id}" if run_id else RUN_LABEL]}
+        if not include_running:
+            filters['status'] = STOPPED_STATES
+        containers: Sequence[dict] = \
+            self._request_json('GET', f"/containers/json?{urlencode({'all': '1', 'filters': json.dumps(filters)})}")
+        for container in containers:
+            self._remove_container(container['Id'])
+        return [container['Id'] for container in containers]
+
+    def _remove_container(self, container_id: str) -> None:
+        self._request_json('DELETE', f"/containers/{container_id}?force=1", expected=(204, 404))
+
+    @staticmethod
+    def _registry(image: str) -> str:
+        parts: Sequence[str] = image.split('/')
+        if len(parts) > 1 and ('.' in parts[0] or ':' in parts[0] or parts[0] == 'localhost'):
+            return parts[0]
+        else:
+            return DOCKER_HUB_REGISTRY
+
+    @staticmethod
+    def registry_auth(image: str, config_dir: Path = None) -> Union[None, str]:
+        """Returns the "X-Registry-Auth" header for pulling the given image (or None for anonymous pulls), resolved from
+        the Docker CLI configuration the way the 'docker' CLI does: the registry's credential helper (or the default
+        credential store) first, and then the credentials stored in the configuration itself."""
+        config_dir: Path = config_dir if config_dir else Path(os.environ.get('DOCKER_CONFIG', Path.home() / '.docker'))
+        try:
+            with open(config_dir / 'config.json', 'r') as f:
+                config: dict = json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+        registry: str = DockerEngineInvoker._registry(image)
+        auth: dict = None
+        helper: str = config.get('credHelpers', {}).get(registry, config.get('credsStore'))
+        if helper:
+            try:
+                process = subprocess.run([f"docker-credential-{helper}", "get"], input=registry,
+                                         stdout=PIPE, stderr=PIPE, universal_newlines=True)
+            except OSError as e:
+                raise UserError(f"Docker credential helper 'docker-credential-{helper}' could not be executed: {e}")
+            if process.returncode == 0:
+                credentials: dict = json.loads(process.stdout)
+                if credentials['Username'] == '<token>':
+                    auth = {'identitytoken': credentials['Secret']}
+                else:
+                    auth = {'username': credentials['Username'], 'password': credentials['Secret']}
+
+        if auth is None:
+            for address, entry in config.get('auths', {}).items():
+                if address != registry and re.sub(r'^https?://', '', address).split('/')[0] != registry:
+                    continue
+                elif 'identitytoken' in entry:
+                    auth = {'identitytoken': entry['identitytoken']}
+                elif 'auth' in entry:
+                    username, password = base64.b64decode(entry['auth']).decode('utf-8').split(':', 1)
+                    auth = {'username': username, 'password': password}
+
+        if auth is None:
+            return None
+        auth['serveraddress'] = registry
+        return base64.urlsafe_b64encode(json.dumps(auth).encode('utf-8')).decode('ascii')
+
+    def pull(self, image: str) -> None:
+        name, tag = image, 'latest'
+        if ':' in image[image.rfind('/') + 1:]:
+            name, tag = image.rsplit(':', 1)
+        auth: str = DockerEngineInvoker.registry_auth(image)
+        status, data = self._request('POST', f"/images/create?{urlencode({'fromImage': name, 'tag': tag})}",
+                                     headers={'X-Registry-Auth': auth} if auth else None)
+        if status != 200:
+            raise UserError(f"failed pulling image '{image}' ({status}): {data.decode('utf-8', errors='replace')}")
+
+        # progress is streamed as a sequence of JSON objects; errors are reported in-stream
+        for line in data.decode('utf-8').splitlines():
+            if line.strip():
+                progress: dict = json.loads(line)
+                if 'error' in progress:
+                    raise UserError(f"failed pulling image '{image}': {progress['error']}")
+
+    def _create_container(self, container_work_dir: str, image: str, entrypoint: str = None,
+                          args: Sequence[str] = None) -> str:
+        body: dict = {
+            'Image': image,
+            'WorkingDir': container_work_dir,
+            'AttachStdin': True,
+            'AttachStdout': True,
+            'AttachStderr': True,
+            'OpenStdin': True,
+            'StdinOnce': True,
+            'Tty': False,
+            'Labels': dict(self._labels),
+            'HostConfig': {'Binds': list(self._volumes) if self._volumes else []}
+        }
+        if entrypoint is not None:
+            body['Entrypoint'] = [entrypoint]
+        if args:
+            body['Cmd'] = list(args)
+
+        # like "docker run", pull the image if it's missing
+        status, data = self._request('POST', '/containers/create', body)
+        if status == 404:
+            self.pull(image)
+            status, data = self._request('POST', '/containers/create', body)
+        if status != 201:
+            raise UserError(f"failed creating container for '{image}' ({status}): "
+                            f"{data.decode('utf-8', errors='replace').strip()}")
+        return json.loads(data.decode('utf-8'))['Id']
+
+    def _attach(self, container_id: str) -> Tuple[socket.socket, bytes]:
+        """Opens a hijacked "attach" connection to the given container, returning the raw socket, and any stream bytes
+        that were read along with the response headers."""
+        sock: socket.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self._socket_path)
+        sock.sendall(f"POST /containers/{container_id}/attach?stream=1&stdin=1&stdout=1&stderr=1 HTTP/1.1\r\n"
+                     f"Host: localhost\r\n"
+                     f"Content-Type: text/plain\r\n"
+                     f"Connection: Upgrade\r\n"
+                     f"Upgrade: tcp\r\n"
+                     f"\r\n".encode('utf-8'))
+        received: bytes = b''
+        while b'\r\n\r\n' not in received:
+            chunk: bytes = sock.recv(4096)
+            if not chunk:
+                raise UserError(f"Docker Engine closed the attach connection of container '{container_id}'")
+            received += chunk
+        headers, remainder = received.split(b'\r\n\r\n', 1)
+        status_line: str = headers.split(b'\r\n', 1)[0].decode('utf-8')
+        if status_line.split(' ')[1] not in ('101', '200'):
+            sock.close()
+            raise UserError(f"failed attaching to container '{container_id}': {status_line}")
+        return sock, remainder
+
+    @staticmethod
+    def _demultiplex(sock: socket.socket, buffer: bytes, handlers: Sequence[Callable[[str], None]]) -> None:
+        """Reads Docker's multiplexed stream format (8-byte frame headers denoting the stream & payload size) until the
+        connection is closed, passing complete lines of each stream to its handler."""
+        pending_lines: MutableSequence[bytes] = [b'', b'', b'']
+
+        def receive(size: int) -> bool:
+            nonlocal buffer
+            while len(buffer) < size:
+                chunk: bytes = sock.recv(65536)
+                if not chunk:
+                    return False
+                buffer += chunk
+            return True
+
+        while receive(8):
+            stream_type: int = buffer[0]
+            size: int = int.from_bytes(buffer[4:8], byteorder='big')
+            if not receive(8 + size):
+                break
+            payload: bytes = buffer[8:8 + size]
+            buffer = buffer[8 + size:]
+            if stream_type in (1, 2):
+                lines: Sequence[bytes] = (pending_lines[stream_type] + payload).split(b'\n')
+                for line in lines[:-1]:
+                    handlers[stream_type - 1](line.decode('utf-8', errors='replace'))
+                pending_lines[stream_type] = lines[-1]
+
+        for stream_type in (1, 2):
+            if pending_lines[stream_type]:
+                handlers[stream_type - 1](pending_lines[stream_type].decode('utf-8', errors='replace'))
+
+    def _invoke(self,
+                local_work_dir: Path,
+                container_work_dir: str,
+                image: str,
+                entrypoint: str = None,
+                args: Sequence[str] = None,
+                input: dict = None,
+                stderr_logger: Logger = None,
+                stdout_logger: Logger = None) -> Tuple[int, str, str]:
+
+        # save the input we will send to the container (for reference)
+        log: InvocationLog = InvocationLog(local_work_dir=local_work_dir, image=image, journal=self._journal)
+        log.input(input)
+        exit_code: int = None
+
+        # create the container, and attach to it before starting it, so no output is missed
+        started: float = time.time()
+        try:
+            container_id: str = self._create_container(container_work_dir=container_work_dir,
+                                                       image=image,
+                                                       entrypoint=entrypoint,
+                                                       args=args)
+            try:
+                sock, buffer = self._attach(container_id)
+                try:
+                    self._request_json('POST', f"/containers/{container_id}/start", expected=(204, 304))
+                    running: float = time.time()
+                    Timings.record('container start', 'docker', start=started, end=running, image=image)
+
+                    # send input, and close stdin (the container's stdin is closed once we're done writing)
+                    if input is not None:
+                        sock.sendall(json.dumps(input, indent=2).encode('utf-8'))
+                    sock.shutdown(socket.SHUT_WR)
+
+                    # stream stdout & stderr to the log (and loggers), until the container closes them
+                    stdout_lines: MutableSequence[str] = []
+                    stderr_lines: MutableSequence[str] = []
+
+                    def stdout_handler(line: str) -> None:
+                        log.stdout(line)
+                        stdout_lines.append(line)
+                        if stdout_logger:
+                            stdout_logger.info(line)
+
+                    def stderr_handler(line: str) -> None:
+                        log.stderr(line)
+                        stderr_lines.append(line)
+                        if stderr_logger:
+                            stderr_logger.info(line)
+
+                    DockerEngineInvoker._demultiplex(sock, buffer, [stdout_handler, stderr_handler])
+                finally:
+                    sock.close()
+
+                # fetch exit code
+                exit_code = self._request_json('POST', f"/containers/{container_id}/wait")['StatusCode']
+                Timings.record('process runtime', 'docker', start=running, end=time.time(), image=image)
+            finally:
+                # the equivalent of "docker run --rm"
+                self._remove_container(container_id)
+        finally:
+            log.close(exit_code)
+
+        return exit_code, ''.join(line + '\n' for line in stdout_lines), ''.join(line + '\n' for line in stderr_lines)
+
+
+def _execute_builtin(builtins_dir: str,
+                     module_name: str,
+                     args: Sequence[str],
+                     input: dict,
+                     environment: Mapping[str, str],
+                     work_dir: str) -> Tuple[int, str, str]:
+    """Executes a built-in resource module in the current (pool) process, with the same contract as its container:
+    arguments in 'sys.argv', input JSON on stdin, & output on stdout/stderr (returned, along with the exit code)."""
+    if builtins_dir not in sys.path:
+        sys.path.insert(0, builtins_dir)
+
+    saved_environment: dict = dict(os.environ)
+    saved_cwd: str = os.getcwd()
+    saved_argv: Sequence[str] = sys.argv
+    saved_stdin: TextIO = sys.stdin
+    saved_fds: Sequence[int] = [os.dup(1), os.dup(2)]
+    stdout: io.StringIO = io.StringIO()
+    stderr: io.StringIO = io.StringIO()
+    exit_code: int = 0
+    with TemporaryFile(mode='w+') as process_output:
+        try:
+            # modules may read their environment when imported (eg. into their default services), so apply it first
+            os.environ.update(environment)
+            module: Any = importlib.import_module(module_name)
+            os.chdir(work_dir)
+            sys.argv = [module_name] + list(args)
+            sys.stdin = io.StringIO(json.dumps(input) if input is not None else '')
+
+            # output of sub-processes (eg. "kubectl") goes straight to file descriptors 1 & 2, so capture those too
+            os.dup2(process_output.fileno(), 1)
+            os.dup2(process_output.fileno(), 2)
+            with redirect_stdout(stdout), redirect_stderr(stderr):
+                try:
+                    module.main()
+                except SystemExit as e:
+                    exit_code = e.code if isinstance(e.code, int) else 0 if e.code is None else 1
+                except Exception:
+                    traceback.print_exc()
+                    exit_code = 1
+        finally:
+            os.dup2(saved_fds[0], 1)
+            os.dup2(saved_fds[1], 2)
+            for fd in saved_fds:
+                os.close(fd)
+            sys.stdin = saved_stdin
+            sys.argv = saved_argv
+            os.chdir(saved_cwd)
+            os.environ.clear()
+            os.environ.update(saved_environment)
+        process_output.seek(0)
+        return exit_code, stdout.getvalue(), stderr.getvalue() + process_output.read()
+
+
+class InProcessDockerInvoker(DockerInvoker):
+    """Executes built-in resources (the "infolinks/deployster-*" images) in a host-side process pool, rather than in
+    containers, delegating any other invocation to the given (Docker) invoker. Volumes are not mounted, but remapped:
+    the built-in resources find their plugs (& the paths in their environment) at the corresponding host paths."""
+
+    _pool: ProcessPoolExecutor = None
+    _pool_lock: threading.Lock = threading.Lock()
+
+    def __init__(self, delegate: DockerInvoker, builtins_dir: Path, max_workers: int = None,
+                 environment: Mapping[str, str] = None) -> None:
+        super().__init__(volumes=delegate.volumes, labels=delegate.labels, journal=delegate.journal)
+        self._delegate: DockerInvoker = delegate
+        self._builtins_dir: Path = builtins_dir
+        self._max_workers: int = max_workers
+        self._environment: Mapping[str, str] = environment if environment else {}
+
+    @staticmethod
+    def shutdown() -> None:
+        with InProcessDockerInvoker._pool_lock:
+            if InProcessDockerInvoker._pool is not None:
+                InProcessDockerInvoker._pool.shutdown()
+                InProcessDockerInvoker._pool = None
+
+    @property
+    def volumes(self) -> Sequence[str]:
+        return self._volumes
+
+    @volumes.setter
+    def volumes(self, volumes: Sequence[str]) -> None:
+        self._volumes = volumes
+        self._delegate.volumes = volumes
+
+    @property
+    def delegate(self) -> DockerInvoker:
+        return self._delegate
+
+    def builtin_module(self, image: str) -> Union[None, Tuple[str, Mapping[str, str]]]:
+        """Returns the module & environment of the given image, if it's a built-in resource (None otherwise)."""
+        match = BUILTIN_IMAGE_PATTERN.match(image)
+        if not match or not self._builtins_dir.is_dir():
+            return None
+        name: str = match.group('name')
+        return BUILTIN_RESOURCES.get('k8s' if name.startswith('k8s-') else name)
+
+    def inspect_image_id(self, image: str) -> Union[None, str]:
+        return None if self.builtin_module(image) else self._delegate.inspect_image_id(image)
+
+    def pull(self, image: str) -> None:
+        if not self.builtin_module(image):
+            self._delegate.pull(image)
+
+    def prune_containers(self, run_id: str = None, include_running: bool = False) -> Sequence[str]:
+        return self._delegate.prune_containers(run_id=run_id, include_running=include_running)
+
+    def set_worker_action(self, image: str, entrypoint: str = None, args: Sequence[str] = None) -> None:
+        self._delegate.set_worker_action(image=image, entrypoint=entrypoint, args=args)
+
+    def _check_requirements(self, image: str, module_name: str) -> None:
+        """Fails if the host lacks the tools the given module executes, or the host paths of its volumes (which are not
+        mounted in-process). Since every resource is initialized before anything is applied, this fails runs up front
+        rather than partway through."""
+        tools: Sequence[str] = [tool for tool in BUILTIN_TOOLS.get(module_name, []) if shutil.which(tool) is None]
+        if tools:
+            raise UserError(f"'{image}' cannot be executed in-process: {', '.join(tools)} not found on this host "
+                            f"(run without '--in-process')")
+        paths: Sequence[str] = [v.split(':')[0] for v in self._volumes or [] if not os.path.exists(v.split(':')[0])]
+        if paths:
+            raise UserError(f"'{image}' cannot be executed in-process: {', '.join(paths)} not found on this host "
+                            f"(run without '--in-process')")
+
+    def _remap(self, path: str) -> str:
+        # volumes are "<host path>:<container path>[:<mode>]"; the deepest container path containing this path wins
+        mappings: Sequence[Tuple[str, str]] = sorted([tuple(v.split(':')[0:2]) for v in self._volumes or []],
+                                                     key=lambda mapping: len(mapping[1]), reverse=True)
+        for host_path, container_path in mappings:
+            if path == container_path or path.startswith(container_path.rstrip('/') + '/'):
+                return host_path + path[len(container_path):]
+        return path
+
+    def _dispatch(self,
+                  local_work_dir: Path,
+                  container_work_dir: str,
+                  image: str,
+                  entrypoint: str = None,
+                  args: Sequence[str] = None,
+                  input: dict = None,
+                  stderr_logger: Logger = None,
+                  stdout_logger: Logger = None) -> Tuple[int, str, str]:
+        builtin: Tuple[str, Mapping[str, str]] = self.builtin_module(image) if entrypoint is None else None
+        if builtin is None:
+            return self._delegate._dispatch(local_work_dir=local_work_dir,
+                                            container_work_dir=container_work_dir,
+                                            image=image,
+                                            entrypoint=entrypoint,
+                                            args=args,
+                                            input=input,
+                                            stderr_logger=stderr_logger,
+                                            stdout_logger=stdout_logger)
+
+        module_name, module_environment = builtin
+        self._check_requirements(image=image, module_name=module_name)
+
+        # save the input we will send to the module (for reference)
+        log: InvocationLog = InvocationLog(local_work_dir=local_work_dir, image=image, journal=self._journal)
+        log.input(input)
+
+        # plugs are found at their host paths (resources look them up in DEPLOYSTER_PATH_MAPPINGS)
+        environment: dict = {name: self._remap(value) for name, value in module_environment.items()}
+        environment.update(self._environment)
+        # gcloud keeps its active account in its config dir, so concurrent invocations must not share one
+        environment['CLOUDSDK_CONFIG'] = str(local_work_dir.absolute() / '.gcloud')
+        environment['DEPLOYSTER_PATH_MAPPINGS'] = json.dumps({container_path: host_path for host_path, container_path
+                                                              in [v.split(':')[0:2] for v in self._volumes or []]})
+
+        with InProcessDockerInvoker._pool_lock:
+            if InProcessDockerInvoker._pool is None:
+                InProcessDockerInvoker._pool = ProcessPoolExecutor(max_workers=self._max_workers)
+            pool: ProcessPoolExecutor = InProcessDockerInvoker._pool
+
+        # images' default command is "init"
+        exit_code: int = None
+        try:
+            exit_code, stdout, stderr = pool.submit(_execute_builtin,
+                                                    builtins_dir=str(self._builtins_dir.absolute()),
+                                                    module_name=module_name,
+                                                    args=list(args) if args else ['init'],
+                                                    input=input,
+                                                    environment=environment,
+                                                    work_dir=self._remap(container_work_dir)).result()
+            for line in stdout.splitlines():
+                log.stdout(line)
+                if stdout_logger:
+                    stdout_logger.info(line)
+            for line in stderr.splitlines():
+                log.stderr(line)
+                if stderr_logger:
+                    stderr_logger.info(line)
+        finally:
+            log.close(exit_code)
+        return exit_code, stdout, stderr
+
+
+def create_docker_invoker(context: Context,
+                          volumes: Sequence[str] = None,
+                          labels: Mapping[str, str] = None) -> DockerInvoker:
+    labels: dict = dict(labels if labels else {}, **{RUN_LABEL: context.run_id})
+    journal: Journal = Journal.for_path(context.work_dir / 'journal.jsonl') if context.journal else None
+    if context.docker_backend == 'api':
+        invoker: DockerInvoker = DockerEngineInvoker(volumes=volumes, labels=labels, journal=journal,
+                                                     socket_path=context.docker_socket)
+    else:
+        workers: WorkerPool = WorkerPool.shared() if context.workers else None
+        invoker: DockerInvoker = DockerInvoker(volumes=volumes, labels=labels, journal=journal, workers=workers)
+
+    # built-in resources run on the host (gcloud's config is kept in the work dir, to leave the user's config alone,
+    # while Google API discovery documents are cached across runs in the conf dir)
+    if context.in_process:
+        if not context.builtins_dir.is_dir():
+            raise UserError(f"illegal config: '--in-process' requires the built-in resources' sources, which were not "
+                            f"found at '{context.builtins_dir}' (see BUILTINS_DIR)")
+        return InProcessDockerInvoker(delegate=invoker,
+                                      builtins_dir=context.builtins_dir,
+                                      max_workers=context.parallelism,
+                                      environment={
+                                          'DEPLOYSTER_DISCOVERY_CACHE': str(context.conf_dir / 'discovery-cache')
+                                      })
+    else:
+        return invoker
@@ -1,48 +1,222 @@
 import os
 import shutil
 import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait, as_completed, FIRST_COMPLETED, FIRST_EXCEPTION
+from pathlib import Path
 from subprocess import PIPE
+from typing import MutableSequence, MutableMapping, Sequence, Mapping, Tuple, Deque
 
 from colors import underline, faint, bold
 
+from cache import InitCache
 from context import ConfirmationMode
-from manifest import Manifest
-from util import UserError, Logger, italic, ask
+from docker import DockerInvoker, DockerEngineInvoker, create_docker_invoker
+from manifest import Manifest, Resource, ResourceStatus
+from timing import Timings
+from util import UserError, Logger, italic, ask, post_process_cache_info
 
 
 class Executor:
 
-    def __init__(self, manifest: Manifest) -> None:
+    def __init__(self, manifest: Manifest, docker_invoker: DockerInvoker = None) -> None:
         super().__init__()
         self._manifest: Manifest = manifest
+        self._docker_invoker: DockerInvoker = \
+            docker_invoker if docker_invoker is not None else create_docker_invoker(context=manifest.context)
 
     def bootstrap(self) -> None:
-        with Logger(f":hourglass: {underline('Bootstrapping:')}") as logger:
+        with Logger(f":hourglass: {underline('Bootstrapping:')}") as logger, Timings.span('bootstrap', 'run'):
 
             # verify Docker is available
             logger.info(f":wrench: Verifying that Docker is available...")
-            process = subprocess.run(["docker", "run", "hello-world"], stdout=PIPE, stderr=PIPE)
-            if process.returncode != 0:
-                raise UserError(f"Docker is not available. Here's output from a test run:\n"
-                                f"=======================================================\n"
-                                f"{process.stderr.decode('utf-8')}")
+            if self._manifest.context.docker_backend == 'api':
+                socket_path: str = self._manifest.context.docker_socket
+                if not DockerEngineInvoker(socket_path=socket_path).ping():
+                    raise UserError(f"Docker Engine API is not available at '{socket_path}'")
+            else:
+                # "docker version" queries the daemon too, without leaving a container behind (as "docker run" would)
+                process = subprocess.run(["docker", "version"], stdout=PIPE, stderr=PIPE)
+                if process.returncode != 0:
+                    raise UserError(f"Docker is not available. Here's output from 'docker version':\n"
+                                    f"=======================================================\n"
+                                    f"{process.stderr.decode('utf-8')}")
 
             # clean work dir
             logger.info(f":wrench: Cleaning work directory (at {italic(faint(self._manifest.context.work_dir))})")
             try:
                 for file in os.listdir(str(self._manifest.context.work_dir)):
-                    shutil.rmtree(str(self._manifest.context.work_dir / file))
+                    path: Path = self._manifest.context.work_dir / file
+                    if path.is_dir():
+                        shutil.rmtree(str(path))
+                    else:
+                        os.remove(str(path))
             except FileNotFoundError:
                 pass
 
-            # initialize resources
-            for resource in self._manifest.resources.values():
+            # pull resource images up-front (concurrently), rather than implicitly by each resource's first invocation
+            self._pull_images(logger, [resource.type for resource in self._manifest.resources.values()])
+
+            # initialize resources, and pull the images of their state actions (now that those are known, except for
+            # resources whose initialization was deferred)
+            self._initialize_resources(logger)
+            self._pull_images(logger, [resource.state_action.image for resource in self._manifest.resources.values()
+                                        if resource.state_action is not None])
+            init_cache: InitCache = self._manifest.init_cache
+            if self._manifest.context.verbose and init_cache.enabled:
+                logger.info(f":card_file_box: Init cache: {init_cache.hits} hits, {init_cache.misses} misses"
+                            f"{'' if init_cache.writable else ' (cache directory is not writable)'}")
+
+    def _pull_images(self, logger: Logger, images: Sequence[str]) -> None:
+        # many resources share the same image; images available locally need not be pulled at all
+        images: Sequence[str] = [image for image in dict.fromkeys(images)
+                                 if self._docker_invoker.inspect_image_id(image) is None]
+        if not images:
+            return
+
+        logger.info(f":arrow_down: Pulling {len(images)} image(s)...")
+        failures: MutableSequence[str] = []
+        parallelism: int = self._manifest.context.pull_parallelism
+        with Timings.span('pull images', 'docker', images=images), \
+                ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix='pull') as pool:
+            futures: Mapping[Future, str] = {pool.submit(self._docker_invoker.pull, image): image for image in images}
+            for count, future in enumerate(as_completed(futures), start=1):
+                image: str = futures[future]
+                if future.exception() is not None:
+                    error: BaseException = future.exception()
+                    failures.append(image)
+                    logger.error(f":x: [{count}/{len(images)}] Failed pulling {bold(image)}: "
+                                 f"{error.message if isinstance(error, UserError) else error}")
+                else:
+                    logger.info(f":heavy_check_mark: [{count}/{len(images)}] Pulled {bold(image)}")
+        if failures:
+            raise UserError(f"failed pulling {len(failures)} image(s): {', '.join(failures)}")
+
+    def _initialize_resources(self, logger: Logger) -> None:
+        parallelism: int = self._manifest.context.parallelism
+        resources: Sequence[Resource] = list(self._manifest.resources.values())
+
+        # each resource's output is buffered while it initializes, and printed in manifest order once all are done
+        indent: int = Logger.current_indent()
+        buffers: Mapping[str, MutableSequence[Tuple[bool, str]]] = {resource.name: [] for resource in resources}
+
+        def initialize_resource(resource: Resource) -> None:
+            with Logger.worker_thread(indent, buffers[resource.name]):
                 resource.initialize()
 
+        with ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix='init') as pool:
+            futures: Sequence[Future] = [pool.submit(initialize_resource, resource) for resource in resources]
+
+            # on first failure, cancel initializations that have not started yet (running ones are allowed to finish)
+            done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+            if not_done:
+                for future in not_done:
+                    future.cancel()
+                wait(not_done)
+
+        # report results (and errors) in manifest order
+        failure: BaseException = None
+        for resource, future in zip(resources, futures):
+            Logger.flush_buffer(buffers[resource.name])
+            if future.cancelled():
+                logger.warn(f":x: Initialization of '{resource.name}' cancelled")
+            elif future.exception() is not None:
+                if failure is None:
+                    failure = future.exception()
+                else:
+                    error: BaseException = future.exception()
+                    logger.error(f":x: Initialization of '{resource.name}' failed: "
+                                 f"{error.message if isinstance(error, UserError) else error}")
+        if failure is not None:
+            raise failure
+
     def execute(self) -> None:
-        with Logger(f":dizzy: {underline('Execution:')}") as logger:
+        with Logger(f":dizzy: {underline('Execution:')}") as logger, Timings.span('execute', 'run'):
             if self._manifest.context.confirm == ConfirmationMode.ONCE:
                 if ask(logger=logger, message=bold('Execute?'), chars='yn', default='n') == 'n':
                     raise UserError(f"user aborted")
-            for resource in self._manifest.resources.values():
+            self._execute_resources()
+            if self._manifest.context.verbose:
+                cache_info: dict = post_process_cache_info()
+                logger.info(f":card_file_box: Template cache: {cache_info['size']} compiled, {cache_info['hits']} hits, "
+                            f"{cache_info['misses']} misses ({cache_info['hit_rate']:.0%} hit rate)")
+
+    def _execute_resources(self) -> None:
+        parallelism: int = self._manifest.context.parallelism
+        levels: Sequence[Sequence[Resource]] = self._manifest.levels
+
+        # track the number of unresolved dependencies of each resource; a resource is ready once that reaches zero
+        unresolved: MutableMapping[Resource, int] = {}
+        dependents: MutableMapping[Resource, MutableSequence[Resource]] = {r: [] for level in levels for r in level}
+        for resource in [r for level in levels for r in level]:
+            dependencies: Sequence[Resource] = list({id(d): d for d in resource.dependencies.values()}.values())
+            unresolved[resource] = len([d for d in dependencies if d.status != ResourceStatus.VALID])
+            for dependency in dependencies:
+                if dependency.status != ResourceStatus.VALID:
+                    dependents[dependency].append(resource)
+        ready: Deque[Resource] = deque(r for level in levels for r in level if unresolved[r] == 0)
+        running: MutableMapping[Future, Resource] = {}
+        batches: MutableMapping[Future, Sequence[Resource]] = {}
+        failure: BaseException = None
+
+        # worker threads continue the indentation of the "Execution" logger
+        indent: int = Logger.current_indent()
+
+        def execute_resource(resource: Resource) -> None:
+            with Logger.worker_thread(indent):
                 resource.execute()
+
+        def resolve_batch_state(resources: Sequence[Resource]) -> None:
+            with Logger.worker_thread(indent):
+                Resource.resolve_batch_state(resources)
+
+        with ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix='resource') as pool:
+            while ready or running or batches:
+
+                # start ready resources (in level order) as long as we have free workers; once a resource fails, we
+                # stop starting new resources and just wait for the running ones to finish
+                while failure is None and ready and len(running) + len(batches) < parallelism:
+                    resource: Resource = ready.popleft()
+
+                    # ready resources supporting the same batch "state" action have their state resolved together
+                    batch_key: tuple = resource.batch_key
+                    batch: Sequence[Resource] = \
+                        [resource] + ([r for r in ready if r.batch_key == batch_key] if batch_key else [])
+                    if len(batch) > 1:
+                        for batched in batch[1:]:
+                            ready.remove(batched)
+                        batches[pool.submit(resolve_batch_state, batch)] = batch
+                    else:
+                        running[pool.submit(execute_resource, resource)] = resource
+                if not running and not batches:
+                    break
+
+                # wait for at least one resource (or batch) to finish, which might unblock resources depending on it
+                done, not_done = wait(list(running.keys()) + list(batches.keys()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in batches:
+                        batch: Sequence[Resource] = batches.pop(future)
+                        if future.exception() is not None:
+                            if failure is None:
+                                failure = future.exception()
+                        else:
+                            # state was resolved; execute the batch's resources next (in order)
+                            ready.extendleft(reversed(batch))
+                        continue
+
+                    resource: Resource = running.pop(future)
+                    if future.exception() is not None:
+                        if failure is None:
+                            failure = future.exception()
+                    elif resource.status == ResourceStatus.VALID:
+                        for dependent in dependents[resource]:
+                            unresolved[dependent] -= 1
+                            if unresolved[dependent] == 0:
+                                ready.append(dependent)
+
+        if failure is not None:
+            raise failure
+
+        unfinished: Sequence[str] = [r.name for level in levels for r in level if unresolved[r] > 0]
+        if unfinished:
+            raise UserError(f"could not execute {', '.join(unfinished)}: dependencies were not resolved")
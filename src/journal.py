@@ -0,0 +1,89 @@
+import json
+import threading
+import time
+from pathlib import Path
+from typing import MutableMapping, Sequence, Iterator, Any, TextIO
+
+
+class Journal:
+    """Append-only run journal: a single JSON-lines file recording the input, output & exit code of every invocation of
+    the run, instead of separate stdin/stdout/stderr files per invocation.
+
+    Every record has a type ('t'), the invocation ID ('id') and a timestamp ('ts'):
+        - 'start':  invocation started (also has 'resource', 'action', 'image' & 'stdin')
+        - 'out':    a line of standard output ('line')
+        - 'err':    a line of standard error ('line')
+        - 'exit':   invocation ended ('code')"""
+
+    _journals: MutableMapping[str, 'Journal'] = {}
+    _journals_lock: threading.Lock = threading.Lock()
+
+    def __init__(self, path: Path) -> None:
+        super().__init__()
+        self._path: Path = path
+        self._lock: threading.Lock = threading.Lock()
+        self._file: TextIO = None
+
+    @staticmethod
+    def for_path(path: Path) -> 'Journal':
+        """Returns the (process-wide) journal of the given file."""
+        with Journal._journals_lock:
+            return Journal._journals.setdefault(str(path), Journal(path))
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def append(self, type: str, id: str, **fields: Any) -> None:
+        record: dict = {'t': type, 'id': id, 'ts': time.time()}
+        record.update(fields)
+        line: str = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._lock:
+            # opened lazily, since the work dir is cleaned (during bootstrap) before resources are invoked
+            if self._file is None:
+                self._path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = open(self._path, 'a')
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    @staticmethod
+    def read(path: Path) -> Iterator[dict]:
+        with open(path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    @staticmethod
+    def invocations(path: Path) -> Sequence[dict]:
+        """Reconstructs the invocations recorded in the given journal file (in order of their start)."""
+        invocations: MutableMapping[str, dict] = {}
+        for record in Journal.read(path):
+            if record['t'] == 'start':
+                invocations[record['id']] = {
+                    'id': record['id'],
+                    'resource': record.get('resource'),
+                    'action': record.get('action'),
+                    'image': record.get('image'),
+                    'start': record['ts'],
+                    'end': None,
+                    'exit_code': None,
+                    'stdin': record.get('stdin'),
+                    'stdout': [],
+                    'stderr': []
+                }
+            elif record['id'] in invocations:
+                invocation: dict = invocations[record['id']]
+                if record['t'] == 'out':
+                    invocation['stdout'].append(record['line'])
+                elif record['t'] == 'err':
+                    invocation['stderr'].append(record['line'])
+                elif record['t'] == 'exit':
+                    invocation['end'] = record['ts']
+                    invocation['exit_code'] = record['code']
+        return list(invocations.values())
@@ -1,20 +1,25 @@
 import json
 import os
 import pkgutil
+import hashlib
 import re
-from copy import deepcopy
 from enum import auto, Enum, unique
 from pathlib import Path
-from typing import Mapping, Sequence, Pattern, MutableMapping, Callable
+from typing import Mapping, Sequence, Pattern, MutableMapping, Callable, Any, MutableSequence, Tuple, Iterator, Union
 
-import jsonschema
 import yaml
-from jsonschema import ValidationError
+from jsonschema import ValidationError, SchemaError
 
 import util
+from cache import InitCache, JsonCache
 from context import Context, ConfirmationMode
-from docker import DockerInvoker
-from util import UserError, bold, underline, Logger, faint, italic, post_process, ask
+from docker import DockerInvoker, create_docker_invoker, RESOURCE_LABEL
+from timing import Timings
+from util import UserError, bold, underline, Logger, faint, italic, post_process, ask, analyze_templates, \
+    create_validator, cached_validator, validate, load_yaml
+
+# where deferred "init" invocations find the plugs allowed for the resource (each under its plug name)
+PLUGS_CONTAINER_DIR = '/deployster/plugs'
 
 
 class Action:
@@ -70,6 +75,10 @@ class ResourceStatus(Enum):
 class Resource:
     init_action_stdout_schema = json.loads(pkgutil.get_data('schema', 'action-init-result.schema'))
     state_action_stdout_schema = json.loads(pkgutil.get_data('schema', 'action-state-result.schema'))
+    init_action_stdout_validator = create_validator(init_action_stdout_schema)
+    state_action_stdout_validator = create_validator(state_action_stdout_schema)
+    valid_state_result_validator = create_validator(
+        [s for s in state_action_stdout_schema['oneOf'] if s['properties']['status']['pattern'] == '^VALID$'][0])
 
     def __init__(self,
                  manifest: 'Manifest',
@@ -89,7 +98,9 @@ class Resource:
         self._type: str = type
         self._readonly: bool = readonly
         self._config_schema: dict = None
+        self._config_validator: Any = None
         self._config: dict = config if config else {}
+        self._config_plan: Any = analyze_templates(self._config)
         self._resolved_config: dict = None
         self._dependencies: Mapping[str, 'Resource'] = dependencies if dependencies else {}
         self._docker_volumes: Sequence[str] = [
@@ -99,9 +110,16 @@ class Resource:
         ]
         self._plug_volumes: Sequence[str] = None
         self._docker_invoker: DockerInvoker = \
-            docker_invoker if docker_invoker is not None else DockerInvoker(volumes=self._docker_volumes)
+            docker_invoker if docker_invoker is not None \
+                else create_docker_invoker(context=manifest.context,
+                                           volumes=self._docker_volumes,
+                                           labels={RESOURCE_LABEL: name})
         self._plugs: MutableMapping[str, Plug] = {}
         self._state_action: Action = None
+        self._batch_state_action: Action = None
+        self._batch_state_result: dict = None
+        self._init_deferred: bool = False
+        self._init_image_id: str = None
         self._state: dict = None
         self._apply_actions: Sequence[Action] = None
 
@@ -129,135 +147,323 @@ class Resource:
     def status(self) -> ResourceStatus:
         return self._status
 
+    @property
+    def state_action(self) -> Action:
+        return self._state_action
+
+    @property
+    def batch_state_action(self) -> Action:
+        return self._batch_state_action
+
+    @property
+    def batch_key(self) -> Union[None, Tuple[Any, ...]]:
+        """Key of resources whose "state" action can be resolved in a single batched invocation (None if this
+        resource does not support the batch protocol): same batch action, and same plugs mounted."""
+        action: Action = self._batch_state_action
+        if action is None or self._init_deferred or self._status != ResourceStatus.INITIALIZED \
+                or self._batch_state_result is not None:
+            return None
+        return action.image, action.entrypoint, tuple(action.args or []), tuple(self._plug_volumes or [])
+
     @property
     def state(self) -> dict:
         return self._state
 
     def initialize(self) -> None:
         with Logger(f":point_right: Initializing '{bold(self.name)}' ({italic(faint(self.type))})",
-                    spacious=False) as logger:
+                    spacious=False) as logger, Timings.span('init', 'resource', resource=self.name):
+
+            # init results depend only on the image (and on this input), so try the init cache first
+            input: dict = self._init_input()
+            init_cache: InitCache = self._manifest.init_cache
+            image_id: str = self._docker_invoker.inspect_image_id(self.type) if init_cache.enabled else None
+            result: dict = init_cache.get(image_id=image_id, input=input) if image_id else None
+            if result is not None:
+                self._load_init_result(logger, result)
+
+            # in lazy mode, the "init" action is deferred until the config is resolved, & combined with "state"
+            elif self._manifest.context.lazy_init:
+                logger.info(f"Deferred until its configuration is resolved")
+                self._init_deferred: bool = True
+                self._init_image_id: str = image_id
+
+            else:
+                # execute resource Docker image with the default entrypoint
+                result = self._docker_invoker.run_json(
+                    logger=logger,
+                    local_work_dir=self._manifest.context.work_dir / self.name / "init",
+                    container_work_dir=str(self._manifest.context.workspace_dir),
+                    image=self.type,
+                    input=input)
+                self._load_init_result(logger, result)
+                self._cache_init_result(input=input, image_id=image_id, result=result)
+
+            # mark resource as initialized
+            self._status: ResourceStatus = ResourceStatus.INITIALIZED
 
-            # execute resource Docker image with the default entrypoint
-            result = self._docker_invoker.run_json(
+    def _init_input(self) -> dict:
+        return {
+            'name': self.name,
+            'type': self.type,
+            'version': self._manifest.context.version,
+            'verbose': self._manifest.context.verbose,
+            'workspace': str(self._manifest.context.workspace_dir)
+        }
+
+    def _cache_init_result(self, input: dict, image_id: str, result: dict) -> None:
+        init_cache: InitCache = self._manifest.init_cache
+        if init_cache.enabled:
+
+            # the image may have been pulled just now
+            if image_id is None:
+                image_id = self._docker_invoker.inspect_image_id(self.type)
+
+            # cache result (only once it was successfully validated); combined state results are never cached
+            if image_id:
+                result: dict = {k: v for k, v in result.items() if k != 'state_result'}
+                init_cache.put(image=self.type, image_id=image_id, input=input, result=result)
+
+    def _initialize_with_state(self, logger: Logger) -> dict:
+        """Performs a deferred "init" action, sending it the resolved config; resources supporting the combined
+        protocol respond with their state result too (returned), saving a separate "state" invocation."""
+        with Timings.span('init', 'resource', resource=self.name):
+
+            # the plugs the resource will request are not known yet, so mount every (existing) plug allowed for it
+            # under PLUGS_CONTAINER_DIR; the resource looks them up by name, & provides its state only if they suffice
+            plugs: Mapping[str, Plug] = {name: plug for name, plug in self._manifest.plugs.items()
+                                         if plug.allowed_for(self.name, self.type) and plug.path.exists()}
+            plug_paths: Mapping[str, str] = {name: f"{PLUGS_CONTAINER_DIR}/{name}" for name in plugs.keys()}
+            volumes: list = []
+            volumes.extend(self._docker_volumes)
+            volumes.extend([f"{plug.path}:{plug_paths[name]}:{'ro' if plug.readonly else 'rw'}"
+                            for name, plug in plugs.items()])
+            self._docker_invoker.volumes = volumes
+
+            input: dict = self._init_input()
+            result: dict = self._docker_invoker.run_json(
                 logger=logger,
                 local_work_dir=self._manifest.context.work_dir / self.name / "init",
                 container_work_dir=str(self._manifest.context.workspace_dir),
                 image=self.type,
-                input={
-                    'name': self.name,
-                    'type': self.type,
-                    'version': self._manifest.context.version,
-                    'verbose': self._manifest.context.verbose,
-                    'workspace': str(self._manifest.context.workspace_dir)
-                })
-
-            # validate manifest against our manifest schema
-            try:
-                jsonschema.validate(result, Resource.init_action_stdout_schema)
-            except ValidationError as e:
-                raise UserError(
-                    f"protocol error: '{self.name}' initialization result failed validation: {e.message}") from e
-
-            # store config schema
-            self._config_schema = result['config_schema'] if 'config_schema' in result else {
-                'type': 'object',
-                'additionalProperties': True
-            }
-
-            # parse, validate & collect requested plugs
-            plugs: MutableMapping[str, Plug] = {}
-            for plug_name, plug_spec in (result['plugs'] if 'plugs' in result else {}).items():
-                optional = plug_spec['optional'] if 'optional' in plug_spec else False
-                require_writable = plug_spec['writable'] if 'writable' in plug_spec else True
-
-                if plug_name not in self._manifest.plugs:
-                    if optional:
-                        logger.warn(f"Optional plug '{plug_name}' does not exist (skipped)")
-                        continue
-                    else:
-                        raise UserError(
-                            f"illegal config: plug '{plug_name}' required by '{self.name}' does not exist")
-
-                plug = self._manifest.plug(plug_name)
-                if not plug.allowed_for(self.name, self.type):
-                    if optional:
-                        logger.warn(f"Optional plug '{plug_name}' is not allowed for this resource (skipped)")
-                        continue
-                    else:
-                        raise UserError(
-                            f"illegal config: plug '{plug_name}' required by '{self.name}' is not allowed for it")
-                elif require_writable and plug.readonly:
-                    if optional:
-                        logger.warn(
-                            f"Optional plug '{plug_name}' is readonly, but requested with write access (denied)")
-                        continue
-                    else:
-                        raise UserError(
-                            f"illegal config: plug '{plug_name}' required by '{self.name}' is readonly, but requested "
-                            f"with write access")
-                else:
-                    plugs[plug_spec['container_path']] = plug
-            self._plugs: MutableMapping[str, Plug] = plugs
-
-            # save actions
-            state_action = result['state_action']
-            if ('image' not in state_action or not state_action['image']) \
-                    and ('entrypoint' not in state_action or not state_action['entrypoint']) \
-                    and ('args' not in state_action or not state_action['args']):
-                raise UserError(f"state action must not equal the default 'init' action (must have image, entrypoint, "
-                                f"args, or a combination of some of those.")
-
-            self._state_action: Action = \
-                Action(work_dir=self._manifest.context.work_dir / self.name / "state",
-                       name="state",
-                       description=f"Discover state of resource '{self.name}'",
-                       image=state_action['image'] if 'image' in state_action else self.type,
-                       entrypoint=state_action['entrypoint'] if 'entrypoint' in state_action else None,
-                       args=state_action['args'] if 'args' in state_action else None)
+                input=dict(input, combined_state=True, config=self._resolved_config, plugs=plug_paths))
+            self._load_init_result(logger, result)
+            self._cache_init_result(input=input, image_id=self._init_image_id, result=result)
+            self._init_deferred: bool = False
+
+        # the state result is only trusted if every plug accepted for the resource was mounted for this invocation
+        if 'state_result' in result and all(plug.name in plug_paths for plug in self._plugs.values()):
+            state_result: dict = result['state_result']
+            self._validate_state_result(state_result)
+            return state_result
+        else:
+            return None
+
+    def _load_init_result(self, logger: Logger, result: dict) -> None:
+        # validate manifest against our manifest schema
+        try:
+            validate(Resource.init_action_stdout_validator, result)
+        except ValidationError as e:
+            raise UserError(
+                f"protocol error: '{self.name}' initialization result failed validation: {e.message}") from e
 
-            # mark resource as initialized
-            self._status: ResourceStatus = ResourceStatus.INITIALIZED
+        # store config schema
+        self._config_schema = result['config_schema'] if 'config_schema' in result else {
+            'type': 'object',
+            'additionalProperties': True
+        }
+        try:
+            self._config_validator = cached_validator(self._config_schema)
+        except SchemaError as e:
+            raise UserError(f"protocol error: '{self.name}' provided an invalid config schema: {e.message}") from e
+
+        # parse, validate & collect requested plugs
+        plugs: MutableMapping[str, Plug] = {}
+        for plug_name, plug_spec in (result['plugs'] if 'plugs' in result else {}).items():
+            optional = plug_spec['optional'] if 'optional' in plug_spec else False
+            require_writable = plug_spec['writable'] if 'writable' in plug_spec else True
+
+            if plug_name not in self._manifest.plugs:
+                if optional:
+                    logger.warn(f"Optional plug '{plug_name}' does not exist (skipped)")
+                    continue
+                else:
+                    raise UserError(
+                        f"illegal config: plug '{plug_name}' required by '{self.name}' does not exist")
+
+            plug = self._manifest.plug(plug_name)
+            if not plug.allowed_for(self.name, self.type):
+                if optional:
+                    logger.warn(f"Optional plug '{plug_name}' is not allowed for this resource (skipped)")
+                    continue
+                else:
+                    raise UserError(
+                        f"illegal config: plug '{plug_name}' required by '{self.name}' is not allowed for it")
+            elif require_writable and plug.readonly:
+                if optional:
+                    logger.warn(
+                        f"Optional plug '{plug_name}' is readonly, but requested with write access (denied)")
+                    continue
+                else:
+                    raise UserError(
+                        f"illegal config: plug '{plug_name}' required by '{self.name}' is readonly, but requested "
+                        f"with write access")
+            else:
+                plugs[plug_spec['container_path']] = plug
+        self._plugs: MutableMapping[str, Plug] = plugs
+
+        # save actions
+        state_action = result['state_action']
+        if ('image' not in state_action or not state_action['image']) \
+                and ('entrypoint' not in state_action or not state_action['entrypoint']) \
+                and ('args' not in state_action or not state_action['args']):
+            raise UserError(f"state action must not equal the default 'init' action (must have image, entrypoint, "
+                            f"args, or a combination of some of those.")
+
+        self._state_action: Action = \
+            Action(work_dir=self._manifest.context.work_dir / self.name / "state",
+                   name="state",
+                   description=f"Discover state of resource '{self.name}'",
+                   image=state_action['image'] if 'image' in state_action else self.type,
+                   entrypoint=state_action['entrypoint'] if 'entrypoint' in state_action else None,
+                   args=state_action['args'] if 'args' in state_action else None)
+
+        # images that can resolve the state of multiple resources in a single invocation say so
+        if 'batch_state_action' in result:
+            batch_state_action: dict = result['batch_state_action']
+            self._batch_state_action: Action = \
+                Action(work_dir=self._manifest.context.work_dir / self.name / "batch_state",
+                       name="batch_state",
+                       description=f"Discover state of multiple '{self.type}' resources",
+                       image=batch_state_action['image'] if 'image' in batch_state_action else self.type,
+                       entrypoint=batch_state_action['entrypoint'] if 'entrypoint' in batch_state_action else None,
+                       args=batch_state_action['args'] if 'args' in batch_state_action else None)
+
+        # images that can serve their actions as long-lived workers say so (otherwise actions are one-shot)
+        if 'worker_action' in result:
+            worker_action: dict = result['worker_action']
+            self._docker_invoker.set_worker_action(
+                image=self.type,
+                entrypoint=worker_action['entrypoint'] if 'entrypoint' in worker_action else None,
+                args=worker_action['args'] if 'args' in worker_action else None)
 
         self._plug_volumes: Sequence[str] = \
             [f"{p.path}:{cpath}:{'ro' if p.readonly else 'rw'}" for cpath, p in self._plugs.items()]
         volumes: list = []
         volumes.extend(self._docker_volumes)
         volumes.extend(self._plug_volumes)
-        self._docker_invoker: DockerInvoker = DockerInvoker(volumes=volumes)
-
-    def _resolve_state(self, logger: Logger) -> dict:
-
-        # invoke the "state" action
-        state_result = self._docker_invoker.run_json(
-            logger=logger,
-            local_work_dir=self._manifest.context.work_dir / self.name / self._state_action.name,
-            container_work_dir=str(self._manifest.context.workspace_dir),
-            image=self._state_action.image,
-            entrypoint=self._state_action.entrypoint,
-            args=self._state_action.args,
-            input={
-                'name': self.name,
-                'type': self.type,
-                'version': self._manifest.context.version,
-                'verbose': self._manifest.context.verbose,
-                'workspace': str(self._manifest.context.workspace_dir),
-                'config': self._resolved_config
-            }
-        )
+        self._docker_invoker.volumes = volumes
+
+    def _state_input(self) -> dict:
+        return {
+            'name': self.name,
+            'type': self.type,
+            'version': self._manifest.context.version,
+            'verbose': self._manifest.context.verbose,
+            'workspace': str(self._manifest.context.workspace_dir),
+            'config': self._resolved_config
+        }
+
+    def _resolve_state(self, logger: Logger, phase: str = 'state') -> dict:
+        with Timings.span(phase, 'resource', resource=self.name):
 
+            # invoke the "state" action
+            state_result = self._docker_invoker.run_json(
+                logger=logger,
+                local_work_dir=self._manifest.context.work_dir / self.name / self._state_action.name,
+                container_work_dir=str(self._manifest.context.workspace_dir),
+                image=self._state_action.image,
+                entrypoint=self._state_action.entrypoint,
+                args=self._state_action.args,
+                input=self._state_input()
+            )
+
+            self._validate_state_result(state_result)
+            return state_result
+
+    @staticmethod
+    def resolve_batch_state(resources: Sequence['Resource']) -> None:
+        """Resolves the config & state of the given resources (which must share the same batch key) using a single
+        invocation of their batch "state" action; each resource then uses its state result when executed."""
+        first: Resource = resources[0]
+        names: str = ', '.join(bold(resource.name) for resource in resources)
+        with Logger(f":point_right: Inspecting {names} ({faint(first.type)})...") as logger, \
+                Timings.span('batch state', 'resource', resources=[resource.name for resource in resources]):
+
+            for resource in resources:
+                resource._resolve_config(logger)
+
+            # the batch action receives an array of "state" inputs, and responds with an array of "state" results
+            action: Action = first._batch_state_action
+            state_results: Any = first._docker_invoker.run_json(
+                logger=logger,
+                local_work_dir=action.work_dir,
+                container_work_dir=str(first._manifest.context.workspace_dir),
+                image=action.image,
+                entrypoint=action.entrypoint,
+                args=action.args,
+                input=[resource._state_input() for resource in resources])
+            if type(state_results) != list or len(state_results) != len(resources):
+                raise UserError(f"protocol error: batch state result of {len(resources)} '{first.type}' resources "
+                                f"must be an array of {len(resources)} state results")
+
+            for resource, state_result in zip(resources, state_results):
+                resource._validate_state_result(state_result)
+                resource._batch_state_result: dict = state_result
+
+    def _validate_state_result(self, state_result: dict) -> None:
         # validate result against our the state schema
         try:
-            jsonschema.validate(state_result, Resource.state_action_stdout_schema)
+            with Timings.span('validate state', 'state'):
+                validate(Resource.state_action_stdout_validator, state_result)
         except ValidationError as e:
             raise UserError(f"protocol error: '{self.name}' state result failed validation: {e.message}") from e
 
+    def _resolve_config(self, logger: Logger) -> Union[None, dict]:
+        """Post-processes & validates the config; returns the state result, if provided by a deferred "init"."""
+
+        # post-process configuration (rendering never modifies the context, so a shallow copy suffices)
+        config_context: dict = dict(self._manifest.context.data)
+        config_context.update({
+            alias: {
+                'name': dep.name,
+                'type': dep.type,
+                'state': dep.state,
+            } for alias, dep in self._dependencies.items()
+        })
+        with Timings.span('post_process', 'config', resource=self.name):
+            self._resolved_config = post_process(value=self._config, context=config_context, plan=self._config_plan)
+
+        # deferred "init" action (lazy mode) is performed now, possibly providing the state result as well
+        state_result: dict = self._initialize_with_state(logger) if self._init_deferred else None
+
+        # validate the config, now that it's been resolved
+        try:
+            with Timings.span('validate config', 'config', resource=self.name):
+                validate(self._config_validator, self._resolved_config)
+        except ValidationError as e:
+            path: str = ''
+            for token in e.path:
+                if path:
+                    path: str = path + '[' + str(token) + ']' if type(token) == int else path + '.' + str(token)
+                else:
+                    path = str(token)
+            raise UserError(f"illegal config for '{self.name}.config.{path}': {e.message}\n"
+                            f"Must match schema: {e.schema}") from e
         return state_result
 
-    def execute(self) -> None:
+    def _emitted_state_result(self, stdout: str) -> Union[None, dict]:
+        """Returns the VALID state result emitted by an action as its last line of output (None if it emitted none)."""
+        lines: Sequence[str] = [line for line in (stdout or '').splitlines() if line.strip()]
+        if not lines or not lines[-1].startswith('{'):
+            return None
+        try:
+            state_result: dict = json.loads(lines[-1])
+            validate(Resource.valid_state_result_validator, state_result)
+            return state_result
+        except (ValueError, ValidationError):
+            return None
 
-        # attempt to resolve all dependencies (resolving an already-resolved dependency has no side-effects)
-        for dependency in self._dependencies.values():
-            dependency.execute()
+    def execute(self) -> None:
 
         # if we're already resolving, we have a circular dependency loop
         if self._status == ResourceStatus.RESOLVING:
@@ -267,38 +473,28 @@ class Resource:
         elif self._status == ResourceStatus.VALID:
             return
 
-        # fail if not initialized, or already resolving (circular dependency), and do nothing if already resolved
+        # fail if not initialized
         elif self._status is None:
             raise Exception(f"internal error: cannot resolve un-initialized resource ('{self.name}')")
 
-        with Logger(f":point_right: Inspecting {bold(self.name)} ({faint(self.type)})...") as logger:
-
-            # post-process configuration
-            config_context: dict = deepcopy(self._manifest.context.data)
-            config_context.update({
-                alias: {
-                    'name': dep.name,
-                    'type': dep.type,
-                    'state': dep.state,
-                } for alias, dep in self._dependencies.items()
-            })
-            self._resolved_config = post_process(value=self._config, context=config_context)
-
-            # validate the config, now that it's been resolved
-            try:
-                jsonschema.validate(self._resolved_config, self._config_schema)
-            except ValidationError as e:
-                path: str = ''
-                for token in e.path:
-                    if path:
-                        path: str = path + '[' + str(token) + ']' if type(token) == int else path + '.' + str(token)
-                    else:
-                        path = str(token)
-                raise UserError(f"illegal config for '{self.name}.config.{path}': {e.message}\n"
-                                f"Must match schema: {e.schema}") from e
+        # attempt to resolve all dependencies (resolving an already-resolved dependency has no side-effects); we're
+        # marked as resolving beforehand, so that dependency loops are detected rather than recursed into endlessly
+        self._status = ResourceStatus.RESOLVING
+        for dependency in self._dependencies.values():
+            dependency.execute()
 
-            # invoke the "state" action
-            state_result = self._resolve_state(logger=logger)
+        with Logger(f":point_right: Inspecting {bold(self.name)} ({faint(self.type)})...") as logger, \
+                Timings.span('resolve', 'resource', resource=self.name):
+
+            # config & state may have already been resolved by a batched "state" action
+            if self._batch_state_result is not None:
+                state_result: dict = self._batch_state_result
+                self._batch_state_result = None
+            else:
+                # invoke the "state" action (unless already provided by the "init" action)
+                state_result: dict = self._resolve_config(logger)
+                if state_result is None:
+                    state_result = self._resolve_state(logger=logger)
 
             # save resource status
             self._status: ResourceStatus = ResourceStatus[state_result['status']]
@@ -319,9 +515,13 @@ class Resource:
                     if util.ask(logger=logger, message=bold('Execute this resource?'), chars='yn', default='n') == 'n':
                         raise UserError(f"user aborted")
 
-                # execute the "apply" actions
-                for action in self._apply_actions:
-                    with Logger(header=f":wrench: {action.description} ({action.name})") as action_logger:
+                # execute the "apply" actions; the last one may emit the new state (unless strict verification)
+                emitted_state_result: dict = None
+                for index, action in enumerate(self._apply_actions):
+                    emit_state: bool = index == len(self._apply_actions) - 1 and \
+                                       not self._manifest.context.strict_verify
+                    with Logger(header=f":wrench: {action.description} ({action.name})") as action_logger, \
+                            Timings.span(f"action {action.name}", 'resource', resource=self.name):
 
                         # confirm if necessary
                         if self._manifest.context.confirm == ConfirmationMode.ACTION:
@@ -329,7 +529,7 @@ class Resource:
                                 raise UserError(f"user aborted")
 
                         # execute
-                        self._docker_invoker.run(
+                        stdout: str = self._docker_invoker.run(
                             logger=action_logger,
                             local_work_dir=self._manifest.context.work_dir / self.name / action.name,
                             container_work_dir=str(self._manifest.context.workspace_dir),
@@ -343,12 +543,19 @@ class Resource:
                                 'verbose': self._manifest.context.verbose,
                                 'workspace': str(self._manifest.context.workspace_dir),
                                 'config': self._resolved_config,
-                                'staleState': state_result["staleState"] if "staleState" in state_result else {}
+                                'staleState': state_result["staleState"] if "staleState" in state_result else {},
+                                'emit_state': emit_state
                             }
                         )
+                        if emit_state:
+                            emitted_state_result = self._emitted_state_result(stdout)
 
-                # verify that the resource is now VALID
-                updated_state_result: dict = self._resolve_state(logger=logger)
+                # verify that the resource is now VALID (unless the last action already reported its new state)
+                if emitted_state_result is not None:
+                    logger.info(f"Using the state reported by the '{self._apply_actions[-1].name}' action")
+                    updated_state_result: dict = emitted_state_result
+                else:
+                    updated_state_result: dict = self._resolve_state(logger=logger, phase='re-state')
                 if ResourceStatus[updated_state_result['status']] != ResourceStatus.VALID:
                     raise UserError(f"protocol error: expected '{self.name}' to be VALID after applying actions")
                 else:
@@ -406,12 +613,16 @@ class Plug:
 
 class Manifest:
     schema = json.loads(pkgutil.get_data('schema', 'manifest.schema'))
+    validator = create_validator(schema)
 
     def __init__(self, context: Context, manifest_files: Sequence[Path],
                  resource_factory: Callable[..., Resource] = Resource) -> None:
         super().__init__()
         self._context = context
         self._manifest_files: Sequence[Path] = manifest_files
+        self._init_cache: InitCache = InitCache(path=context.conf_dir / 'cache' / 'init', enabled=context.init_cache)
+        self._manifest_cache: JsonCache = JsonCache(path=context.conf_dir / 'cache' / 'manifests',
+                                                    enabled=context.manifest_cache)
 
         composite_manifest: dict = {
             'plugs': {},
@@ -420,18 +631,7 @@ class Manifest:
 
         # read manifest files
         for manifest_file in self._manifest_files:
-            with open(manifest_file, 'r') as f:
-                # read the manifest
-                try:
-                    manifest = yaml.load(f.read())
-                except yaml.YAMLError as e:
-                    raise UserError(f"Manifest '{manifest_file}' is malformed: {e}") from e
-
-                # validate the manifest
-                try:
-                    jsonschema.validate(manifest, Manifest.schema)
-                except ValidationError as e:
-                    raise UserError(f"Manifest '{manifest_file}' failed validation: {e.message}") from e
+            manifest: dict = self._load_manifest_file(manifest_file)
 
             # merge into the composite manifest
             if 'plugs' in manifest:
@@ -458,37 +658,162 @@ class Manifest:
                                     allowed_resource_types=plug['resource_types'] if 'resource_types' in plug else [])
         self._plugs: Mapping[str, Plug] = plugs
 
-        # parse resources
+        # build the dependency graph (resource name => dependency alias => dependency resource name)
+        graph: MutableMapping[str, Mapping[str, str]] = {}
+        for name, data in composite_manifest['resources'].items():
+            dependencies: MutableMapping[str, str] = {}
+            for alias, dep_resource_name in (data['dependencies'] if 'dependencies' in data else {}).items():
+                alias = post_process(alias, self.context.data)
+                dep_resource_name = post_process(dep_resource_name, self.context.data)
+                if dep_resource_name not in composite_manifest['resources']:
+                    raise UserError(f"resource '{name}' depends on an unknown resource: {dep_resource_name}")
+                dependencies[alias] = dep_resource_name
+            graph[name] = dependencies
+
+        # parse resources, level by level (so that dependencies are always created before resources depending on them)
         resources: MutableMapping[str, Resource] = {}
+        levels: MutableSequence[Sequence[Resource]] = []
+        for level in Manifest._sort_topologically(graph):
+            for name in level:
+                data: dict = composite_manifest['resources'][name]
+                resources[name] = \
+                    resource_factory(
+                        manifest=self,
+                        name=post_process(name, self.context.data),
+                        type=post_process(data['type'], self.context.data),
+                        readonly=post_process(data['readonly'], self.context.data) if 'readonly' in data else False,
+                        config=data['config'] if 'config' in data else {},
+                        dependencies={alias: resources[dep_name] for alias, dep_name in graph[name].items()})
+            levels.append([resources[name] for name in level])
+
+        # resources are exposed in manifest order (levels are only kept for scheduling)
+        self._resources: Mapping[str, Resource] = {name: resources[name] for name in graph}
+        self._levels: Sequence[Sequence[Resource]] = levels
+
+    @staticmethod
+    def _sort_topologically(graph: Mapping[str, Mapping[str, str]]) -> Sequence[Sequence[str]]:
+        """Sorts the given dependency graph into levels, such that each node only depends on nodes of previous levels
+        (nodes of each level retain their original order). Raises a UserError describing every dependency cycle (if
+        there are any)."""
+
+        # Kahn's algorithm, one level at a time
+        order: Mapping[str, int] = {name: index for index, name in enumerate(graph)}
+        pending_counts: MutableMapping[str, int] = {name: len(set(deps.values())) for name, deps in graph.items()}
+        dependents: MutableMapping[str, MutableSequence[str]] = {name: [] for name in graph}
+        for name, deps in graph.items():
+            for dep_name in set(deps.values()):
+                dependents[dep_name].append(name)
+
+        levels: MutableSequence[Sequence[str]] = []
+        level: Sequence[str] = [name for name, count in pending_counts.items() if count == 0]
+        sorted_count: int = 0
+        while level:
+            levels.append(level)
+            sorted_count += len(level)
+            next_level: MutableSequence[str] = []
+            for name in level:
+                for dependent in dependents[name]:
+                    pending_counts[dependent] -= 1
+                    if pending_counts[dependent] == 0:
+                        next_level.append(dependent)
+            level = sorted(next_level, key=lambda n: order[n])
+
+        if sorted_count < len(graph):
+            cycles: Sequence[Sequence[str]] = Manifest._find_cycles(graph)
+            raise UserError(f"illegal config: circular resource dependency encountered! Dependency cycles: " +
+                            ", ".join(f"[{', '.join(cycle[0:10])}{', ...' if len(cycle) > 10 else ''}]"
+                                      for cycle in cycles))
+        return levels
+
+    @staticmethod
+    def _find_cycles(graph: Mapping[str, Mapping[str, str]]) -> Sequence[Sequence[str]]:
+        """Returns the strongly-connected components of the given graph that contain cycles, using an iterative version
+        of Tarjan's algorithm (to avoid recursion limits on large graphs)."""
+        index_of: MutableMapping[str, int] = {}
+        low_link: MutableMapping[str, int] = {}
+        stack: MutableSequence[str] = []
+        on_stack: set = set()
+        cycles: MutableSequence[Sequence[str]] = []
+        order: Mapping[str, int] = {name: index for index, name in enumerate(graph)}
+
+        for root in graph:
+            if root in index_of:
+                continue
+
+            # each work item is a node, and an iterator over its remaining successors
+            work: MutableSequence[Tuple[str, Iterator[str]]] = [(root, iter(graph[root].values()))]
+            index_of[root] = low_link[root] = len(index_of)
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                node, successors = work[-1]
+                successor: str = next(successors, None)
+                if successor is not None:
+                    if successor not in index_of:
+                        index_of[successor] = low_link[successor] = len(index_of)
+                        stack.append(successor)
+                        on_stack.add(successor)
+                        work.append((successor, iter(graph[successor].values())))
+                    elif successor in on_stack:
+                        low_link[node] = min(low_link[node], index_of[successor])
+                    continue
+
+                # all successors visited; if this node is a root of a component, pop it from the stack
+                work.pop()
+                if work:
+                    parent: str = work[-1][0]
+                    low_link[parent] = min(low_link[parent], low_link[node])
+                if low_link[node] == index_of[node]:
+                    component: MutableSequence[str] = []
+                    while True:
+                        member: str = stack.pop()
+                        on_stack.remove(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    if len(component) > 1 or node in graph[node].values():
+                        cycles.append(sorted(component, key=lambda n: order[n]))
+
+        return cycles
+
+    def _load_manifest_file(self, manifest_file: Path) -> dict:
+        with open(manifest_file, 'rb') as f:
+            source: bytes = f.read()
+            stat: os.stat_result = os.fstat(f.fileno())
+
+        # unchanged files (same path, mtime, size & content) were already parsed & validated by a previous run
+        key: str = JsonCache.hash({
+            'path': str(Path(manifest_file).absolute()),
+            'mtime': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'sha256': hashlib.sha256(source).hexdigest(),
+            'schema': Manifest.schema
+        })
+        manifest: dict = self._manifest_cache.get(key)
+        if manifest is not None:
+            return manifest
+
+        # read the manifest
+        try:
+            with Timings.span('parse', 'manifest', file=str(manifest_file)):
+                manifest = load_yaml(source.decode('utf-8'))
+        except yaml.YAMLError as e:
+            raise UserError(f"Manifest '{manifest_file}' is malformed: {e}") from e
 
-        def get_resource(name, data) -> Resource:
-            if name in resources:
-                return resources[name]
-
-            dependencies: MutableMapping[str, Resource] = {}
-            if 'dependencies' in data:
-                for alias, dep_resource_name in data['dependencies'].items():
-                    alias = post_process(alias, self.context.data)
-                    dep_resource_name = post_process(dep_resource_name, self.context.data)
-                    if dep_resource_name not in composite_manifest['resources']:
-                        raise UserError(f"resource '{name}' depends on an unknown resource: {dep_resource_name}")
-                    else:
-                        dep_resource_data = composite_manifest['resources'][dep_resource_name]
-                        dependencies[alias] = get_resource(dep_resource_name, dep_resource_data)
-            resources[name] = \
-                resource_factory(
-                    manifest=self,
-                    name=post_process(name, self.context.data),
-                    type=post_process(data['type'], self.context.data),
-                    readonly=post_process(data['readonly'], self.context.data) if 'readonly' in data else False,
-                    config=data['config'] if 'config' in data else {},
-                    dependencies=dependencies)
-            return resources[name]
-
-        for resource_name, resource in composite_manifest['resources'].items():
-            get_resource(resource_name, resource)
-
-        self._resources = resources
+        # validate the manifest
+        try:
+            with Timings.span('validate', 'manifest', file=str(manifest_file)):
+                validate(Manifest.validator, manifest)
+        except ValidationError as e:
+            raise UserError(f"Manifest '{manifest_file}' failed validation: {e.message}") from e
+
+        # only cache manifests that survive a JSON round-trip unchanged (eg. no dates, or non-string keys)
+        try:
+            if json.loads(json.dumps(manifest)) == manifest:
+                self._manifest_cache.put(key, manifest)
+        except (TypeError, ValueError):
+            pass
+        return manifest
 
     @property
     def context(self) -> Context:
@@ -509,6 +834,10 @@ class Manifest:
                             for pattern in value.resource_type_patterns:
                                 types_logger.info('- ' + pattern)
 
+    @property
+    def init_cache(self) -> InitCache:
+        return self._init_cache
+
     @property
     def manifest_files(self) -> Sequence[Path]:
         return self._manifest_files
@@ -526,3 +855,8 @@ class Manifest:
     @property
     def resources(self) -> Mapping[str, Resource]:
         return self._resources
+
+    @property
+    def levels(self) -> Sequence[Sequence[Resource]]:
+        """Resources grouped by dependency depth: each resource only depends on resources of previous levels."""
+        return self._levels
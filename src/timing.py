@@ -0,0 +1,196 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import MutableSequence, Sequence, MutableMapping, Any, Tuple
+
+from colors import underline, bold
+
+from util import Logger
+
+
+class Span:
+
+    def __init__(self,
+                 id: int,
+                 name: str,
+                 category: str,
+                 resource: str,
+                 thread: str,
+                 parent: 'Span',
+                 start: float,
+                 attributes: dict = None) -> None:
+        super().__init__()
+        self._id: int = id
+        self._name: str = name
+        self._category: str = category
+        self._resource: str = resource
+        self._thread: str = thread
+        self._parent: Span = parent
+        self._start: float = start
+        self._end: float = None
+        self._attributes: dict = attributes if attributes else {}
+
+    @property
+    def id(self) -> int:
+        return self._id
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def category(self) -> str:
+        return self._category
+
+    @property
+    def resource(self) -> str:
+        return self._resource
+
+    @property
+    def thread(self) -> str:
+        return self._thread
+
+    @property
+    def parent(self) -> 'Span':
+        return self._parent
+
+    @property
+    def start(self) -> float:
+        return self._start
+
+    @property
+    def end(self) -> float:
+        return self._end
+
+    @end.setter
+    def end(self, value: float) -> None:
+        self._end = value
+
+    @property
+    def duration(self) -> float:
+        return (self._end if self._end is not None else time.time()) - self._start
+
+    @property
+    def attributes(self) -> dict:
+        return self._attributes
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self._id,
+            'name': self._name,
+            'category': self._category,
+            'resource': self._resource,
+            'thread': self._thread,
+            'parent': self._parent.id if self._parent else None,
+            'start': self._start,
+            'end': self._end,
+            'duration': self.duration,
+            'attributes': self._attributes
+        }
+
+
+class Timings:
+    """Records (possibly nested) timed spans of the run's phases, across all threads. Nesting is tracked per-thread; a
+    span without an explicit resource inherits its parent's resource."""
+
+    _lock: threading.Lock = threading.Lock()
+    _spans: MutableSequence[Span] = []
+    _thread_state: threading.local = threading.local()
+
+    @staticmethod
+    def reset() -> None:
+        with Timings._lock:
+            Timings._spans = []
+
+    @staticmethod
+    def spans() -> Sequence[Span]:
+        with Timings._lock:
+            return list(Timings._spans)
+
+    @staticmethod
+    def current() -> Span:
+        stack: MutableSequence[Span] = getattr(Timings._thread_state, 'stack', None)
+        return stack[-1] if stack else None
+
+    @staticmethod
+    def _create(name: str, category: str, resource: str, start: float, attributes: dict) -> Span:
+        parent: Span = Timings.current()
+        with Timings._lock:
+            span: Span = Span(id=len(Timings._spans) + 1,
+                              name=name,
+                              category=category,
+                              resource=resource if resource is not None else parent.resource if parent else None,
+                              thread=threading.current_thread().name,
+                              parent=parent,
+                              start=start,
+                              attributes=attributes)
+            Timings._spans.append(span)
+        return span
+
+    @staticmethod
+    @contextmanager
+    def span(name: str, category: str, resource: str = None, **attributes: Any) -> Span:
+        span: Span = Timings._create(name, category, resource, time.time(), attributes)
+        if not hasattr(Timings._thread_state, 'stack'):
+            Timings._thread_state.stack = []
+        Timings._thread_state.stack.append(span)
+        try:
+            yield span
+        finally:
+            span.end = time.time()
+            Timings._thread_state.stack.pop()
+
+    @staticmethod
+    def record(name: str, category: str, start: float, end: float, resource: str = None, **attributes: Any) -> Span:
+        """Records an already-completed span (as a child of the current span)."""
+        span: Span = Timings._create(name, category, resource, start, attributes)
+        span.end = end
+        return span
+
+    @staticmethod
+    def summary() -> Sequence[dict]:
+        """Aggregates spans by category & name, sorted by total time (descending)."""
+        groups: MutableMapping[Tuple[str, str], MutableSequence[float]] = {}
+        for span in Timings.spans():
+            groups.setdefault((span.category, span.name), []).append(span.duration)
+        rows: Sequence[dict] = [{
+            'category': category,
+            'name': name,
+            'count': len(durations),
+            'total': sum(durations),
+            'mean': sum(durations) / len(durations),
+            'max': max(durations)
+        } for (category, name), durations in groups.items()]
+        return sorted(rows, key=lambda row: row['total'], reverse=True)
+
+    @staticmethod
+    def display() -> None:
+        rows: Sequence[dict] = Timings.summary()
+        if not rows:
+            return
+        with Logger(header=f":stopwatch: {underline('Timings:')}") as logger:
+            width: int = max(len(f"{row['category']}: {row['name']}") for row in rows)
+            logger.info(bold(f"{'phase'.ljust(width)}  {'count':>6}  {'total (s)':>10}  {'mean (ms)':>10}  "
+                             f"{'max (ms)':>10}"))
+            for row in rows:
+                logger.info(f"{(row['category'] + ': ' + row['name']).ljust(width)}  {row['count']:>6}  "
+                            f"{row['total']:>10.3f}  {row['mean'] * 1000:>10.1f}  {row['max'] * 1000:>10.1f}")
+
+    @staticmethod
+    def write_report(path: Path, **properties: Any) -> None:
+        spans: Sequence[Span] = Timings.spans()
+        start: float = min(span.start for span in spans) if spans else None
+        end: float = max(span.start + span.duration for span in spans) if spans else None
+        report: dict = dict(properties)
+        report.update({
+            'start': start,
+            'end': end,
+            'duration': end - start if spans else 0,
+            'summary': Timings.summary(),
+            'spans': [span.to_dict() for span in spans]
+        })
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(json.dumps(report, indent=2))
@@ -0,0 +1,65 @@
+import json
+from pathlib import Path
+from typing import Sequence, Mapping, MutableMapping, MutableSequence
+
+from timing import Span
+
+
+def trace_events(spans: Sequence[Span], dependencies: Mapping[str, Sequence[str]] = None) -> Sequence[dict]:
+    """Converts the given spans to Chrome trace events (as understood by chrome://tracing & Perfetto): one track per
+    thread, and a flow event from each resource's 'resolve' span to the 'resolve' spans of resources depending on it.
+
+    The 'dependencies' mapping maps each resource name to the names of the resources it depends on."""
+    if not spans:
+        return []
+    origin: float = min(span.start for span in spans)
+
+    def microseconds(timestamp: float) -> int:
+        return int(round((timestamp - origin) * 1000000))
+
+    # one track per thread, in order of first appearance
+    threads: MutableMapping[str, int] = {}
+    for span in spans:
+        threads.setdefault(span.thread, len(threads) + 1)
+    events: MutableSequence[dict] = [{'name': 'process_name', 'ph': 'M', 'pid': 1, 'args': {'name': 'deployster'}}]
+    for thread, tid in threads.items():
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': thread}})
+        events.append({'name': 'thread_sort_index', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'sort_index': tid}})
+
+    resolve_spans: MutableMapping[str, Span] = {}
+    for span in spans:
+        args: dict = {k: v if isinstance(v, (str, int, float, bool)) else str(v) for k, v in span.attributes.items()}
+        if span.resource:
+            args['resource'] = span.resource
+        events.append({
+            'name': f"{span.resource}: {span.name}" if span.resource and span.category == 'resource' else span.name,
+            'cat': span.category,
+            'ph': 'X',
+            'pid': 1,
+            'tid': threads[span.thread],
+            'ts': microseconds(span.start),
+            'dur': microseconds(span.start + span.duration) - microseconds(span.start),
+            'args': args
+        })
+        if span.name == 'resolve' and span.category == 'resource':
+            resolve_spans[span.resource] = span
+
+    # dependency edges: from the end of the dependency's resolution, to the start of the dependent's resolution
+    flow_id: int = 0
+    for resource, dependency_names in (dependencies if dependencies else {}).items():
+        for dependency in dependency_names:
+            if resource in resolve_spans and dependency in resolve_spans:
+                flow_id += 1
+                source: Span = resolve_spans[dependency]
+                target: Span = resolve_spans[resource]
+                events.append({'name': 'dependency', 'cat': 'dependency', 'ph': 's', 'id': flow_id, 'pid': 1,
+                               'tid': threads[source.thread], 'ts': microseconds(source.start + source.duration) - 1})
+                events.append({'name': 'dependency', 'cat': 'dependency', 'ph': 'f', 'bp': 'e', 'id': flow_id,
+                               'pid': 1, 'tid': threads[target.thread], 'ts': microseconds(target.start)})
+    return events
+
+
+def write_trace(path: Path, spans: Sequence[Span], dependencies: Mapping[str, Sequence[str]] = None) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(json.dumps({'traceEvents': trace_events(spans, dependencies), 'displayTimeUnit': 'ms'}))
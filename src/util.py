@@ -1,13 +1,19 @@
+import json
 import termios
+import threading
 import tty
-from contextlib import AbstractContextManager
+from contextlib import AbstractContextManager, contextmanager
+from functools import lru_cache
 from pathlib import Path
 from pprint import pformat
-from typing import Any, Callable
+from typing import Any, Callable, MutableSequence, Tuple
 
 import emoji
+import jsonschema
+import yaml
 from colors import *
 from jinja2 import Environment, Template, Undefined, FileSystemLoader
+from jinja2.environment import TemplateExpression
 from jinja2.exceptions import TemplateSyntaxError, UndefinedError
 
 
@@ -17,33 +23,117 @@ class UserError(Exception):
         self.message = message
 
 
+# prefer the (much faster) libyaml-based loader, when available
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
+
+def load_yaml(source: str) -> Any:
+    return yaml.load(source, Loader=YamlLoader)
+
+
+# validators of schemas, keyed by their canonical JSON representation
+_schema_validators: dict = {}
+_schema_validators_lock: threading.Lock = threading.Lock()
+
+
+def create_validator(schema: dict) -> Any:
+    """Returns a validator for the given schema, checking the schema itself (against its metaschema) only once."""
+    cls = jsonschema.validators.validator_for(schema)
+    cls.check_schema(schema)
+    return cls(schema)
+
+
+def cached_validator(schema: dict) -> Any:
+    """Like 'create_validator', but returns the same validator for equal schemas."""
+    key: str = json.dumps(schema, sort_keys=True)
+    with _schema_validators_lock:
+        validator = _schema_validators.get(key)
+    if validator is None:
+        validator = create_validator(schema)
+        with _schema_validators_lock:
+            validator = _schema_validators.setdefault(key, validator)
+    return validator
+
+
+def validate(validator: Any, instance: Any) -> None:
+    """Validates the given instance in a single pass, raising the first validation error found (if any)."""
+    error = next(validator.iter_errors(instance), None)
+    if error is not None:
+        raise error
+
+
 class Logger(AbstractContextManager):
-    _global_indent: int = 0
+    # indentation is tracked per-thread, so that resources executed concurrently do not mess up each other's nesting
+    _thread_state: threading.local = threading.local()
+
+    # serializes printing (and prompting) across threads
+    output_lock: threading.RLock = threading.RLock()
 
     def __init__(self, header: str = None, indent_amount: int = 6, spacious: bool = True) -> None:
         super().__init__()
         self._header: str = header
         self._indent_amount: int = indent_amount
         self._spacious: bool = spacious
-        self._indent: int = Logger._global_indent
+        self._indent: int = Logger.current_indent()
         self._line_ended: bool = True
 
+    @staticmethod
+    def current_indent() -> int:
+        return getattr(Logger._thread_state, 'indent', 0)
+
+    @staticmethod
+    @contextmanager
+    def worker_thread(indent: int, buffer: MutableSequence[Tuple[bool, str]] = None):
+        """Sets up logging for a worker thread: loggers created in the current thread continue the given indentation
+        (usually the indentation of the thread that spawned the worker), and if a buffer is given, output is collected
+        into it instead of being printed (see 'Logger.flush_buffer')."""
+        previous_indent: int = Logger.current_indent()
+        previous_buffer: MutableSequence[Tuple[bool, str]] = getattr(Logger._thread_state, 'buffer', None)
+        Logger._thread_state.indent = indent
+        Logger._thread_state.buffer = buffer
+        try:
+            yield
+        finally:
+            Logger._thread_state.indent = previous_indent
+            Logger._thread_state.buffer = previous_buffer
+
+    @staticmethod
+    def flush_buffer(buffer: MutableSequence[Tuple[bool, str]]) -> None:
+        with Logger.output_lock:
+            for to_stderr, text in buffer:
+                Logger._write(text, to_stderr)
+            buffer.clear()
+
+    @staticmethod
+    def _write(text: str, to_stderr: bool) -> None:
+        buffer: MutableSequence[Tuple[bool, str]] = getattr(Logger._thread_state, 'buffer', None)
+        if buffer is not None:
+            buffer.append((to_stderr, text))
+        else:
+            with Logger.output_lock:
+                stream = sys.stderr if to_stderr else sys.stdout
+                stream.write(text)
+                stream.flush()
+
     def __enter__(self) -> 'Logger':
         if self._header:
             self.info(self._header)
             if self._spacious:
                 self.info('')
 
-        Logger._global_indent += self._indent_amount
-        self._indent: int = Logger._global_indent
+        Logger._thread_state.indent = Logger.current_indent() + self._indent_amount
+        self._indent: int = Logger.current_indent()
         return self
 
     def __exit__(self, exc_type, exc_value, traceback) -> Any:
         if exc_value is None and self._spacious:
             self.info('')
 
-        Logger._global_indent -= self._indent_amount
-        self._indent: int = Logger._global_indent
+        Logger._thread_state.indent = Logger.current_indent() - self._indent_amount
+        self._indent: int = Logger.current_indent()
 
         # returning None means that exception should be handled as normal by the caller; if we returned True then
         # the exception would be SUPPRESSED and not raised onward. (you normally wouldn't want that)
@@ -60,18 +150,15 @@ class Logger(AbstractContextManager):
             return first_line + rest_lines
 
     def info(self, message: str, newline: bool = True) -> None:
-        print(self._wrap_message(message), file=sys.stdout, end='\n' if newline else '')
-        sys.stdout.flush()
+        Logger._write(self._wrap_message(message) + ('\n' if newline else ''), to_stderr=False)
         self._line_ended: bool = newline
 
     def warn(self, message: str, newline: bool = True) -> None:
-        print(self._wrap_message(message, yellow), file=sys.stdout, end='\n' if newline else '')
-        sys.stdout.flush()
+        Logger._write(self._wrap_message(message, yellow) + ('\n' if newline else ''), to_stderr=False)
         self._line_ended: bool = newline
 
     def error(self, message: str, newline: bool = True) -> None:
-        print(self._wrap_message(message, red), file=sys.stderr, end='\n' if newline else '')
-        sys.stderr.flush()
+        Logger._write(self._wrap_message(message, red) + ('\n' if newline else ''), to_stderr=True)
         self._line_ended: bool = newline
 
 
@@ -105,33 +192,104 @@ def ask(logger: Logger, message: str, chars: str, default: str) -> str:
         prompt = prompt + (c.upper() if c == default else c.lower())
         prompt = prompt + '/'
     prompt = prompt[0:len(prompt) - 1] + '] '
-    logger.info(prompt, newline=False)
-
-    while True:
-        ch = getch().lower()
-        if ord(ch[0]) == 3 or ord(ch[0]) == 4:
-            raise KeyboardInterrupt()
-        elif ch.lower()[0] in chars.lower():
-            logger.info(bold(ch.lower()))
-            return ch
 
+    # hold the output lock while waiting for the user, so concurrent resources do not print over the prompt
+    with Logger.output_lock:
+        logger.info(prompt, newline=False)
+
+        while True:
+            ch = getch().lower()
+            if ord(ch[0]) == 3 or ord(ch[0]) == 4:
+                raise KeyboardInterrupt()
+            elif ch.lower()[0] in chars.lower():
+                logger.info(bold(ch.lower()))
+                return ch
+
+
+@lru_cache(maxsize=None)
+def _jinja_environment(path: str) -> Environment:
+    return Environment(loader=FileSystemLoader(path))
+
+
+@lru_cache(maxsize=4096)
+def _compile_expression(path: str, source: str) -> TemplateExpression:
+    return _jinja_environment(path).compile_expression(source=source, undefined_to_none=False)
+
+
+@lru_cache(maxsize=4096)
+def _compile_template(path: str, source: str) -> Any:
+    # only the compiled code is cached, since each template is bound to the globals (context) it is rendered with
+    return _jinja_environment(path).compile(source)
+
+
+def post_process_cache_info() -> dict:
+    """Returns the combined size & hit/miss counters of the compiled expressions & templates caches."""
+    infos = [_compile_expression.cache_info(), _compile_template.cache_info()]
+    hits: int = sum(info.hits for info in infos)
+    misses: int = sum(info.misses for info in infos)
+    return {
+        'size': sum(info.currsize for info in infos),
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / (hits + misses) if hits + misses else 0.0
+    }
+
+
+def is_template(value: str) -> bool:
+    return value.find('{{') >= 0 or value.find('{%') >= 0
+
+
+def analyze_templates(value: Any) -> Any:
+    """Returns a rendering plan for the given value, for use with 'post_process': None if nothing in it is templated,
+    True for a templated string, or (for dicts & lists) a dict mapping each key/index that leads to templated strings
+    to its own plan."""
+    if isinstance(value, str):
+        return True if is_template(value) else None
+    elif isinstance(value, dict):
+        plan: dict = {}
+        for k, v in value.items():
+            item_plan: Any = analyze_templates(v)
+            if item_plan is not None:
+                plan[k] = item_plan
+        return plan if plan else None
+    elif isinstance(value, list):
+        plan: dict = {}
+        for index, item in enumerate(value):
+            item_plan: Any = analyze_templates(item)
+            if item_plan is not None:
+                plan[index] = item_plan
+        return plan if plan else None
+    else:
+        return None
+
+
+_ANALYZE = object()
+
+
+def post_process(value: Any, context: dict, plan: Any = _ANALYZE) -> Any:
+    """Renders the templated strings in the given value. Only containers leading to templated strings are copied -
+    untemplated subtrees are shared with the given value (and must therefore not be modified by the caller). A plan
+    previously computed by 'analyze_templates' for this value may be provided to avoid re-analyzing it."""
+
+    # templates may include files relative to the current directory, which is why environments are kept per-directory
+    path: str = str(Path('.').absolute())
 
-def post_process(value: Any, context: dict) -> Any:
     def _evaluate(expr: str) -> Any:
-        environment: Environment = Environment(loader=FileSystemLoader(str(Path('.').absolute())))
         try:
             if expr.startswith('{{') and expr.endswith('}}') and expr.find('{{') == expr.rfind('{{'):
                 # line is a single expression (only one '{{' token at the beginning, and '}}' at the end)
                 expr = expr[2:len(expr) - 2]
-                result = environment.compile_expression(source=expr, undefined_to_none=False)(context)
+                result = _compile_expression(path, expr)(context)
                 if type(result) == Undefined:
                     raise UserError(f"expression '{expr}' yielded an undefined result (are all variables defined?)\n"
                                     f"Context is: {pformat(context)}")
                 else:
                     return result
-            elif expr.find('{{') >= 0 or expr.find('{%') >= 0:
+            elif is_template(expr):
                 # given string contains a jinja expression, use normal templating
-                template: Template = environment.from_string(expr, globals=context)
+                environment: Environment = _jinja_environment(path)
+                template: Template = Template.from_code(environment, _compile_template(path, expr),
+                                                        environment.make_globals(context), None)
                 return template.render(context)
             else:
                 return expr
@@ -142,21 +300,22 @@ def post_process(value: Any, context: dict) -> Any:
             raise UserError(f"expression error in '{expr}': {e.message}\n"
                             f"Context is: {pformat(context)}") from e
 
-    def _post_process_config(value) -> Any:
-        if isinstance(value, str):
+    def _post_process_config(value: Any, plan: Any) -> Any:
+        if plan is None:
+            return value
+        elif isinstance(value, str):
             return _evaluate(value)
-
         elif isinstance(value, dict):
-            copy: dict = {}
-            for k, v in value.items():
-                copy[k] = _post_process_config(value=v)
+            copy: dict = dict(value)
+            for k, item_plan in plan.items():
+                copy[k] = _post_process_config(value=value[k], plan=item_plan)
             return copy
         elif isinstance(value, list):
-            copy: list = []
-            for item in value:
-                copy.append(_post_process_config(value=item))
+            copy: list = list(value)
+            for index, item_plan in plan.items():
+                copy[index] = _post_process_config(value=value[index], plan=item_plan)
             return copy
         else:
             return value
 
-    return _post_process_config(value=value)
+    return _post_process_config(value=value, plan=analyze_templates(value) if plan is _ANALYZE else plan)
@@ -0,0 +1,168 @@
+import json
+import threading
+from collections import deque
+from subprocess import Popen, PIPE, TimeoutExpired
+from threading import Thread
+from typing import Sequence, MutableSequence, MutableMapping, Tuple, Callable, Deque
+
+from util import UserError
+
+
+class Worker:
+    """A long-lived resource container, serving action invocations as newline-delimited JSON-RPC 2.0 requests over its
+    stdin & stdout (see 'serve' in the 'dresources' module). Serves one request at a time."""
+
+    def __init__(self, command: Sequence[str], image: str) -> None:
+        super().__init__()
+        self._command: Tuple[str, ...] = tuple(command)
+        self._image: str = image
+        self._next_id: int = 1
+        self._request_lock: threading.Lock = threading.Lock()
+        self._stderr_handler: Callable[[str], None] = None
+        self._stderr_tail: Deque[str] = deque(maxlen=20)
+        self._process: Popen = Popen(command, shell=False, stdin=PIPE, stdout=PIPE, stderr=PIPE,
+                                     universal_newlines=True)
+
+        # stderr not attributed to a request (eg. start-up errors) is kept for error messages
+        self._stderr_thread: Thread = Thread(target=self._read_stderr, name=f"{image}-worker-stderr", daemon=True)
+        self._stderr_thread.start()
+
+    @property
+    def command(self) -> Tuple[str, ...]:
+        return self._command
+
+    @property
+    def image(self) -> str:
+        return self._image
+
+    @property
+    def alive(self) -> bool:
+        return self._process.poll() is None
+
+    def _read_stderr(self) -> None:
+        for line in iter(self._process.stderr.readline, ''):
+            line = line[0:len(line) - 1] if line.endswith('\n') else line
+            handler: Callable[[str], None] = self._stderr_handler
+            if handler:
+                handler(line)
+            else:
+                self._stderr_tail.append(line)
+
+    def _fail(self, message: str) -> UserError:
+        tail: str = '\n'.join(self._stderr_tail)
+        return UserError(f"worker of '{self._image}' failed: {message}" + (f"\n{tail}" if tail else ''))
+
+    def request(self,
+                method: str,
+                params: dict,
+                stdout_handler: Callable[[str], None],
+                stderr_handler: Callable[[str], None]) -> int:
+        """Sends a request to the worker, dispatching its output to the given handlers; returns its exit code."""
+        with self._request_lock:
+            request_id: int = self._next_id
+            self._next_id += 1
+            self._stderr_handler = stderr_handler
+            try:
+                try:
+                    self._process.stdin.write(json.dumps({
+                        'jsonrpc': '2.0',
+                        'id': request_id,
+                        'method': method,
+                        'params': params
+                    }) + '\n')
+                    self._process.stdin.flush()
+                except OSError as e:
+                    raise self._fail(f"could not send request ({e})") from e
+
+                for line in iter(self._process.stdout.readline, ''):
+                    try:
+                        message: dict = json.loads(line)
+                    except ValueError as e:
+                        raise self._fail(f"invalid message: {line.strip()}") from e
+
+                    if 'id' not in message:
+                        if message.get('method') == 'output' and message['params']['id'] == request_id:
+                            params: dict = message['params']
+                            handler = stdout_handler if params['stream'] == 'stdout' else stderr_handler
+                            handler(params['line'])
+                    elif 'error' in message:
+                        raise self._fail(message['error']['message'])
+                    elif message['id'] == request_id:
+                        return message['result']['exit_code']
+
+                raise self._fail(f"worker exited unexpectedly (exit code {self._process.wait()})")
+            finally:
+                self._stderr_handler = None
+
+    def close(self, timeout: float = 10) -> None:
+        # closing stdin ends the worker's request loop (& thus its container)
+        try:
+            self._process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self._process.wait(timeout=timeout)
+        except TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+        self._stderr_thread.join()
+
+
+class WorkerPool:
+    """Pool of warm workers, keyed by their command (image, volumes, etc). Since each worker serves one request at a
+    time, concurrent invocations of the same image start additional workers."""
+
+    _shared: 'WorkerPool' = None
+    _shared_lock: threading.Lock = threading.Lock()
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._lock: threading.Lock = threading.Lock()
+        self._idle: MutableMapping[Tuple[str, ...], MutableSequence[Worker]] = {}
+        self._workers: MutableSequence[Worker] = []
+
+    @staticmethod
+    def shared() -> 'WorkerPool':
+        """Returns the process-wide pool."""
+        with WorkerPool._shared_lock:
+            if WorkerPool._shared is None:
+                WorkerPool._shared = WorkerPool()
+            return WorkerPool._shared
+
+    @property
+    def workers(self) -> Sequence[Worker]:
+        with self._lock:
+            return list(self._workers)
+
+    def acquire(self, command: Sequence[str], image: str) -> Worker:
+        key: Tuple[str, ...] = tuple(command)
+        with self._lock:
+            idle: MutableSequence[Worker] = self._idle.setdefault(key, [])
+            while idle:
+                worker: Worker = idle.pop()
+                if worker.alive:
+                    return worker
+        worker: Worker = Worker(command=command, image=image)
+        with self._lock:
+            self._workers.append(worker)
+        return worker
+
+    def release(self, worker: Worker) -> None:
+        if worker.alive:
+            with self._lock:
+                self._idle.setdefault(worker.command, []).append(worker)
+
+    def discard(self, worker: Worker) -> None:
+        """Closes a worker whose state is unknown (eg. after a failed request), rather than returning it to the pool."""
+        with self._lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+        worker.close()
+
+    def close(self) -> None:
+        with self._lock:
+            workers: Sequence[Worker] = self._workers
+            self._workers = []
+            self._idle = {}
+        for worker in workers:
+            worker.close()
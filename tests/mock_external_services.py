@@ -1,8 +1,15 @@
+import json
+import socketserver
+import sys
+import threading
 import time
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
 from pathlib import Path
 from typing import Mapping, Sequence, Union, Any, Tuple
 
 from docker import DockerInvoker
+from journal import Journal
 from external_services import ExternalServices, SqlExecutor
 from util import Logger
 
@@ -13,18 +20,46 @@ class MockDockerInvoker(DockerInvoker):
                  volumes: Sequence[str] = None,
                  return_code: int = -1,
                  stderr: str = '',
-                 stdout: str = '') -> None:
+                 stdout: str = '',
+                 latency: float = 0,
+                 image_id: str = None) -> None:
         super().__init__(volumes)
         self._mock_return_code = return_code
         self._mock_stderr = stderr
         self._mock_stdout = stdout
+        self._mock_latency = latency
+        self._mock_image_id = image_id
+        self.invocations: int = 0
+
+    def inspect_image_id(self, image: str) -> Union[None, str]:
+        return self._mock_image_id
 
     def _invoke(self, local_work_dir: Path, container_work_dir: str, image: str, entrypoint: str = None,
                 args: Sequence[str] = None, input: dict = None, stderr_logger: Logger = None,
                 stdout_logger: Logger = None) -> Tuple[int, str, str]:
+        self.invocations += 1
+        if self._mock_latency:
+            time.sleep(self._mock_latency)
         return self._mock_return_code, self._mock_stdout, self._mock_stderr
 
 
+class MockProcessDockerInvoker(DockerInvoker):
+    """Runs a local process instead of a Docker container, exercising the real process & output handling of the
+    invoker. The process echoes its stdin back to stdout after sleeping for the given duration (in seconds)."""
+
+    def __init__(self, volumes: Sequence[str] = None, duration: float = 0, journal: Journal = None) -> None:
+        super().__init__(volumes, journal=journal)
+        self._duration: float = duration
+
+    def inspect_image_id(self, image: str) -> Union[None, str]:
+        return None
+
+    def _command(self, container_work_dir: str, image: str, entrypoint: str = None,
+                 args: Sequence[str] = None, labels: Mapping[str, str] = None) -> Sequence[str]:
+        return [sys.executable, '-c', f"import sys, time; time.sleep({self._duration}); "
+                                      f"print(sys.stdin.read())"]
+
+
 class MockSqlExecutor(SqlExecutor):
 
     def __init__(self, svc: ExternalServices, sql_execution_results: Mapping[str, Sequence[dict]] = None) -> None:
@@ -98,13 +133,15 @@ class MockExternalServices(ExternalServices):
     def find_gcp_project_enabled_apis(self, project_id: str) -> Sequence[str]:
         return self._gcp_project_apis[project_id] if project_id in self._gcp_project_apis else None
 
-    def wait_for_gcp_service_manager_operation(self, result):
-        pass
+    def wait_for_gcp_service_usage_operations(self,
+                                              results: Sequence[Union[dict, Exception]],
+                                              timeout: int = 60 * 10) -> Sequence[dict]:
+        return results
 
-    def enable_gcp_project_api(self, project_id: str, api: str) -> None:
+    def enable_gcp_project_apis(self, project_id: str, apis: Sequence[str]) -> None:
         pass
 
-    def disable_gcp_project_api(self, project_id: str, api: str) -> None:
+    def disable_gcp_project_apis(self, project_id: str, apis: Sequence[str]) -> None:
         pass
 
     def wait_for_gcp_resource_manager_operation(self, result):
@@ -262,6 +299,10 @@ class MockExternalServices(ExternalServices):
         key = f"{api_version}-{kind}-{namespace}-{name}"
         return self._k8s_objects[key] if key in self._k8s_objects else None
 
+    def find_k8s_objects(self, manifests: Sequence[dict]) -> Sequence[Union[None, dict]]:
+        return [self.find_k8s_namespace_object(manifest) if 'namespace' in manifest['metadata']
+                else self.find_k8s_cluster_object(manifest) for manifest in manifests]
+
     def create_k8s_object(self, manifest: dict, timeout: int = 60 * 5, verbose: bool = True) -> None:
         api_version: str = manifest["apiVersion"]
         kind: str = manifest["kind"]
@@ -285,3 +326,123 @@ class MockExternalServices(ExternalServices):
         if self._k8s_create_times is not None and key in self._k8s_create_times:
             duration: int = self._k8s_create_times[key]
             time.sleep(duration / 1000)
+
+
+class MockDockerEngine:
+    """Minimal stand-in for the Docker Engine API, served over a Unix socket. Containers echo their stdin back to
+    stdout, and write their image name to stderr."""
+
+    def __init__(self, socket_path: str, images: Mapping[str, str] = None) -> None:
+        self.socket_path: str = socket_path
+        self.images: dict = dict(images) if images else {}
+        self.requests: list = []
+        self.connections: int = 0
+        self.containers: dict = {}
+        self.removed: list = []
+        self.registry_auths: list = []
+        engine = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                engine.connections += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def _body(self) -> Any:
+                length: int = int(self.headers.get('Content-Length', 0))
+                return json.loads(self.rfile.read(length).decode('utf-8')) if length else None
+
+            def _respond(self, status: int, body: Any = None) -> None:
+                data: bytes = json.dumps(body).encode('utf-8') if body is not None else b''
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                engine.requests.append(('GET', self.path))
+                if self.path == '/_ping':
+                    self._respond(200, 'OK')
+                elif self.path.startswith('/containers/json'):
+                    filters: dict = json.loads(parse_qs(urlparse(self.path).query)['filters'][0])
+                    label: str = filters['label'][0]
+                    matches: list = []
+                    for container_id, container in engine.containers.items():
+                        if container_id in engine.removed:
+                            continue
+                        labels: list = [k for k in container['Labels']] + \
+                                       [f"{k}={v}" for k, v in container['Labels'].items()]
+                        state: str = container.get('State', 'exited')
+                        if label in labels and ('status' not in filters or state in filters['status']):
+                            matches.append({'Id': container_id})
+                    self._respond(200, matches)
+                elif self.path.startswith('/images/') and self.path.endswith('/json'):
+                    image: str = self.path[len('/images/'):-len('/json')]
+                    if image in engine.images:
+                        self._respond(200, {'Id': engine.images[image]})
+                    else:
+                        self._respond(404, {'message': f"No such image: {image}"})
+                else:
+                    self._respond(404, {'message': 'not found'})
+
+            def do_DELETE(self):
+                engine.requests.append(('DELETE', self.path.split('?')[0]))
+                container_id: str = self.path.split('/')[2].split('?')[0]
+                if container_id in engine.containers and container_id not in engine.removed:
+                    engine.removed.append(container_id)
+                    self._respond(204)
+                else:
+                    self._respond(404, {'message': f"No such container: {container_id}"})
+
+            def do_POST(self):
+                engine.requests.append(('POST', self.path.split('?')[0]))
+                body: Any = self._body()
+                if self.path == '/containers/create':
+                    if body['Image'] not in engine.images:
+                        self._respond(404, {'message': f"No such image: {body['Image']}"})
+                    else:
+                        container_id: str = f"c{len(engine.containers) + 1}"
+                        engine.containers[container_id] = body
+                        self._respond(201, {'Id': container_id})
+                elif self.path.startswith('/images/create'):
+                    engine.registry_auths.append(self.headers.get('X-Registry-Auth'))
+                    image: str = self.path.split('fromImage=')[1].split('&')[0] + ':' + self.path.split('tag=')[1]
+                    engine.images[image] = f"sha256:{image}"
+                    self._respond(200)
+                elif self.path.endswith('/start'):
+                    self._respond(204)
+                elif self.path.endswith('/wait'):
+                    self._respond(200, {'StatusCode': 0})
+                elif '/attach' in self.path:
+                    container_id: str = self.path.split('/')[2]
+                    self.send_response(101)
+                    self.send_header('Connection', 'Upgrade')
+                    self.send_header('Upgrade', 'tcp')
+                    self.end_headers()
+                    self.wfile.flush()
+                    stdin: bytes = self.rfile.read()
+                    for stream, payload in [(1, stdin), (2, engine.containers[container_id]['Image'].encode())]:
+                        # split payloads across frames, to exercise the demultiplexer
+                        for i in range(0, len(payload), 7):
+                            chunk: bytes = payload[i:i + 7]
+                            self.wfile.write(bytes([stream, 0, 0, 0]) + len(chunk).to_bytes(4, 'big') + chunk)
+                    self.close_connection = True
+                else:
+                    self._respond(404, {'message': 'not found'})
+
+        self._server = socketserver.ThreadingUnixStreamServer(socket_path, Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def __enter__(self) -> 'MockDockerEngine':
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,154 @@
+import json
+import os
+import shutil
+from pathlib import Path
+
+import yaml
+
+from cache import JsonCache, InitCache
+from context import Context
+from manifest import Manifest, Resource
+from mock_external_services import MockDockerInvoker
+
+
+def clean_dir(path: str) -> Path:
+    shutil.rmtree(path, ignore_errors=True)
+    return Path(path)
+
+
+def test_json_cache():
+    cache: JsonCache = JsonCache(path=clean_dir('./tests/.cache/json_cache'))
+    assert cache.get('k1') is None
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    cache.put('k1', {'a': 1})
+    assert cache.get('k1') == {'a': 1}
+    assert cache.peek('k1') == {'a': 1}
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.delete('k1')
+    assert cache.get('k1') is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_json_cache_disabled():
+    cache: JsonCache = JsonCache(path=clean_dir('./tests/.cache/json_cache_disabled'), enabled=False)
+    cache.put('k1', {'a': 1})
+    assert cache.get('k1') is None
+    assert (cache.hits, cache.misses) == (0, 0)
+
+
+def test_json_cache_unwritable():
+    path: Path = clean_dir('./tests/.cache/json_cache_unwritable')
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text('not a directory')
+    cache: JsonCache = JsonCache(path=path)
+    cache.put('k1', {'a': 1})
+    assert not cache.writable
+    assert cache.get('k1') is None
+
+
+def test_init_cache_invalidated_when_tag_is_repointed():
+    path: Path = clean_dir('./tests/.cache/init_cache')
+    cache: InitCache = InitCache(path=path)
+    input: dict = {'name': 'r1', 'type': 'img:1', 'version': '1.2.3', 'verbose': False, 'workspace': '/ws'}
+
+    cache.put(image='img:1', image_id='sha256:1', input=input, result={'v': 1})
+    assert cache.get(image_id='sha256:1', input=input) == {'v': 1}
+
+    # resource name is not part of the key
+    assert cache.get(image_id='sha256:1', input=dict(input, name='r2')) == {'v': 1}
+
+    # but the rest of the input is
+    assert cache.get(image_id='sha256:1', input=dict(input, version='2.0.0')) is None
+
+    # re-pointing the tag to a new image evicts the result of the previous image
+    cache.put(image='img:1', image_id='sha256:2', input=input, result={'v': 2})
+    assert cache.get(image_id='sha256:2', input=input) == {'v': 2}
+    assert cache.get(image_id='sha256:1', input=input) is None
+    assert len(os.listdir(str(path))) == 2
+
+
+def test_resource_initialize_uses_init_cache():
+    scenario_dir: Path = clean_dir('./tests/.cache/init_cache_scenario')
+    os.makedirs(str(scenario_dir))
+    manifest_file: Path = scenario_dir / 'manifest.yaml'
+    with manifest_file.open('w') as f:
+        f.write(yaml.dump({'resources': {'r1': {'type': 'img:1'}, 'r2': {'type': 'img:1'}}}))
+
+    def create_manifest(init_cache: bool) -> Manifest:
+        context: Context = Context(version_file_path='./tests/test_version', env={
+            "CONF_DIR": str(scenario_dir / 'conf'),
+            "WORKSPACE_DIR": str(scenario_dir / 'workspace'),
+            "WORK_DIR": str(scenario_dir / 'work')
+        })
+        context.init_cache = init_cache
+        return Manifest(context=context, manifest_files=[manifest_file])
+
+    init_result: str = json.dumps({'state_action': {'args': ['state']}})
+
+    def initialize(resource: Resource, image_id: str = 'sha256:1') -> MockDockerInvoker:
+        invoker: MockDockerInvoker = MockDockerInvoker(return_code=0, stdout=init_result, image_id=image_id)
+        resource._docker_invoker = invoker
+        resource.initialize()
+        return invoker
+
+    # first resource misses, second resource (same image) hits
+    manifest: Manifest = create_manifest(init_cache=True)
+    assert initialize(manifest.resource('r1')).invocations == 1
+    assert initialize(manifest.resource('r2')).invocations == 0
+    assert (manifest.init_cache.hits, manifest.init_cache.misses) == (1, 1)
+
+    # cache survives across runs
+    manifest: Manifest = create_manifest(init_cache=True)
+    assert initialize(manifest.resource('r1')).invocations == 0
+
+    # a re-pointed tag is a miss
+    assert initialize(manifest.resource('r1'), image_id='sha256:2').invocations == 1
+
+    # images that are not available locally are never cached
+    assert initialize(manifest.resource('r1'), image_id=None).invocations == 1
+
+    # cache can be disabled
+    manifest: Manifest = create_manifest(init_cache=False)
+    assert initialize(manifest.resource('r1'), image_id='sha256:2').invocations == 1
+    assert (manifest.init_cache.hits, manifest.init_cache.misses) == (0, 0)
+
+
+def test_manifest_cache():
+    scenario_dir: Path = clean_dir('./tests/.cache/manifest_cache_scenario')
+    os.makedirs(str(scenario_dir))
+    manifest_file: Path = scenario_dir / 'manifest.yaml'
+    with manifest_file.open('w') as f:
+        f.write(yaml.dump({'resources': {'r1': {'type': 'img:1'}}}))
+
+    def create_manifest(manifest_cache: bool = True) -> Manifest:
+        context: Context = Context(version_file_path='./tests/test_version', env={
+            "CONF_DIR": str(scenario_dir / 'conf'),
+            "WORKSPACE_DIR": str(scenario_dir / 'workspace'),
+            "WORK_DIR": str(scenario_dir / 'work')
+        })
+        context.manifest_cache = manifest_cache
+        return Manifest(context=context, manifest_files=[manifest_file])
+
+    manifest: Manifest = create_manifest()
+    assert (manifest._manifest_cache.hits, manifest._manifest_cache.misses) == (0, 1)
+    manifest: Manifest = create_manifest()
+    assert (manifest._manifest_cache.hits, manifest._manifest_cache.misses) == (1, 0)
+    assert manifest.resource('r1').type == 'img:1'
+
+    # changed files are parsed (and validated) again
+    with manifest_file.open('w') as f:
+        f.write(yaml.dump({'resources': {'r1': {'type': 'img:2'}}}))
+    manifest: Manifest = create_manifest()
+    assert (manifest._manifest_cache.hits, manifest._manifest_cache.misses) == (0, 1)
+    assert manifest.resource('r1').type == 'img:2'
+
+    # documents that would not survive a JSON round-trip are never cached
+    with manifest_file.open('w') as f:
+        f.write("resources:\n  r1:\n    type: img:3\n    config:\n      date: 2018-01-01\n")
+    assert create_manifest().resource('r1').type == 'img:3'
+    assert create_manifest()._manifest_cache.hits == 0
+
+    # cache can be disabled
+    assert create_manifest(manifest_cache=False)._manifest_cache.misses == 0
@@ -1,9 +1,21 @@
+import base64
 import json
+import os
+import shutil
+import sys
+import tempfile
+import time
 from pathlib import Path
+from typing import Sequence
 
 import pytest
 
-from mock_external_services import MockDockerInvoker
+from docker import DockerEngineInvoker, DockerInvoker, InProcessDockerInvoker, create_docker_invoker, RUN_LABEL, \
+    RESOURCE_LABEL
+from context import Context
+from journal import Journal
+import docker
+from mock_external_services import MockDockerInvoker, MockProcessDockerInvoker, MockDockerEngine
 from util import UserError, Logger
 
 
@@ -71,3 +83,334 @@ def test_docker_invoker_run_json():
                                                                                    entrypoint=None,
                                                                                    args=None,
                                                                                    input=None)
+
+
+def test_docker_invoker_process_handling(tmpdir):
+    data: dict = {'k1': 'v1', 'k2': ['a', 'b']}
+    invoker: MockProcessDockerInvoker = MockProcessDockerInvoker(duration=0.2)
+    work_dir: Path = Path(str(tmpdir))
+
+    # completion is detected as soon as the process exits, rather than on the next polling interval
+    start: float = time.time()
+    result: dict = invoker.run_json(logger=Logger(), local_work_dir=work_dir, container_work_dir='/', image='img',
+                                    input=data)
+    assert time.time() - start < 0.9
+    assert result == data
+    assert [f for f in os.listdir(str(work_dir)) if f.startswith('stdin-')]
+
+
+def test_docker_invoker_journal():
+    data: dict = {'k1': 'v1', 'k2': ['a', 'b']}
+    run_dir: Path = Path('./tests/.cache/docker_invoker_journal')
+    shutil.rmtree(str(run_dir), ignore_errors=True)
+    journal: Journal = Journal(run_dir / 'journal.jsonl')
+    invoker: MockProcessDockerInvoker = MockProcessDockerInvoker(journal=journal)
+
+    # output is returned from memory, and recorded in the journal instead of per-invocation files
+    for action in ['init', 'state']:
+        result: dict = invoker.run_json(logger=Logger(), local_work_dir=run_dir / 'r1' / action,
+                                        container_work_dir='/', image='img', input=dict(data, action=action))
+        assert result == dict(data, action=action)
+    journal.close()
+    assert os.listdir(str(run_dir)) == ['journal.jsonl']
+
+    invocations: Sequence[dict] = Journal.invocations(run_dir / 'journal.jsonl')
+    assert [(i['resource'], i['action'], i['image'], i['exit_code']) for i in invocations] == \
+           [('r1', 'init', 'img', 0), ('r1', 'state', 'img', 0)]
+    assert invocations[1]['stdin'] == dict(data, action='state')
+    assert json.loads('\n'.join(invocations[1]['stdout'])) == dict(data, action='state')
+    assert invocations[0]['id'] != invocations[1]['id']
+
+
+
+IN_PROCESS_MODULE = """
+import os
+from dresources import DResource, action, resource_main
+
+class PlugResource(DResource):
+
+    def __init__(self, data: dict) -> None:
+        super().__init__(data=data, svc=None)
+        self.add_plug(name='kube', container_path='/root/.kube', optional=False, writable=False)
+
+    def discover_state(self):
+        return {'pid': os.getpid(), 'plug': self.get_plug('kube').path, 'config': os.environ['ECHO_CONFIG']}
+
+    def get_actions_for_missing_state(self):
+        return []
+
+    def get_actions_for_discovered_state(self, state: dict):
+        return []
+
+    @action
+    def fail(self, args) -> None:
+        os.system('echo from a sub-process >&2')
+        raise Exception('failed!')
+
+def main():
+    resource_main(PlugResource)
+"""
+
+
+def test_in_process_docker_invoker(tmpdir, monkeypatch):
+    data: dict = {'name': 'r1', 'type': 't', 'version': '1', 'verbose': False, 'workspace': '/', 'config': {}}
+    work_dir: Path = Path(str(tmpdir))
+    monkeypatch.setitem(docker.BUILTIN_RESOURCES, 'test-echo',
+                        ('deployster_test_echo', {'ECHO_CONFIG': '/root/.kube/echo.yaml'}))
+
+    with tempfile.TemporaryDirectory() as builtins_dir, tempfile.TemporaryDirectory() as kube_dir:
+        with open(os.path.join(builtins_dir, 'deployster_test_echo.py'), 'w') as f:
+            f.write(IN_PROCESS_MODULE)
+
+        delegate: MockDockerInvoker = MockDockerInvoker(return_code=0, stdout='{"delegated": true}', image_id='abc')
+        invoker: InProcessDockerInvoker = InProcessDockerInvoker(delegate=delegate, builtins_dir=Path(builtins_dir),
+                                                                 max_workers=1)
+        invoker.volumes = [f"{work_dir}:/work:rw", f"{kube_dir}:/root/.kube:ro"]
+        assert delegate.volumes == invoker.volumes
+
+        def invoke(image: str, args: Sequence[str] = None) -> dict:
+            return invoker.run_json(logger=Logger(), local_work_dir=work_dir, container_work_dir='/work',
+                                    image=image, args=args, input=data)
+
+        try:
+            # built-in images run in a pool process, with plugs & environment paths remapped to host paths
+            image: str = 'infolinks/deployster-test-echo:1.0.0'
+            assert invoker.inspect_image_id(image) is None
+            assert invoke(image)['plugs']['kube']['container_path'] == '/root/.kube'
+            state: dict = invoke(image, ['state'])['state']
+            assert state['pid'] != os.getpid()
+            assert state['plug'] == kube_dir
+            assert state['config'] == f"{kube_dir}/echo.yaml"
+            assert invoke(image, ['state'])['state']['pid'] == state['pid']
+            assert 'ECHO_CONFIG' not in os.environ and os.getcwd() != str(work_dir)
+
+            # failures are reported by exit code, and output of sub-processes is captured as well
+            exit_code, stdout, stderr = invoker._dispatch(local_work_dir=work_dir, container_work_dir='/work',
+                                                          image=image, args=['fail'], input=data)
+            assert exit_code == 1 and stdout == ''
+            assert 'Exception: failed!' in stderr and 'from a sub-process' in stderr
+            with pytest.raises(UserError, match='exit code #1'):
+                invoke(image, ['fail'])
+
+            # missing host tools & plug paths fail invocations before executing anything
+            monkeypatch.setitem(docker.BUILTIN_TOOLS, 'deployster_test_echo', ['deployster-missing-tool'])
+            with pytest.raises(UserError, match='deployster-missing-tool not found on this host'):
+                invoke(image)
+            monkeypatch.setitem(docker.BUILTIN_TOOLS, 'deployster_test_echo', [sys.executable])
+            invoker.volumes = [f"{work_dir}:/work:rw", '/deployster-missing/.kube:/root/.kube:ro']
+            with pytest.raises(UserError, match='/deployster-missing/.kube not found on this host'):
+                invoke(image)
+
+            # other images are delegated
+            assert invoker.inspect_image_id('infolinks/deployster-unknown:1') == 'abc'
+            assert invoke('infolinks/deployster-unknown:1') == {'delegated': True}
+            assert invoke('img', ['state']) == {'delegated': True}
+            assert delegate.invocations == 2
+        finally:
+            InProcessDockerInvoker.shutdown()
+
+
+IN_PROCESS_GCP_MODULE = """
+import os
+import external_services
+from dresources import DResource, resource_main
+from external_services import ExternalServices
+
+# clients are built with (& record) the credentials of the resource that first needed them
+external_services.build = lambda serviceName, version, cache: os.environ['GOOGLE_APPLICATION_CREDENTIALS']
+IMPORT_DISCOVERY_CACHE = os.environ.get('DEPLOYSTER_DISCOVERY_CACHE')
+
+class GcpResource(DResource):
+
+    def __init__(self, data: dict, svc: ExternalServices = ExternalServices()) -> None:
+        super().__init__(data=data, svc=svc)
+
+    def discover_state(self):
+        return {'pid': os.getpid(),
+                'client_credentials': self.svc._get_gcp_service('compute', 'v1'),
+                'gcloud_config': os.environ['CLOUDSDK_CONFIG'],
+                'import_discovery_cache': IMPORT_DISCOVERY_CACHE,
+                'discovery_cache': str(self.svc.discovery_cache.path.parent)}
+
+    def get_actions_for_missing_state(self):
+        return []
+
+    def get_actions_for_discovered_state(self, state: dict):
+        return []
+
+def main():
+    resource_main(GcpResource)
+"""
+
+
+def test_in_process_docker_invoker_isolates_credentials(tmpdir, monkeypatch):
+    monkeypatch.setitem(docker.BUILTIN_RESOURCES, 'test-gcp',
+                        ('deployster_test_gcp', {'GOOGLE_APPLICATION_CREDENTIALS': '/deployster/service-account.json'}))
+    monkeypatch.setitem(docker.BUILTIN_TOOLS, 'deployster_test_gcp', [])
+    root: Path = Path(str(tmpdir))
+    builtins_dir: Path = root / 'builtins'
+    os.makedirs(str(builtins_dir))
+    with open(str(builtins_dir / 'deployster_test_gcp.py'), 'w') as f:
+        f.write(IN_PROCESS_GCP_MODULE)
+
+    invoker: InProcessDockerInvoker = InProcessDockerInvoker(delegate=MockDockerInvoker(), builtins_dir=builtins_dir,
+                                                             max_workers=1,
+                                                             environment={'DEPLOYSTER_DISCOVERY_CACHE': str(root)})
+
+    def discover(name: str) -> dict:
+        credentials: Path = root / f"{name}.json"
+        credentials.touch()
+        work_dir: Path = root / name
+        os.makedirs(str(work_dir))
+        invoker.volumes = [f"{credentials}:/deployster/service-account.json:ro"]
+        data: dict = {'name': name, 'type': 't', 'version': '1', 'verbose': False, 'workspace': '/', 'config': {}}
+        return invoker.run_json(logger=Logger(), local_work_dir=work_dir, container_work_dir=str(work_dir),
+                                image='infolinks/deployster-test-gcp:1', args=['state'], input=data)['state']
+
+    try:
+        # resources plugged with different service accounts never share API clients or gcloud config, even when
+        # executed by the same pool process
+        r1: dict = discover('r1')
+        r2: dict = discover('r2')
+        assert r1['pid'] == r2['pid']
+        assert r1['client_credentials'] == str(root / 'r1.json')
+        assert r2['client_credentials'] == str(root / 'r2.json')
+        assert r1['gcloud_config'] == str(root / 'r1' / '.gcloud')
+        assert r2['gcloud_config'] == str(root / 'r2' / '.gcloud')
+
+        # the environment is applied before the module is imported
+        assert r1['import_discovery_cache'] == r1['discovery_cache'] == str(root)
+    finally:
+        InProcessDockerInvoker.shutdown()
+
+
+def test_docker_engine_invoker(tmpdir):
+    data: dict = {'k1': 'v1', 'k2': ['a', 'b']}
+    work_dir: Path = Path(str(tmpdir))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        socket_path: str = os.path.join(temp_dir, 'docker.sock')
+        with MockDockerEngine(socket_path=socket_path, images={'img:1': 'sha256:1'}) as engine:
+            invoker: DockerEngineInvoker = DockerEngineInvoker(volumes=['/a:/b:ro'], socket_path=socket_path)
+            assert invoker.ping()
+            assert invoker.inspect_image_id('img:1') == 'sha256:1'
+            assert invoker.inspect_image_id('img:2') is None
+
+            # stdin is streamed to the container, stdout & stderr are demultiplexed back
+            rc, stdout, stderr = invoker._invoke(local_work_dir=work_dir, container_work_dir='/w', image='img:1',
+                                                 entrypoint='/e', args=['a1'], input=data)
+            assert rc == 0
+            assert json.loads(stdout) == data
+            assert stderr == 'img:1\n'
+            assert engine.containers['c1'] == {
+                'Image': 'img:1', 'WorkingDir': '/w', 'Entrypoint': ['/e'], 'Cmd': ['a1'],
+                'AttachStdin': True, 'AttachStdout': True, 'AttachStderr': True,
+                'OpenStdin': True, 'StdinOnce': True, 'Tty': False, 'Labels': {},
+                'HostConfig': {'Binds': ['/a:/b:ro']}
+            }
+            assert engine.removed == ['c1']
+            assert invoker.run_json(logger=Logger(), local_work_dir=work_dir, container_work_dir='/w',
+                                    image='img:1', input=data) == data
+
+            # missing images are pulled
+            assert invoker.run_json(logger=Logger(), local_work_dir=work_dir, container_work_dir='/w',
+                                    image='img:2', input=data) == data
+            assert ('POST', '/images/create') in engine.requests
+
+            # control requests reuse keep-alive connections (one more connection per attach)
+            attaches: int = len([r for r in engine.requests if r[1].endswith('/attach')])
+            assert engine.connections <= attaches + 2
+
+
+def test_docker_engine_invoker_registry_auth(monkeypatch, tmpdir):
+    def decode(header: str) -> dict:
+        return json.loads(base64.urlsafe_b64decode(header.encode('ascii')).decode('utf-8'))
+
+    config_dir: Path = Path(str(tmpdir))
+    assert DockerEngineInvoker.registry_auth('img:1', config_dir=config_dir) is None
+
+    # credentials stored in the configuration, keyed by registry (with or without scheme)
+    with open(config_dir / 'config.json', 'w') as f:
+        f.write(json.dumps({'auths': {
+            'https://index.docker.io/v1/': {'auth': base64.b64encode(b'hub:secret1').decode('ascii')},
+            'https://registry.local:5000': {'auth': base64.b64encode(b'local:secret2').decode('ascii')}
+        }}))
+    assert decode(DockerEngineInvoker.registry_auth('org/img:1', config_dir=config_dir)) == {
+        'username': 'hub', 'password': 'secret1', 'serveraddress': 'https://index.docker.io/v1/'
+    }
+    assert decode(DockerEngineInvoker.registry_auth('registry.local:5000/img', config_dir=config_dir)) == {
+        'username': 'local', 'password': 'secret2', 'serveraddress': 'registry.local:5000'
+    }
+    assert DockerEngineInvoker.registry_auth('gcr.io/prj/img:1', config_dir=config_dir) is None
+
+    # credential helpers take precedence
+    helper: Path = config_dir / 'docker-credential-test'
+    with open(helper, 'w') as f:
+        f.write('#!/bin/sh\nread registry\necho "{\\"Username\\": \\"<token>\\", \\"Secret\\": \\"$registry\\"}"\n')
+    helper.chmod(0o755)
+    monkeypatch.setenv('PATH', f"{config_dir}{os.pathsep}{os.environ['PATH']}")
+    with open(config_dir / 'config.json', 'w') as f:
+        f.write(json.dumps({'credHelpers': {'gcr.io': 'test'}}))
+    assert decode(DockerEngineInvoker.registry_auth('gcr.io/prj/img:1', config_dir=config_dir)) == {
+        'identitytoken': 'gcr.io', 'serveraddress': 'gcr.io'
+    }
+
+    # pulls send the header to the engine
+    monkeypatch.setenv('DOCKER_CONFIG', str(config_dir))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        socket_path: str = os.path.join(temp_dir, 'docker.sock')
+        with MockDockerEngine(socket_path=socket_path) as engine:
+            invoker: DockerEngineInvoker = DockerEngineInvoker(socket_path=socket_path)
+            invoker.pull('gcr.io/prj/img:1')
+            invoker.pull('img:1')
+            assert decode(engine.registry_auths[0])['identitytoken'] == 'gcr.io'
+            assert engine.registry_auths[1] is None
+
+
+def test_docker_engine_invoker_removes_containers(tmpdir):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        socket_path: str = os.path.join(temp_dir, 'docker.sock')
+        with MockDockerEngine(socket_path=socket_path, images={'img:1': 'sha256:1'}) as engine:
+            work_dir: Path = Path(str(tmpdir))
+            for run_id in ['run1', 'run2']:
+                invoker: DockerEngineInvoker = DockerEngineInvoker(labels={RUN_LABEL: run_id, RESOURCE_LABEL: 'r1'},
+                                                                   socket_path=socket_path)
+                invoker.run(logger=Logger(), local_work_dir=work_dir, container_work_dir='/', image='img:1')
+            assert engine.containers['c1']['Labels'] == {RUN_LABEL: 'run1', RESOURCE_LABEL: 'r1'}
+            assert engine.removed == ['c1', 'c2']
+
+            # simulate leftovers of crashed runs
+            engine.removed.clear()
+            engine.containers['c2']['State'] = 'running'
+            engine.containers['c3'] = {'Labels': {}, 'State': 'exited'}
+            invoker: DockerEngineInvoker = DockerEngineInvoker(socket_path=socket_path)
+            assert invoker.prune_containers(run_id='run2') == []
+            assert invoker.prune_containers() == ['c1']
+            assert invoker.prune_containers(include_running=True) == ['c2']
+            assert engine.removed == ['c1', 'c2']
+
+
+def test_docker_invoker_command():
+    invoker: DockerInvoker = DockerInvoker(volumes=['/a:/b:ro'], labels={RUN_LABEL: 'run1'})
+    assert invoker._command(container_work_dir='/w', image='img:1', entrypoint='/e', args=['a1']) == [
+        'docker', 'run', '-i', '--rm', '--workdir=/w', '--label', f"{RUN_LABEL}=run1", '--volume', '/a:/b:ro',
+        '--entrypoint', '/e', 'img:1', 'a1'
+    ]
+
+
+def test_create_docker_invoker():
+    context: Context = Context()
+    assert type(create_docker_invoker(context=context)) == DockerInvoker
+    assert create_docker_invoker(context=context, labels={RESOURCE_LABEL: 'r1'}).labels == {
+        RUN_LABEL: context.run_id, RESOURCE_LABEL: 'r1'
+    }
+    assert Context().run_id != context.run_id
+    context.docker_backend = 'api'
+    assert isinstance(create_docker_invoker(context=context), DockerEngineInvoker)
+    context.in_process = True
+    assert isinstance(create_docker_invoker(context=context).delegate, DockerEngineInvoker)
+    context: Context = Context(env=dict(os.environ, BUILTINS_DIR='/deployster-missing'))
+    context.in_process = True
+    with pytest.raises(UserError, match="'--in-process' requires the built-in resources' sources"):
+        create_docker_invoker(context=context)
+    with pytest.raises(UserError, match="unknown Docker backend"):
+        context.docker_backend = 'ssh'
@@ -0,0 +1,425 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Mapping, MutableSequence, Tuple, Sequence, Union, Any
+
+import pytest
+import yaml
+from colors import strip_color
+
+from context import Context, ConfirmationMode
+from executor import Executor
+from manifest import Manifest, Resource, ResourceStatus
+from mock_external_services import MockDockerInvoker
+from timing import Timings, Span
+from util import UserError, Logger
+
+STATE_LATENCY = 0.3
+
+
+class TimedResource(Resource):
+    timeline: MutableSequence[Tuple[str, str, float]] = []
+    timeline_lock = threading.Lock()
+
+    def __init__(self,
+                 manifest: 'Manifest',
+                 name: str,
+                 type: str,
+                 readonly: bool,
+                 config: dict = None,
+                 dependencies: Mapping[str, 'Resource'] = None) -> None:
+        super().__init__(manifest, name, type, readonly, config, dependencies)
+
+    def initialize(self) -> None:
+        self._docker_invoker = MockDockerInvoker(return_code=0, stdout=json.dumps({'state_action': {'args': ['s']}}))
+        super().initialize()
+        state: dict = {'status': 'FAILED'} if self.name.startswith('bad') else {'status': 'VALID', 'state': {}}
+        self._docker_invoker = MockDockerInvoker(return_code=0, stdout=json.dumps(state), latency=STATE_LATENCY)
+
+    def execute(self) -> None:
+        assert all(dep.status == ResourceStatus.VALID for dep in self.dependencies.values())
+        with TimedResource.timeline_lock:
+            TimedResource.timeline.append((self.name, 'start', time.time()))
+        super().execute()
+        with TimedResource.timeline_lock:
+            TimedResource.timeline.append((self.name, 'end', time.time()))
+
+
+class SlowInitResource(Resource):
+
+    def __init__(self,
+                 manifest: 'Manifest',
+                 name: str,
+                 type: str,
+                 readonly: bool,
+                 config: dict = None,
+                 dependencies: Mapping[str, 'Resource'] = None) -> None:
+        super().__init__(manifest, name, type, readonly, config, dependencies)
+
+    def initialize(self) -> None:
+        # resources named "bad*" fail fast, the rest take a while to initialize
+        if self.name.startswith('bad'):
+            self._docker_invoker = MockDockerInvoker(return_code=1, latency=0.05)
+        else:
+            init_result: str = json.dumps({'state_action': {'args': ['s']}})
+            self._docker_invoker = MockDockerInvoker(return_code=0, stdout=init_result, latency=STATE_LATENCY)
+        super().initialize()
+
+
+class PullingDockerInvoker(MockDockerInvoker):
+
+    def __init__(self, local_images: Sequence[str], latency: float) -> None:
+        super().__init__(latency=latency)
+        self.local_images: Sequence[str] = local_images
+        self.pulls: MutableSequence[str] = []
+
+    def inspect_image_id(self, image: str) -> Union[None, str]:
+        return f"sha256:{image}" if image in self.local_images else None
+
+    def pull(self, image: str) -> None:
+        time.sleep(self._mock_latency)
+        if image.startswith('bad'):
+            raise UserError(f"failed pulling image '{image}'")
+        self.pulls.append(image)
+
+
+class CombiningDockerInvoker(MockDockerInvoker):
+    """Answers "init" & "state" invocations; images named "combined:*" support the combined init+state protocol."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.calls: MutableSequence[Tuple[str, str, dict]] = []
+        self.volumes_by_call: MutableSequence[Sequence[str]] = []
+
+    def _invoke(self, local_work_dir: Path, container_work_dir: str, image: str, entrypoint: str = None,
+                args: Sequence[str] = None, input: dict = None, stderr_logger: Logger = None,
+                stdout_logger: Logger = None) -> Tuple[int, str, str]:
+        action: str = args[0] if args else 'init'
+        self.calls.append((input['name'], action, input))
+        self.volumes_by_call.append(list(self.volumes or []))
+        state_result: dict = {'status': 'VALID', 'state': {'value': input['config']['value']}} \
+            if 'config' in input else None
+        if action == 'state':
+            return 0, json.dumps(state_result), ''
+        elif image.startswith('combined-plugged:'):
+            # requires the "p" plug, so it can only provide its state if that plug was mounted
+            result: dict = {'state_action': {'args': ['state']},
+                            'plugs': {'p': {'container_path': '/p', 'optional': False, 'writable': False}}}
+            if input.get('combined_state') and 'p' in input.get('plugs', {}):
+                result['state_result'] = state_result
+            return 0, json.dumps(result), ''
+        elif image.startswith('combined:') and input.get('combined_state'):
+            return 0, json.dumps({'state_action': {'args': ['state']}, 'state_result': state_result}), ''
+        else:
+            return 0, json.dumps({'state_action': {'args': ['state']}}), ''
+
+
+class BatchingDockerInvoker(MockDockerInvoker):
+    """Answers "init" & "state" invocations; images named "batch:*" support the batch state protocol."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.calls: MutableSequence[Tuple[str, Any]] = []
+
+    def _invoke(self, local_work_dir: Path, container_work_dir: str, image: str, entrypoint: str = None,
+                args: Sequence[str] = None, input: Any = None, stderr_logger: Logger = None,
+                stdout_logger: Logger = None) -> Tuple[int, str, str]:
+        action: str = args[0] if args else 'init'
+        if action == 'batch_state':
+            self.calls.append((action, [i['name'] for i in input]))
+            return 0, json.dumps([{'status': 'VALID', 'state': {'value': i['config']['value']}} for i in input]), ''
+        self.calls.append((action, input['name']))
+        if action == 'state':
+            return 0, json.dumps({'status': 'VALID', 'state': {'value': input['config']['value']}}), ''
+        elif image.startswith('batch:'):
+            result: dict = {'state_action': {'args': ['state']}, 'batch_state_action': {'args': ['batch_state']}}
+            return 0, json.dumps(result), ''
+        else:
+            return 0, json.dumps({'state_action': {'args': ['state']}}), ''
+
+
+class ApplyingDockerInvoker(MockDockerInvoker):
+    """Answers "init" & "state" invocations of a STALE resource, whose "fix" action makes it VALID (and emits the given
+    output, if asked to emit the resource's new state)."""
+
+    def __init__(self, emitted: str) -> None:
+        super().__init__()
+        self.calls: MutableSequence[Tuple[str, dict]] = []
+        self._emitted: str = emitted
+        self._fixed: bool = False
+
+    def _invoke(self, local_work_dir: Path, container_work_dir: str, image: str, entrypoint: str = None,
+                args: Sequence[str] = None, input: dict = None, stderr_logger: Logger = None,
+                stdout_logger: Logger = None) -> Tuple[int, str, str]:
+        action: str = args[0] if args else 'init'
+        self.calls.append((action, input))
+        if action == 'init':
+            return 0, json.dumps({'state_action': {'args': ['state']}}), ''
+        elif action == 'state':
+            result: dict = {'status': 'VALID', 'state': {'fixed': True}} if self._fixed \
+                else {'status': 'STALE', 'actions': [{'name': 'prepare', 'args': ['prepare']},
+                                                      {'name': 'fix', 'args': ['fix']}]}
+            return 0, json.dumps(result), ''
+        elif action == 'fix':
+            self._fixed = True
+            return 0, 'fixing...\n' + (self._emitted if input['emit_state'] else ''), ''
+        else:
+            return 0, 'preparing...\n', ''
+
+
+def create_manifest(name: str, resources: dict, parallelism: int, resource_factory=TimedResource,
+                    initialize: bool = True, plugs: dict = None) -> Manifest:
+    scenario_dir: Path = Path('./tests/.cache/executor') / name
+    os.makedirs(str(scenario_dir), exist_ok=True)
+    manifest_file: Path = scenario_dir / 'manifest.yaml'
+    with manifest_file.open('w') as f:
+        f.write(yaml.dump({'plugs': plugs, 'resources': resources} if plugs else {'resources': resources}))
+
+    context: Context = Context(version_file_path='./tests/test_version', env={
+        "CONF_DIR": str(scenario_dir / 'conf'),
+        "WORKSPACE_DIR": str(scenario_dir / 'workspace'),
+        "WORK_DIR": str(scenario_dir / 'work')
+    })
+    context.confirm = ConfirmationMode.NO
+    context.parallelism = parallelism
+    manifest: Manifest = Manifest(context=context, manifest_files=[manifest_file], resource_factory=resource_factory)
+    if initialize:
+        for resource in manifest.resources.values():
+            resource.initialize()
+    TimedResource.timeline.clear()
+    return manifest
+
+
+def event_time(name: str, event: str) -> float:
+    return [t for n, e, t in TimedResource.timeline if n == name and e == event][0]
+
+
+def test_parallelism_validation():
+    with pytest.raises(UserError, match='parallelism must be at least 1'):
+        Context().parallelism = 0
+
+
+def test_execute_serially():
+    manifest: Manifest = create_manifest('serial', {
+        'r1': {'type': 'r:1'},
+        'r2': {'type': 'r:1'},
+        'r3': {'type': 'r:1'},
+    }, parallelism=1)
+    start: float = time.time()
+    Executor(manifest=manifest).execute()
+    assert time.time() - start >= 3 * STATE_LATENCY
+    assert [n for n, e, t in TimedResource.timeline if e == 'start'] == ['r1', 'r2', 'r3']
+    assert all(r.status == ResourceStatus.VALID for r in manifest.resources.values())
+
+
+def test_execute_independent_resources_concurrently():
+    manifest: Manifest = create_manifest('independent', {
+        'r1': {'type': 'r:1'},
+        'r2': {'type': 'r:1'},
+        'r3': {'type': 'r:1'},
+    }, parallelism=3)
+    start: float = time.time()
+    Executor(manifest=manifest).execute()
+    assert time.time() - start < 2 * STATE_LATENCY
+    assert all(r.status == ResourceStatus.VALID for r in manifest.resources.values())
+
+
+def test_execute_respects_dependencies():
+    # r1 & r2 are independent; r3 depends on both; r4 depends on r3 only
+    manifest: Manifest = create_manifest('dependencies', {
+        'r1': {'type': 'r:1'},
+        'r2': {'type': 'r:1'},
+        'r3': {'type': 'r:1', 'dependencies': {'a': 'r1', 'b': 'r2'}},
+        'r4': {'type': 'r:1', 'dependencies': {'c': 'r3'}},
+    }, parallelism=4)
+    start: float = time.time()
+    Executor(manifest=manifest).execute()
+    assert time.time() - start < 4 * STATE_LATENCY
+    assert event_time('r3', 'start') >= max(event_time('r1', 'start'), event_time('r2', 'start')) + STATE_LATENCY
+    assert event_time('r4', 'start') >= event_time('r3', 'start') + STATE_LATENCY
+    assert all(r.status == ResourceStatus.VALID for r in manifest.resources.values())
+
+
+def test_execute_stops_scheduling_on_failure():
+    manifest: Manifest = create_manifest('failure', {
+        'bad': {'type': 'r:1'},
+        'r2': {'type': 'r:1'},
+        'r3': {'type': 'r:1', 'dependencies': {'a': 'bad'}},
+    }, parallelism=2)
+    with pytest.raises(UserError, match="state result failed validation"):
+        Executor(manifest=manifest).execute()
+    assert manifest.resource('r2').status == ResourceStatus.VALID
+    assert manifest.resource('r3').status == ResourceStatus.INITIALIZED
+
+
+def test_initialize_concurrently(capsys):
+    manifest: Manifest = create_manifest('init', {
+        'r1': {'type': 'r:1'},
+        'r2': {'type': 'r:1'},
+        'r3': {'type': 'r:1'},
+    }, parallelism=3, resource_factory=SlowInitResource, initialize=False)
+    start: float = time.time()
+    Executor(manifest=manifest)._initialize_resources(logger=Logger())
+    assert time.time() - start < 2 * STATE_LATENCY
+    assert all(r.status == ResourceStatus.INITIALIZED for r in manifest.resources.values())
+
+    # output is reported in manifest order, regardless of completion order
+    output: str = strip_color(capsys.readouterr().out)
+    assert 0 <= output.find("'r1'") < output.find("'r2'") < output.find("'r3'")
+
+
+def test_initialize_failure_cancels_pending(capsys):
+    manifest: Manifest = create_manifest('init_failure', {
+        'bad1': {'type': 'r:1'},
+        'r2': {'type': 'r:1'},
+        'r3': {'type': 'r:1'},
+        'r4': {'type': 'r:1'},
+    }, parallelism=2, resource_factory=SlowInitResource, initialize=False)
+    with pytest.raises(UserError, match='Docker command terminated with exit code #1'):
+        Executor(manifest=manifest)._initialize_resources(logger=Logger())
+    assert manifest.resource('bad1').status is None
+    assert manifest.resource('r2').status == ResourceStatus.INITIALIZED
+    assert manifest.resource('r4').status is None
+    assert capsys.readouterr().out.find("Initialization of 'r4' cancelled") >= 0
+
+
+def test_pull_images_concurrently(capsys):
+    manifest: Manifest = create_manifest('pull', {'r1': {'type': 'r:1'}}, parallelism=1, initialize=False)
+    manifest.context.pull_parallelism = 3
+    invoker: PullingDockerInvoker = PullingDockerInvoker(local_images=['local:1'], latency=STATE_LATENCY)
+    executor: Executor = Executor(manifest=manifest, docker_invoker=invoker)
+
+    # duplicates are pulled once, local images are not pulled at all
+    start: float = time.time()
+    executor._pull_images(Logger(), ['a:1', 'b:1', 'a:1', 'local:1', 'c:1', 'b:1'])
+    assert time.time() - start < 2 * STATE_LATENCY
+    assert sorted(invoker.pulls) == ['a:1', 'b:1', 'c:1']
+    assert strip_color(capsys.readouterr().out).find('[3/3] Pulled') >= 0
+
+    with pytest.raises(UserError, match="failed pulling 1 image\\(s\\): bad:1"):
+        executor._pull_images(Logger(), ['bad:1', 'd:1'])
+    assert 'd:1' in invoker.pulls
+
+
+def test_execute_records_timings():
+    Timings.reset()
+    manifest: Manifest = create_manifest('timings', {
+        'r1': {'type': 'r:1'},
+        'r2': {'type': 'r:1', 'dependencies': {'a': 'r1'}},
+    }, parallelism=2)
+    Executor(manifest=manifest).execute()
+    spans: Sequence[Span] = Timings.spans()
+    assert [span.resource for span in spans if span.name == 'state'] == ['r1', 'r2']
+    assert [span.parent.name for span in spans if span.name == 'invocation' and span.resource == 'r2'] == \
+           ['init', 'state']
+    assert {'init', 'post_process', 'validate config', 'validate state', 'execute'} <= {span.name for span in spans}
+
+
+def test_lazy_init_combines_init_and_state():
+    invoker: CombiningDockerInvoker = CombiningDockerInvoker()
+    manifest: Manifest = create_manifest('lazy_init', {
+        'r1': {'type': 'combined:1', 'config': {'value': 'v1'}},
+        'r2': {'type': 'combined:1', 'dependencies': {'a': 'r1'}, 'config': {'value': '{{ a.state.value }}-v2'}},
+        'r3': {'type': 'plain:1', 'dependencies': {'a': 'r2'}, 'config': {'value': '{{ a.state.value }}-v3'}},
+    }, parallelism=1, resource_factory=lambda **kwargs: Resource(docker_invoker=invoker, **kwargs), initialize=False)
+    manifest.context.lazy_init = True
+    manifest.context.init_cache = False
+
+    executor: Executor = Executor(manifest=manifest, docker_invoker=invoker)
+    executor._initialize_resources(logger=Logger())
+    assert invoker.calls == []
+    assert all(r.status == ResourceStatus.INITIALIZED for r in manifest.resources.values())
+
+    # supporting resources are initialized with their resolved config, and provide their state at the same time
+    executor.execute()
+    assert [(name, action) for name, action, input in invoker.calls] == \
+           [('r1', 'init'), ('r2', 'init'), ('r3', 'init'), ('r3', 'state')]
+    assert invoker.calls[1][2]['config'] == {'value': 'v1-v2'}
+    assert manifest.resource('r3').state == {'value': 'v1-v2-v3'}
+    assert all(r.status == ResourceStatus.VALID for r in manifest.resources.values())
+
+
+def test_lazy_init_mounts_allowed_plugs(tmpdir):
+    plug_dir: Path = Path(str(tmpdir))
+    invoker: CombiningDockerInvoker = CombiningDockerInvoker()
+    manifest: Manifest = create_manifest('lazy_init_plugs', {
+        'r1': {'type': 'combined-plugged:1', 'config': {'value': 'v1'}},
+        'r2': {'type': 'combined-plugged:1', 'config': {'value': 'v2'}},
+    }, parallelism=1, resource_factory=lambda **kwargs: Resource(docker_invoker=invoker, **kwargs), initialize=False,
+        plugs={
+            'p': {'path': str(plug_dir), 'read_only': True, 'resource_names': ['r1', 'r2']},
+            'only_r1': {'path': str(plug_dir), 'resource_names': ['r1']},
+            'missing': {'path': str(plug_dir / 'missing'), 'resource_names': ['r1']},
+        })
+    manifest.context.lazy_init = True
+    manifest.context.init_cache = False
+    executor: Executor = Executor(manifest=manifest, docker_invoker=invoker)
+    executor._initialize_resources(logger=Logger())
+    executor.execute()
+
+    # allowed (& existing) plugs are mounted by name, so plugged resources can provide their state when initialized
+    assert [(name, action) for name, action, input in invoker.calls] == [('r1', 'init'), ('r2', 'init')]
+    assert invoker.calls[0][2]['plugs'] == {'p': '/deployster/plugs/p', 'only_r1': '/deployster/plugs/only_r1'}
+    assert invoker.calls[1][2]['plugs'] == {'p': '/deployster/plugs/p'}
+    assert f"{plug_dir}:/deployster/plugs/p:ro" in invoker.volumes_by_call[1]
+    assert manifest.resource('r2').state == {'value': 'v2'}
+    assert all(r.status == ResourceStatus.VALID for r in manifest.resources.values())
+
+
+def test_batch_state_of_ready_resources():
+    invoker: BatchingDockerInvoker = BatchingDockerInvoker()
+    manifest: Manifest = create_manifest('batch_state', {
+        'b1': {'type': 'batch:1', 'config': {'value': 'v1'}},
+        'b2': {'type': 'batch:1', 'config': {'value': 'v2'}},
+        'b3': {'type': 'batch:1', 'config': {'value': 'v3'}},
+        'b4': {'type': 'batch:1', 'dependencies': {'a': 'b1'}, 'config': {'value': '{{ a.state.value }}-v4'}},
+        'p1': {'type': 'plain:1', 'config': {'value': 'p1'}},
+    }, parallelism=2, resource_factory=lambda **kwargs: Resource(docker_invoker=invoker, **kwargs))
+    invoker.calls.clear()
+
+    # same-image resources that are ready together share a single invocation; others are resolved as usual
+    Executor(manifest=manifest, docker_invoker=invoker).execute()
+    assert sorted(invoker.calls, key=str) == [('batch_state', ['b1', 'b2', 'b3']), ('state', 'b4'), ('state', 'p1')]
+    assert manifest.resource('b2').state == {'value': 'v2'}
+    assert manifest.resource('b4').state == {'value': 'v1-v4'}
+    assert all(r.status == ResourceStatus.VALID for r in manifest.resources.values())
+
+
+def test_batch_state_result_validation():
+    invoker: MockDockerInvoker = MockDockerInvoker(return_code=0, stdout=json.dumps([{'status': 'VALID', 'state': {}}]))
+    manifest: Manifest = create_manifest('batch_state_validation', {
+        'b1': {'type': 'batch:1'},
+        'b2': {'type': 'batch:1'},
+    }, parallelism=1, resource_factory=lambda **kwargs: Resource(docker_invoker=invoker, **kwargs), initialize=False)
+    for resource in manifest.resources.values():
+        resource._load_init_result(Logger(), {'state_action': {'args': ['state']},
+                                              'batch_state_action': {'args': ['batch_state']}})
+        resource._status = ResourceStatus.INITIALIZED
+    assert manifest.resource('b1').batch_key == manifest.resource('b2').batch_key
+    with pytest.raises(UserError, match='must be an array of 2 state results'):
+        Resource.resolve_batch_state(list(manifest.resources.values()))
+
+
+@pytest.mark.parametrize("emitted,strict_verify,verified", [
+    ('{"status":"VALID","state":{"fixed":true}}', False, False),
+    ('{"status":"VALID","state":{"fixed":true}}', True, True),
+    ('{"status":"STALE","state":{"fixed":true}}', False, True),
+    ('{"status":"VALID"', False, True),
+    ('', False, True),
+])
+def test_apply_actions_emit_state(emitted: str, strict_verify: bool, verified: bool):
+    invoker: ApplyingDockerInvoker = ApplyingDockerInvoker(emitted=emitted)
+    manifest: Manifest = create_manifest('emit_state', {'r1': {'type': 'r:1', 'config': {}}}, parallelism=1,
+                                         resource_factory=lambda **kwargs: Resource(docker_invoker=invoker, **kwargs))
+    manifest.context.strict_verify = strict_verify
+    Executor(manifest=manifest, docker_invoker=invoker).execute()
+
+    # only the last action is asked to emit the new state (unless verification is strict), which is then used instead
+    # of invoking the "state" action again (if it's a valid VALID state result)
+    actions: Sequence[Tuple[str, dict]] = [(a, i) for a, i in invoker.calls if a in ['prepare', 'fix']]
+    assert [(a, i['emit_state']) for a, i in actions] == [('prepare', False), ('fix', not strict_verify)]
+    assert [a for a, i in invoker.calls].count('state') == (2 if verified else 1)
+    assert manifest.resource('r1').status == ResourceStatus.VALID
+    assert manifest.resource('r1').state == {'fixed': True}
@@ -105,7 +105,8 @@ def find_scenarios() -> Sequence[Tuple[str, Path, dict, Sequence[Path]]]:
                     scenario_dir.name,
                     scenario_dir,
                     scenario,
-                    [scenario_dir / file for file in scenario_dir.iterdir() if file.name != 'scenario.yaml']
+                    [scenario_dir / file for file in scenario_dir.iterdir()
+                     if file.is_file() and file.name != 'scenario.yaml']
                 ))
     return scenarios
 
@@ -113,7 +114,7 @@ def find_scenarios() -> Sequence[Tuple[str, Path, dict, Sequence[Path]]]:
 @pytest.mark.parametrize("description,dir,scenario,manifest_files", find_scenarios())
 def test_manifest(capsys, description: str, dir: Path, scenario: dict, manifest_files: Sequence[Path]):
     context: Context = Context(version_file_path='./tests/test_version', env={
-        "CONF_DIR": str(dir.absolute() / 'conf'),
+        "CONF_DIR": str(Path('./tests/.cache/manifest_scenarios').absolute() / description / 'conf'),
         "WORKSPACE_DIR": str(dir.absolute()),
         "WORK_DIR": str(Path('./tests/.cache/manifest_scenarios') / description)
     })
@@ -312,3 +313,64 @@ def test_resource_initialize(capsys):
         f"{str((scenario_dir / 'p2').absolute())}:{init_result['plugs']['readonly_plug']['container_path']}:ro",
         f"{str((scenario_dir / 'p1').absolute())}:{init_result['plugs']['writable_plug']['container_path']}:rw"
     ]
+
+
+def test_manifest_levels():
+    scenario_dir: Path = Path('./tests/.cache/manifest_scenarios/test_manifest_levels')
+    os.makedirs(str(scenario_dir), exist_ok=True)
+
+    def create_manifest(resources: dict) -> Manifest:
+        manifest_file: Path = scenario_dir / 'manifest.yaml'
+        with manifest_file.open('w') as f:
+            f.write(yaml.dump({'resources': resources}))
+        context: Context = Context(version_file_path='./tests/test_version', env={
+            "CONF_DIR": str(scenario_dir / 'conf'),
+            "WORKSPACE_DIR": str(scenario_dir / 'workspace'),
+            "WORK_DIR": str(scenario_dir / 'work')
+        })
+        return Manifest(context=context, manifest_files=[manifest_file], resource_factory=MockResource)
+
+    # levels retain manifest order, and dependencies always precede their dependents (resources stay in manifest order)
+    manifest: Manifest = create_manifest({
+        'r1': {'type': 'r', 'dependencies': {'a': 'r3', 'b': 'r2'}},
+        'r2': {'type': 'r', 'dependencies': {'a': 'r4'}},
+        'r3': {'type': 'r'},
+        'r4': {'type': 'r'},
+        'r5': {'type': 'r', 'dependencies': {'a': 'r3', 'b': 'r3'}},
+    })
+    assert [[r.name for r in level] for level in manifest.levels] == [['r3', 'r4'], ['r2', 'r5'], ['r1']]
+    assert list(manifest.resources.keys()) == ['r1', 'r2', 'r3', 'r4', 'r5']
+    assert manifest.resource('r1').dependencies == {'a': manifest.resource('r3'), 'b': manifest.resource('r2')}
+
+    # long dependency chains do not hit recursion limits
+    count: int = 3000
+    manifest: Manifest = create_manifest({
+        f"r{i}": {'type': 'r', 'dependencies': {'prev': f"r{i - 1}"}} if i else {'type': 'r'} for i in range(count)
+    })
+    assert len(manifest.levels) == count
+    with pytest.raises(UserError, match=r'Dependency cycles: \[r0, r1, r10, r100, r1000, (r\d+, ){5}\.\.\.\]$'):
+        create_manifest({
+            f"r{i}": {'type': 'r', 'dependencies': {'prev': f"r{(i - 1) % count}"}} for i in range(count)
+        })
+
+
+def test_resource_execute_detects_circular_dependency():
+    scenario_dir: Path = Path('./tests/.cache/manifest_scenarios/test_resource_circular')
+    os.makedirs(str(scenario_dir), exist_ok=True)
+    manifest_file: Path = scenario_dir / 'manifest.yaml'
+    with manifest_file.open('w') as f:
+        f.write(yaml.dump({'resources': {'r1': {'type': 'r'}, 'r2': {'type': 'r', 'dependencies': {'a': 'r1'}}}}))
+    context: Context = Context(version_file_path='./tests/test_version', env={
+        "CONF_DIR": str(scenario_dir / 'conf'),
+        "WORKSPACE_DIR": str(scenario_dir / 'workspace'),
+        "WORK_DIR": str(scenario_dir / 'work')
+    })
+    manifest: Manifest = Manifest(context=context, manifest_files=[manifest_file], resource_factory=MockResource)
+
+    # resources are marked as resolving before their dependencies are resolved, so loops fail fast
+    r1: Resource = manifest.resource('r1')
+    r2: Resource = manifest.resource('r2')
+    r1._status = r2._status = ResourceStatus.INITIALIZED
+    r1._dependencies = {'b': r2}
+    with pytest.raises(UserError, match='circular resource dependency encountered'):
+        r2.execute()
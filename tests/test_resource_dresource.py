@@ -1,4 +1,5 @@
 import json
+import os
 from copy import deepcopy
 from pathlib import Path
 from typing import Sequence
@@ -6,7 +7,7 @@ from typing import Sequence
 import pytest
 from _pytest.capture import CaptureResult
 
-from dresources import DResource, DAction, DPlug
+from dresources import DResource, DAction, DPlug, action
 from mock_external_services import MockExternalServices
 
 
@@ -222,6 +223,59 @@ def test_init_action(capsys, plug_name: str, plug_container_path: str, plug_opti
     }
 
 
+@pytest.mark.parametrize("combined_state,plugs,mounted_plugs,expected", [
+    (False, False, None, None),
+    (True, False, None, {'status': 'VALID', 'state': {'k': 'v'}}),
+    (True, True, None, None),
+    (True, True, {'other': '/deployster/plugs/other'}, None),
+    (True, True, {'test': '/deployster/plugs/test'}, {'status': 'VALID', 'state': {'k': 'v'}})
+])
+def test_init_action_with_state(capsys, monkeypatch, combined_state: bool, plugs: bool, mounted_plugs: dict,
+                                expected: dict):
+    monkeypatch.setenv('TEST_CREDENTIALS', '/my/credentials.json')
+    monkeypatch.delenv('DEPLOYSTER_PATH_MAPPINGS', raising=False)
+
+    class TestResource(DResource):
+
+        def __init__(self) -> None:
+            data: dict = {
+                'name': 'test',
+                'type': 'test-resource',
+                'version': '1.2.3',
+                'verbose': True,
+                'workspace': '/workspace',
+                'config': {'k': 'v'},
+                'combined_state': combined_state
+            }
+            if mounted_plugs is not None:
+                data['plugs'] = mounted_plugs
+            super().__init__(data=data, svc=MockExternalServices())
+            if plugs:
+                self.add_plug(name='test', container_path='/my', optional=False, writable=False)
+                self.add_plug(name='optional', container_path='/opt', optional=True, writable=False)
+
+        def discover_state(self):
+            if plugs:
+                # plugs (& environment variables pointing into them) are found where they were mounted
+                assert self.get_plug('test').path == '/deployster/plugs/test'
+                assert self.get_plug('optional').path == '/opt'
+                assert os.environ['TEST_CREDENTIALS'] == '/deployster/plugs/test/credentials.json'
+            return self.info.config
+
+        def get_actions_for_missing_state(self) -> Sequence[DAction]:
+            pass
+
+        def get_actions_for_discovered_state(self, state: dict) -> Sequence[DAction]:
+            return []
+
+    resource: TestResource = TestResource()
+    resource.execute(['init'])
+
+    result: dict = json.loads(capsys.readouterr().out)
+    assert result['state_action'] == {'args': ['state']}
+    assert result.get('state_result') == expected
+
+
 @pytest.mark.parametrize("state,missing_state_actions,existing_state_actions,expected", [
     (None,
      [
@@ -294,3 +348,53 @@ def test_state_action(capsys,
 
     captured: CaptureResult = capsys.readouterr()
     assert json.loads(captured.out) == expected
+
+
+@pytest.mark.parametrize("emit_state,post_apply_state,expected", [
+    (False, {'k': 'v'}, None),
+    (True, None, None),
+    (True, {'k': 'v'}, {'status': 'VALID', 'state': {'k': 'v'}}),
+    (True, Exception('failed!'), None),
+])
+def test_apply_action_emit_state(capsys, emit_state: bool, post_apply_state, expected):
+    class TestResource(DResource):
+
+        def __init__(self) -> None:
+            super().__init__(data={
+                'name': 'test',
+                'type': 'test-resource',
+                'version': '1.2.3',
+                'verbose': True,
+                'workspace': '/workspace',
+                'config': {},
+                'staleState': {},
+                'emit_state': emit_state
+            }, svc=MockExternalServices())
+
+        def discover_state(self):
+            raise Exception('full discovery is not expected')
+
+        def get_actions_for_missing_state(self) -> Sequence[DAction]:
+            return []
+
+        def get_actions_for_discovered_state(self, state: dict) -> Sequence[DAction]:
+            return []
+
+        def post_apply_state(self):
+            if isinstance(post_apply_state, Exception):
+                raise post_apply_state
+            return post_apply_state
+
+        @action
+        def fix(self, args) -> None:
+            print('fixed!')
+
+    TestResource().execute(['fix'])
+
+    # the new state (if known & requested) is printed as the last line; failing to provide it does not fail the action
+    captured: CaptureResult = capsys.readouterr()
+    lines: Sequence[str] = captured.out.splitlines()
+    assert lines[0] == 'fixed!'
+    assert (json.loads(lines[1]) if len(lines) > 1 else None) == expected
+    assert len(lines) == 1 or lines[1] == json.dumps(expected, separators=(',', ':'))
+    assert ('deferring' in captured.err) == isinstance(post_apply_state, Exception)
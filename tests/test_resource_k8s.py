@@ -4,6 +4,7 @@ import time
 import jsonschema
 import pytest
 
+from dresources import batch_state
 from external_services import ExternalServices
 from k8s import K8sResource
 from manifest import Resource
@@ -72,3 +73,35 @@ def test_k8s_resource_check_availability(capsys, timeout_ms, timeout_interval_ms
                 resource.check_availability()
         else:
             resource.check_availability()
+
+
+def test_k8s_resource_batch_state(capsys):
+    class CountingExternalServices(MockExternalServices):
+
+        def __init__(self, k8s_objects: dict) -> None:
+            super().__init__(k8s_objects=k8s_objects)
+            self.batches: int = 0
+
+        def find_k8s_objects(self, manifests):
+            self.batches += 1
+            return super().find_k8s_objects(manifests)
+
+        def find_k8s_namespace_object(self, manifest: dict):
+            if self.batches == 0:
+                raise Exception('objects must be found in batch')
+            return super().find_k8s_namespace_object(manifest)
+
+    def data(name: str) -> dict:
+        manifest: dict = {"apiVersion": "v1", "kind": "ConfigMap", "metadata": {"name": name, "namespace": "ns"}}
+        return {'name': name, 'type': 'k8s', 'version': '1', 'verbose': False, 'workspace': '/',
+                'config': {"manifest": manifest}}
+
+    existing: dict = data('cm1')['config']['manifest']
+    svc: CountingExternalServices = CountingExternalServices(k8s_objects={'v1-ConfigMap-ns-cm1': existing})
+
+    # all resources are discovered using a single lookup, and results are printed in order
+    batch_state(lambda d: K8sResource(data=d, svc=svc), [data('cm1'), data('cm2')])
+    results = json.loads(capsys.readouterr().out)
+    assert svc.batches == 1
+    assert results[0] == {'status': 'VALID', 'state': existing}
+    assert results[1]['status'] == 'STALE' and [a['name'] for a in results[1]['actions']] == ['create']
@@ -2,16 +2,21 @@ import importlib
 import json
 import os
 import re
+import socket
 from copy import deepcopy
-from typing import Sequence, Tuple, MutableSequence, Callable
+from pathlib import Path
+from typing import Sequence, Tuple, MutableSequence, Callable, MutableMapping, Union, Any
 
 import jsonschema
 import pytest
 import yaml
+from google.auth.credentials import AnonymousCredentials
+from google_auth_httplib2 import AuthorizedHttp
 
+import external_services
 import util
 from dresources import DResource
-from external_services import ExternalServices
+from external_services import ExternalServices, DiscoveryCache, DISCOVERY_CACHE_VERSION, OperationPoller
 from manifest import Resource
 from mock_external_services import MockExternalServices
 
@@ -124,3 +129,262 @@ def test_resources(capsys, description: str, mock: dict, resource: dict, expecte
                                 resource=resource,
                                 include_config=True,
                                 extra_data=extra_data).execute(args)
+
+
+def test_discovery_cache(monkeypatch, tmpdir):
+    cache: DiscoveryCache = DiscoveryCache(Path(str(tmpdir)))
+    url: str = 'https://www.googleapis.com/discovery/v1/apis/compute/v1/rest'
+    assert cache.get(url) is None
+    cache.set(url, b'{"name": "compute"}')
+    assert cache.get(url) == '{"name": "compute"}'
+    assert cache.path.name == f"v{DISCOVERY_CACHE_VERSION}"
+    assert DiscoveryCache(Path(str(tmpdir))).get(url) == '{"name": "compute"}'
+
+    # caches that cannot be written to are simply not updated
+    read_only: DiscoveryCache = DiscoveryCache(Path(str(tmpdir)) / 'v1' / os.listdir(str(cache.path))[0])
+    read_only.set(url, '{}')
+    assert read_only.get(url) is None
+
+    # API clients are built using the cache (once per service & version), resolved when used rather than when the
+    # services are created (eg. by a module imported before the resource's environment is applied)
+    builds: MutableSequence[dict] = []
+    monkeypatch.delenv('DEPLOYSTER_DISCOVERY_CACHE', raising=False)
+    monkeypatch.setattr(external_services, 'build', lambda **kwargs: builds.append(kwargs) or object())
+    svc: ExternalServices = ExternalServices()
+    monkeypatch.setenv('DEPLOYSTER_DISCOVERY_CACHE', str(tmpdir))
+    assert svc._get_gcp_service('compute', 'v1') is svc._get_gcp_service('compute', 'v1')
+    assert [(b['serviceName'], b['version'], b['cache'].path) for b in builds] == [('compute', 'v1', cache.path)]
+
+
+def test_operation_poller():
+    now: MutableSequence[float] = [0]
+    sleeps: MutableSequence[float] = []
+
+    def sleep(seconds: float) -> None:
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    poller: OperationPoller = OperationPoller(initial_interval=1, max_interval=4, jitter=0,
+                                              clock=lambda: now[0], sleep=sleep)
+
+    # done operations are returned immediately, without sleeping
+    assert poller.poll(fetch=lambda: {'status': 'DONE'}, description='op') == {'status': 'DONE'}
+    assert sleeps == []
+
+    # pending operations are checked at exponentially growing intervals, up to the maximum interval
+    results = iter([{'done': False}] * 5 + [{'done': True, 'response': {}}])
+    assert poller.poll(fetch=lambda: next(results), description='op') == {'done': True, 'response': {}}
+    assert sleeps == [1, 2, 4, 4, 4]
+
+    # waiting stops at the timeout (the last sleep is shortened to it)
+    sleeps.clear()
+    with pytest.raises(Exception, match='Timed out waiting for op'):
+        poller.poll(fetch=lambda: {'status': 'RUNNING'}, description='op', timeout=10)
+    assert sleeps == [1, 2, 4, 3]
+
+    # jitter randomizes each interval within its bounds
+    sleeps.clear()
+    jittery: OperationPoller = OperationPoller(initial_interval=10, max_interval=10, jitter=0.2,
+                                               clock=lambda: now[0], sleep=sleep)
+    results = iter([{'done': False}] * 20 + [{'done': True}])
+    jittery.poll(fetch=lambda: next(results), description='op')
+    assert all(8 <= s <= 12 for s in sleeps) and len(set(sleeps)) > 1
+
+
+def test_compute_operation_waits(monkeypatch):
+    calls: MutableSequence[Tuple[str, dict]] = []
+
+    class Request:
+        def __init__(self, method: str, kwargs: dict) -> None:
+            self._method = method
+            self._kwargs = kwargs
+            self.http = None
+
+        def execute(self, http: Any = None) -> dict:
+            calls.append((self._method, self._kwargs))
+            return {'status': 'DONE' if len(calls) > 1 else 'RUNNING'}
+
+    class WaitingOperations:
+        def wait(self, **kwargs) -> Request:
+            return Request('wait', kwargs)
+
+    class PollingOperations:
+        def get(self, **kwargs) -> Request:
+            return Request('get', kwargs)
+
+    class Compute:
+        def regionOperations(self) -> WaitingOperations:
+            return WaitingOperations()
+
+        def globalOperations(self) -> PollingOperations:
+            return PollingOperations()
+
+    svc: ExternalServices = ExternalServices()
+    svc.pollers['compute'] = OperationPoller(initial_interval=0, max_interval=0)
+    monkeypatch.setattr(svc, '_get_gcp_service', lambda name, version: Compute())
+
+    # server-side waits are used when available, and polling is used otherwise
+    assert svc.wait_for_gcp_compute_regional_operation('p', 'r', {'name': 'op1'}) == {'status': 'DONE'}
+    assert calls == [('wait', {'project': 'p', 'region': 'r', 'operation': 'op1'})] * 2
+    calls.clear()
+    assert svc.wait_for_gcp_compute_global_operation('p', {'name': 'op2'}) == {'status': 'DONE'}
+    assert calls == [('get', {'project': 'p', 'operation': 'op2'})] * 2
+
+
+def test_compute_operation_waits_until_deadline(monkeypatch):
+    now: MutableSequence[float] = [0]
+    timeouts: MutableSequence[float] = []
+    waits: MutableSequence[float] = [100, 100, 100]
+
+    class Request:
+        def __init__(self) -> None:
+            self.http = AuthorizedHttp(AnonymousCredentials())
+
+        def execute(self, http: Any = None) -> dict:
+            # the server blocks until the operation is done, or until the request times out
+            timeouts.append(http.http.timeout)
+            wait: float = waits.pop(0)
+            now[0] += min(wait, http.http.timeout)
+            if wait > http.http.timeout:
+                raise socket.timeout('timed out')
+            return {'status': 'DONE' if not waits else 'RUNNING'}
+
+    class Operations:
+        def wait(self, **kwargs) -> Request:
+            return Request()
+
+    class Compute:
+        def regionOperations(self) -> Operations:
+            return Operations()
+
+    svc: ExternalServices = ExternalServices()
+    svc.pollers['compute-wait'] = OperationPoller(initial_interval=0, max_interval=0, clock=lambda: now[0])
+    monkeypatch.setattr(svc, '_get_gcp_service', lambda name, version: Compute())
+
+    # each wait request times out no later than the deadline
+    assert svc.wait_for_gcp_compute_regional_operation('p', 'r', {'name': 'op1'}, timeout=300) == {'status': 'DONE'}
+    assert timeouts == [300, 200, 100]
+
+    # waits cut short by the deadline fail the operation (as timed out)
+    now[0] = 0
+    timeouts.clear()
+    waits.extend([100, 120])
+    with pytest.raises(Exception, match='Timed out waiting for Google Compute regional operation'):
+        svc.wait_for_gcp_compute_regional_operation('p', 'r', {'name': 'op1'}, timeout=150)
+    assert timeouts == [150, 50] and now[0] == 150
+
+
+def test_service_usage_operations_waits(monkeypatch):
+    batches: MutableSequence[Sequence[dict]] = []
+    operations: MutableMapping[str, MutableSequence[Union[dict, Exception]]] = {
+        'op1': [Exception('throttled'), {'name': 'op1', 'done': True, 'response': {'api': 1}}],
+        'op2': [{'name': 'op2'}, {'name': 'op2'}, {'name': 'op2', 'done': True, 'error': {'code': 7}}],
+        'op3': [{'name': 'op3', 'done': True, 'response': {'api': 3}}],
+        'op4': [Exception('unavailable')] * 3
+    }
+
+    class Batch:
+        def __init__(self, callback) -> None:
+            self._callback = callback
+            self._requests: MutableSequence[Tuple[str, dict]] = []
+
+        def add(self, request: dict, request_id: str) -> None:
+            self._requests.append((request_id, request))
+
+        def execute(self) -> None:
+            batches.append([request for request_id, request in self._requests])
+            for request_id, request in self._requests:
+                result: Union[dict, Exception] = operations[request['name']].pop(0)
+                if isinstance(result, Exception):
+                    self._callback(request_id, None, result)
+                else:
+                    self._callback(request_id, result, None)
+
+    class Operations:
+        def get(self, name: str) -> dict:
+            return {'name': name}
+
+    class ServiceUsage:
+        def operations(self) -> Operations:
+            return Operations()
+
+        def new_batch_http_request(self, callback) -> Batch:
+            return Batch(callback)
+
+    now: MutableSequence[float] = [0]
+
+    def sleep(seconds: float) -> None:
+        now[0] += seconds
+
+    svc: ExternalServices = ExternalServices()
+    svc.pollers['serviceusage'] = OperationPoller(initial_interval=1, max_interval=1, jitter=0,
+                                                   clock=lambda: now[0], sleep=sleep)
+    monkeypatch.setattr(svc, '_get_gcp_service', lambda name, version: ServiceUsage())
+
+    # pending operations are polled together (one batch request per check), until all are done; failing to fetch an
+    # operation does not fail it (it's fetched again on the next check)
+    assert svc.wait_for_gcp_service_usage_operations([{'name': 'op1'}, {'name': 'op3'}]) == [{'api': 1}, {'api': 3}]
+    assert batches == [[{'name': 'op1'}, {'name': 'op3'}], [{'name': 'op1'}]]
+
+    # errors are reported per operation, once all operations are done (submission failures are final)
+    batches.clear()
+    with pytest.raises(Exception) as e:
+        svc.wait_for_gcp_service_usage_operations([{'name': 'op2'}, Exception('quota exceeded'),
+                                                   {'response': {'api': 5}}])
+    assert 'op2: {"code": 7}' in str(e.value)
+    assert 'operation: quota exceeded' in str(e.value)
+    assert batches == [[{'name': 'op2'}], [{'name': 'op2'}], [{'name': 'op2'}]]
+
+    # operations that cannot be fetched time out
+    with pytest.raises(Exception, match='Timed out waiting for Google Service Usage operations') as e:
+        svc.wait_for_gcp_service_usage_operations([{'name': 'op4'}], timeout=2)
+    assert 'unavailable' in str(e.value)
+
+
+def test_enable_gcp_project_apis(monkeypatch):
+    batches: MutableSequence[Sequence[dict]] = []
+
+    class Batch:
+        def __init__(self, callback) -> None:
+            self._callback = callback
+            self._requests: MutableSequence[Tuple[str, dict]] = []
+
+        def add(self, request: dict, request_id: str) -> None:
+            self._requests.append((request_id, request))
+
+        def execute(self) -> None:
+            batches.append([request for request_id, request in self._requests])
+            for request_id, request in self._requests:
+                self._callback(request_id, {'name': f"op{request_id}", 'done': True, 'response': {}}, None)
+
+    class Services:
+        def batchEnable(self, parent: str, body: dict) -> dict:
+            return {'parent': parent, 'serviceIds': body['serviceIds']}
+
+        def disable(self, name: str, body: dict) -> dict:
+            return {'name': name}
+
+    class ServiceUsage:
+        def services(self) -> Services:
+            return Services()
+
+        def operations(self) -> None:
+            return None
+
+        def new_batch_http_request(self, callback) -> Batch:
+            return Batch(callback)
+
+    svc: ExternalServices = ExternalServices()
+    monkeypatch.setattr(svc, '_get_gcp_service', lambda name, version: ServiceUsage())
+
+    # APIs are enabled in chunks of 20 per "batchEnable" call, all submitted in a single batch HTTP request
+    apis: Sequence[str] = [f"api{i}" for i in range(45)]
+    svc.enable_gcp_project_apis(project_id='prj', apis=apis)
+    assert batches == [[{'parent': 'projects/prj', 'serviceIds': apis[0:20]},
+                        {'parent': 'projects/prj', 'serviceIds': apis[20:40]},
+                        {'parent': 'projects/prj', 'serviceIds': apis[40:45]}]]
+
+    # APIs are disabled concurrently, in a single batch HTTP request
+    batches.clear()
+    svc.disable_gcp_project_apis(project_id='prj', apis=['api1', 'api2'])
+    assert batches == [[{'name': 'projects/prj/services/api1'}, {'name': 'projects/prj/services/api2'}]]
@@ -0,0 +1,58 @@
+import json
+import threading
+import time
+from pathlib import Path
+
+from timing import Timings, Span
+
+
+def test_spans():
+    Timings.reset()
+    with Timings.span('outer', 'c1', resource='r1', k='v') as outer:
+        time.sleep(0.05)
+        with Timings.span('inner', 'c2') as inner:
+            time.sleep(0.05)
+        Timings.record('recorded', 'c2', start=1.0, end=1.5)
+        assert Timings.current() is outer
+    assert Timings.current() is None
+
+    assert [span.name for span in Timings.spans()] == ['outer', 'inner', 'recorded']
+    assert inner.parent is outer and inner.resource == 'r1'
+    assert outer.attributes == {'k': 'v'}
+    assert outer.duration >= inner.duration + 0.05
+    assert Timings.spans()[2].duration == 0.5
+
+    # nesting is tracked per thread
+    def worker():
+        with Timings.span('worker', 'c1'):
+            pass
+
+    with Timings.span('main', 'c1'):
+        thread = threading.Thread(target=worker, name='w1')
+        thread.start()
+        thread.join()
+    worker_span: Span = [span for span in Timings.spans() if span.name == 'worker'][0]
+    assert worker_span.parent is None and worker_span.thread == 'w1'
+
+
+def test_summary_and_report(capsys):
+    Timings.reset()
+    for duration in [0.1, 0.3]:
+        Timings.record('a', 'c', start=0, end=duration)
+    Timings.record('b', 'c', start=0, end=1)
+
+    summary = Timings.summary()
+    assert [(row['name'], row['count']) for row in summary] == [('b', 1), ('a', 2)]
+    assert abs(summary[1]['total'] - 0.4) < 1e-9 and abs(summary[1]['max'] - 0.3) < 1e-9
+
+    Timings.display()
+    assert capsys.readouterr().out.find('c: b') >= 0
+
+    path: Path = Path('./tests/.cache/timing/timings.json')
+    Timings.write_report(path, run_id='run1')
+    with open(path, 'r') as f:
+        report: dict = json.loads(f.read())
+    assert report['run_id'] == 'run1'
+    assert report['duration'] == 1
+    assert len(report['spans']) == 3
+    assert report['summary'][0]['name'] == 'b'
@@ -0,0 +1,25 @@
+from timing import Timings
+from tracing import trace_events
+
+
+def test_trace_events():
+    Timings.reset()
+    Timings.record('resolve', 'resource', start=10.0, end=11.0, resource='r1')
+    Timings.record('resolve', 'resource', start=11.5, end=12.0, resource='r2')
+    Timings.record('parse', 'manifest', start=9.5, end=10.0, file='/m.yaml')
+    events = trace_events(Timings.spans(), dependencies={'r1': [], 'r2': ['r1']})
+
+    threads = [e for e in events if e['ph'] == 'M' and e['name'] == 'thread_name']
+    assert [t['args']['name'] for t in threads] == ['MainThread']
+
+    spans = {e['name']: e for e in events if e['ph'] == 'X'}
+    assert spans['r1: resolve']['ts'] == 500000 and spans['r1: resolve']['dur'] == 1000000
+    assert spans['r2: resolve']['args'] == {'resource': 'r2'}
+    assert spans['parse']['ts'] == 0 and spans['parse']['args'] == {'file': '/m.yaml'}
+
+    # dependency edge from the end of r1 to the start of r2
+    flows = [e for e in events if e['ph'] in ['s', 'f']]
+    assert [(e['ph'], e['ts']) for e in flows] == [('s', 1499999), ('f', 2000000)]
+    assert flows[0]['id'] == flows[1]['id']
+
+    assert trace_events([]) == []
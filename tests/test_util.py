@@ -1,7 +1,11 @@
+import json
+
 import pytest
 from colors import yellow, red
+from jsonschema import ValidationError, SchemaError
 
-from util import UserError, Logger, merge_into, merge, post_process
+from util import UserError, Logger, merge_into, merge, post_process, post_process_cache_info, \
+    analyze_templates, create_validator, cached_validator, validate
 
 
 def test_new_usererror():
@@ -172,3 +176,52 @@ def test_post_processing():
 
     with pytest.raises(expected_exception=UserError, match=r'\' unknown_var \' yielded an undefined result'):
         post_process('{{ unknown_var }}', {})
+
+
+def test_post_processing_caches_compiled_templates():
+    src = {'k1': '{{ c1 * 10 }}', 'k2': 'hello, {{ name }}!', 'k3': 'plain'}
+    before: dict = post_process_cache_info()
+    assert post_process(value=src, context={'c1': 1, 'name': 'John'}) == {'k1': 10, 'k2': 'hello, John!', 'k3': 'plain'}
+    assert post_process(value=src, context={'c1': 2, 'name': 'Jane'}) == {'k1': 20, 'k2': 'hello, Jane!', 'k3': 'plain'}
+    after: dict = post_process_cache_info()
+    assert after['hits'] - before['hits'] >= 2
+    assert after['misses'] - before['misses'] <= 2
+    assert 0 < after['hit_rate'] <= 1
+
+
+def test_post_processing_reuses_untemplated_subtrees():
+    src = {
+        'static': {'a': [1, 2, {'b': 'c'}], 'd': 'e'},
+        'mixed': {'a': 'x', 'b': ['y', '{{ c1 }}'], 'c': {'d': 'z'}},
+        'k': 'hello, {{ name }}!'
+    }
+    plan = analyze_templates(src)
+    assert plan == {'mixed': {'b': {1: True}}, 'k': True}
+    assert analyze_templates({'a': ['b', {'c': 1}]}) is None
+
+    result = post_process(value=src, context={'c1': 1, 'name': 'John'}, plan=plan)
+    assert result == {
+        'static': {'a': [1, 2, {'b': 'c'}], 'd': 'e'},
+        'mixed': {'a': 'x', 'b': ['y', 1], 'c': {'d': 'z'}},
+        'k': 'hello, John!'
+    }
+
+    # untemplated subtrees are shared, templated paths are copied (leaving the source intact)
+    assert result['static'] is src['static']
+    assert result['mixed']['c'] is src['mixed']['c']
+    assert result['mixed'] is not src['mixed']
+    assert src['mixed']['b'] == ['y', '{{ c1 }}']
+
+
+def test_cached_validators():
+    schema: dict = {'type': 'object', 'properties': {'a': {'type': 'integer'}, 'b': {'type': 'string'}}}
+    validator = cached_validator(schema)
+    assert cached_validator(json.loads(json.dumps(schema))) is validator
+    assert cached_validator({'type': 'string'}) is not validator
+
+    validate(validator, {'a': 1, 'b': 'c'})
+    with pytest.raises(ValidationError, match="'x' is not of type 'integer'"):
+        validate(validator, {'a': 'x', 'b': 2})
+
+    with pytest.raises(SchemaError):
+        create_validator({'type': 'no-such-type'})
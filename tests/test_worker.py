@@ -0,0 +1,144 @@
+import io
+import json
+import sys
+from pathlib import Path
+from typing import Sequence, Mapping
+
+import pytest
+
+import dresources
+from docker import DockerInvoker
+from dresources import DResource, DAction, action, serve
+from util import Logger, UserError
+from worker import WorkerPool
+
+WORKER_SCRIPT = """
+import os, sys
+from dresources import DResource, action, resource_main
+
+class EchoResource(DResource):
+
+    def __init__(self, data: dict) -> None:
+        super().__init__(data=data, svc=None)
+
+    def discover_state(self):
+        return {'pid': os.getpid(), 'config': self.info.config}
+
+    def get_actions_for_missing_state(self):
+        return []
+
+    def get_actions_for_discovered_state(self, state: dict):
+        return []
+
+    @action
+    def fail(self, args) -> None:
+        print('failing...', file=sys.stderr)
+        raise Exception('failed!')
+
+resource_main(EchoResource)
+"""
+
+
+class ScriptDockerInvoker(DockerInvoker):
+    """Runs the worker script above in a local process instead of a Docker container ("init" is its default command)."""
+
+    def inspect_image_id(self, image: str) -> None:
+        return None
+
+    def _command(self, container_work_dir: str, image: str, entrypoint: str = None,
+                 args: Sequence[str] = None, labels: Mapping[str, str] = None) -> Sequence[str]:
+        path: str = str(Path(dresources.__file__).parent.absolute())
+        script: str = f"import sys; sys.path.insert(0, {path!r})\n{WORKER_SCRIPT}"
+        return [sys.executable, '-c', script] + list(args or ['init'])
+
+
+class EchoResource(DResource):
+
+    def __init__(self, data: dict) -> None:
+        super().__init__(data=data, svc=None)
+
+    def discover_state(self):
+        return self.info.config
+
+    def get_actions_for_missing_state(self) -> Sequence[DAction]:
+        return []
+
+    def get_actions_for_discovered_state(self, state: dict) -> Sequence[DAction]:
+        return []
+
+    @action
+    def fail(self, args) -> None:
+        print('partial line', end='')
+        raise Exception('failed!')
+
+
+def test_serve():
+    data: dict = {'name': 'r1', 'type': 'img', 'version': '1', 'verbose': False, 'workspace': '/', 'config': {'k': 1}}
+    requests: Sequence[dict] = [
+        {'jsonrpc': '2.0', 'id': 1, 'method': 'state', 'params': {'input': data}},
+        {'jsonrpc': '2.0', 'id': 2, 'method': 'fail', 'params': {'input': data, 'args': []}},
+        {'jsonrpc': '2.0', 'id': 3, 'method': 'unknown', 'params': {'input': data}},
+        {'jsonrpc': '2.0', 'id': 4, 'method': 'batch_state', 'params': {'input': [data, dict(data, config={'k': 2})]}},
+        {'jsonrpc': '2.0', 'id': 5}
+    ]
+    output: io.StringIO = io.StringIO()
+    serve(EchoResource, input=io.StringIO(''.join(json.dumps(r) + '\n' for r in requests)), output=output)
+    messages: Sequence[dict] = [json.loads(line) for line in output.getvalue().splitlines()]
+
+    def lines(request_id: int, stream: str) -> str:
+        return '\n'.join(m['params']['line'] for m in messages
+                         if 'id' not in m and m['params']['id'] == request_id and m['params']['stream'] == stream)
+
+    def exit_code(request_id: int) -> int:
+        return [m['result']['exit_code'] for m in messages if m.get('id') == request_id][0]
+
+    # action output is streamed as notifications, followed by the response
+    assert json.loads(lines(1, 'stdout')) == {'status': 'VALID', 'state': {'k': 1}}
+    assert exit_code(1) == 0
+
+    # failures are reported as exit codes (partial lines are flushed), and the worker keeps serving
+    assert lines(2, 'stdout') == 'partial line'
+    assert 'Exception: failed!' in lines(2, 'stderr')
+    assert exit_code(2) == 1
+    assert exit_code(3) == 2
+
+    # batch state requests provide an array of resource data, and respond with an array of state results
+    assert [r['state'] for r in json.loads(lines(4, 'stdout'))] == [{'k': 1}, {'k': 2}]
+    assert exit_code(4) == 0
+
+    # malformed requests are rejected
+    assert messages[-1]['id'] is None and messages[-1]['error']['code'] == -32600
+
+
+def test_worker_invocations():
+    work_dir: Path = Path('./tests/.cache/worker')
+    data: dict = {'name': 'r1', 'type': 'img', 'version': '1', 'verbose': False, 'workspace': '/', 'config': {'k': 1}}
+    pool: WorkerPool = WorkerPool()
+    invoker: ScriptDockerInvoker = ScriptDockerInvoker(workers=pool)
+
+    def invoke(args: Sequence[str] = None) -> dict:
+        return invoker.run_json(logger=Logger(), local_work_dir=work_dir, container_work_dir='/', image='img',
+                                args=args, input=data)
+
+    try:
+        # images advertise worker support in their "init" result; until then, invocations are one-shot
+        assert invoke()['worker_action'] == {'args': ['serve']}
+        assert invoke()['batch_state_action'] == {'args': ['batch_state']}
+        assert invoke(['state'])['state']['pid'] != invoke(['state'])['state']['pid']
+        assert pool.workers == []
+
+        # once declared, invocations are served by a single warm worker
+        invoker.set_worker_action(image='img', args=['serve'])
+        pids: Sequence[int] = [invoke(['state'])['state']['pid'] for i in range(3)]
+        assert len(set(pids)) == 1
+        assert invoke(['state'])['state']['config'] == {'k': 1}
+        assert len(pool.workers) == 1
+
+        # failed actions do not kill the worker
+        with pytest.raises(UserError, match='exit code #1'):
+            invoke(['fail'])
+        assert invoke(['state'])['state']['pid'] == pids[0]
+        assert len(pool.workers) == 1
+    finally:
+        pool.close()
+    assert pool.workers == []